@@ -0,0 +1,127 @@
+"""Benchmark the bucket-fill engine against the original BFS implementation.
+
+Runs both in headless Chromium on a blank layer with a painted ring and
+fills the (large) outside region, timing the whole fill including the
+canvas read and write-back.  Usage::
+
+    python benchmarks/flood_fill.py [--repeat N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+from pathlib import Path
+
+from playwright.sync_api import sync_playwright
+
+_SCRIPT = Path(__file__).resolve().parents[1] / "src" / "trimap_editor" / "static" / "script.js"
+
+SIZES = {"1 MP": (1000, 1000), "12 MP": (4000, 3000), "24 MP": (6000, 4000)}
+
+# floodFillAt() as it was before the scanline engine (queue.shift() BFS,
+# per-pixel neighbour arrays, full-canvas putImageData).
+_LEGACY_FILL = """
+function legacyFill(ctx, w, h, px, py) {
+    var imgData = ctx.getImageData(0, 0, w, h);
+    var data = imgData.data;
+    var visited = new Uint8Array(w * h);
+    var queue = [py * w + px];
+    visited[py * w + px] = 1;
+    var filled = [py * w + px];
+    while (queue.length > 0) {
+        var idx = queue.shift();
+        var cx = idx % w;
+        var cy = (idx - cx) / w;
+        var neighbors = [];
+        if (cx > 0)     neighbors.push(idx - 1);
+        if (cx < w - 1) neighbors.push(idx + 1);
+        if (cy > 0)     neighbors.push(idx - w);
+        if (cy < h - 1) neighbors.push(idx + w);
+        for (var i = 0; i < neighbors.length; i++) {
+            var ni = neighbors[i];
+            if (visited[ni]) continue;
+            visited[ni] = 1;
+            if (data[ni * 4 + 3] > 127) continue;
+            queue.push(ni);
+            filled.push(ni);
+        }
+    }
+    for (var j = 0; j < filled.length; j++) {
+        var fi = filled[j] * 4;
+        data[fi] = 255; data[fi + 1] = 255; data[fi + 2] = 255; data[fi + 3] = 255;
+    }
+    ctx.putImageData(imgData, 0, 0);
+}
+"""
+
+_SCANLINE_FILL = """
+function scanlineFillAt(ctx, w, h, px, py) {
+    var imgData = ctx.getImageData(0, 0, w, h);
+    var job = {stack: [py * w + px], x0: px, y0: py, x1: px, y1: py};
+    scanlineFill(job, imgData.data, 4, 128, 255, w, h, Infinity);
+    ctx.putImageData(imgData, 0, 0, job.x0, job.y0, job.x1 - job.x0 + 1, job.y1 - job.y0 + 1);
+}
+"""
+
+_RUN = """
+([w, h, which, repeat]) => {
+    var best = Infinity;
+    for (var k = 0; k < repeat; k++) {
+        var c = document.createElement("canvas");
+        c.width = w; c.height = h;
+        var ctx = c.getContext("2d", {willReadFrequently: true});
+        ctx.strokeStyle = "#fff";
+        ctx.lineWidth = 20;
+        ctx.beginPath();
+        ctx.arc(w / 2, h / 2, Math.min(w, h) * 0.3, 0, Math.PI * 2);
+        ctx.stroke();
+        var t0 = performance.now();
+        (which === "legacy" ? legacyFill : scanlineFillAt)(ctx, w, h, 0, 0);
+        ctx.getImageData(0, 0, 1, 1);  // wait for the write-back
+        best = Math.min(best, performance.now() - t0);
+    }
+    return best;
+}
+"""
+
+
+def extract_function(source: str, name: str) -> str:
+    """Return the source text of a top-level ``function name(...) {...}`` in script.js."""
+    match = re.search(rf"function {name}\(", source)
+    if match is None:
+        msg = f"function {name} not found"
+        raise ValueError(msg)
+    depth = 0
+    for i in range(source.index("{", match.end()), len(source)):
+        if source[i] == "{":
+            depth += 1
+        elif source[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return source[match.start() : i + 1]
+    msg = f"unbalanced braces in {name}"
+    raise ValueError(msg)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the best is reported")
+    args = parser.parse_args()
+
+    kernel = extract_function(_SCRIPT.read_text(encoding="utf-8"), "scanlineFill")
+    with sync_playwright() as p:
+        browser = p.chromium.launch()
+        page = browser.new_page()
+        page.add_script_tag(content=kernel + _LEGACY_FILL + _SCANLINE_FILL)
+        print("| size  | BFS (ms) | scanline (ms) | speedup |")  # noqa: T201
+        print("|-------|---------:|--------------:|--------:|")  # noqa: T201
+        for label, (w, h) in SIZES.items():
+            legacy = page.evaluate(_RUN, [w, h, "legacy", args.repeat])
+            scanline = page.evaluate(_RUN, [w, h, "scanline", args.repeat])
+            print(f"| {label:<5} | {legacy:8.0f} | {scanline:13.0f} | {legacy / scanline:6.1f}x |")  # noqa: T201
+        browser.close()
+
+
+if __name__ == "__main__":
+    main()
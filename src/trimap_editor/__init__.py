@@ -3,15 +3,22 @@ from __future__ import annotations
 import html
 import json
 from pathlib import Path
-from typing import Any
+from typing import Any, Literal
 
 import gradio as gr
 from gradio import processing_utils
 from PIL import Image
 
+from trimap_editor.codec import decode_rle, decode_trimap, trimap_hash, trimap_stats
+from trimap_editor.strokes import rasterize_strokes
+
 _STATIC_DIR = Path(__file__).parent / "static"
 
-__all__ = ["TrimapEditor"]
+__all__ = ["TrimapEditor", "decode_rle", "decode_trimap", "rasterize_strokes", "trimap_hash", "trimap_stats"]
+
+_VALUE_FORMATS = ("png", "rle", "strokes")
+_TYPES = ("str", "dict")
+_COMMIT_MODES = ("eager", "lazy")
 
 
 def _load_image(value: Any) -> Image.Image:
@@ -49,6 +56,45 @@ class TrimapEditor(gr.HTML):
       255 → foreground (definitely foreground)
 
     The foreground region is always kept as a subset of the unknown region.
+
+    ``value_format`` selects what the editor commits back to Python:
+    ``"png"`` sends the trimap as a base64 PNG (``trimapBase64``);
+    ``"rle"`` sends a run-length encoded single-channel stream
+    (``trimapRLE``) that :func:`decode_rle` unpacks without PIL;
+    ``"strokes"`` sends an ordered operation log (``strokes``) that
+    :func:`rasterize_strokes` replays into the same trimap.
+    :func:`decode_trimap` handles all three.
+
+    Every committed value also carries ``stats``: per-class pixel counts,
+    the unknown and foreground bounding boxes and a content hash (see
+    :func:`trimap_stats`), so servers can skip empty trimaps, crop to the
+    unknown region or key caches without decoding the trimap.
+
+    ``commit_mode`` controls when the committed value reaches Gradio:
+    ``"eager"`` writes it after every edit (in idle time); ``"lazy"`` keeps
+    it in the browser and writes it only just before another component's
+    event can read it (pointer or key press outside the editor, focus
+    leaving the editor, page hidden), so drawing never triggers Gradio's
+    prop-update cycle.  Events not caused by user input, such as timers,
+    may then see a value that lags behind the latest stroke.
+
+    ``type`` selects what event handlers receive: ``"str"`` passes the raw
+    JSON string, ``"dict"`` passes it already parsed.
+
+    With ``autosave`` (the default) the browser checkpoints the masks and
+    undo history to IndexedDB, keyed by the image content, and restores
+    them when the same image is opened again without a trimap.  Older undo
+    steps live only in IndexedDB, keeping long sessions' memory bounded.
+
+    A trimap or alpha-matte file dropped onto the loaded image (or opened
+    with the Load button) replaces the masks without a server round-trip.
+    Mattes are split into three classes by ``matte_band = (lo, hi)``:
+    alpha ``<= lo`` is background, ``>= hi`` foreground, the rest unknown.
+
+    ``profile=True`` times the editor's hot paths in the browser (frame
+    render, stamping, fills, undo snapshots, encoding, stroke latency),
+    shows them with the memory in use in an overlay, and adds a
+    ``profile`` summary to every committed value.
     """
 
     def __init__(
@@ -59,8 +105,28 @@ class TrimapEditor(gr.HTML):
         canvas_height: int = 500,
         default_fg_color: str = "#00c853",
         default_unknown_color: str = "#2196F3",
+        value_format: Literal["png", "rle", "strokes"] = "png",
+        commit_mode: Literal["eager", "lazy"] = "eager",
+        type: Literal["str", "dict"] = "str",  # noqa: A002 — matches Gradio's preprocess-type convention
+        autosave: bool = True,
+        matte_band: tuple[int, int] = (16, 240),
+        profile: bool = False,
         **kwargs: Any,
     ) -> None:
+        if value_format not in _VALUE_FORMATS:
+            msg = f"Unsupported value_format: {value_format!r}"
+            raise ValueError(msg)
+        if commit_mode not in _COMMIT_MODES:
+            msg = f"Unsupported commit_mode: {commit_mode!r}"
+            raise ValueError(msg)
+        if type not in _TYPES:
+            msg = f"Unsupported type: {type!r}"
+            raise ValueError(msg)
+        lo, hi = matte_band
+        if not 0 <= lo < hi <= 255:  # noqa: PLR2004 — 8-bit alpha range
+            msg = f"matte_band must satisfy 0 <= lo < hi <= 255, got {matte_band!r}"
+            raise ValueError(msg)
+        self.type = type
         html_template = (_STATIC_DIR / "template.html").read_text(encoding="utf-8")
         css_template = (_STATIC_DIR / "style.css").read_text(encoding="utf-8")
         js_on_load = (_STATIC_DIR / "script.js").read_text(encoding="utf-8")
@@ -77,9 +143,19 @@ class TrimapEditor(gr.HTML):
             canvas_height=canvas_height,
             default_fg_color=default_fg_color,
             default_unknown_color=default_unknown_color,
+            value_format=value_format,
+            commit_mode=commit_mode,
+            autosave=autosave,
+            matte_band=[lo, hi],
+            profile=profile,
             **kwargs,
         )
 
+    def preprocess(self, payload: str | None) -> str | dict[str, Any] | None:
+        if self.type == "dict":
+            return json.loads(payload) if payload else None
+        return payload
+
     def postprocess(self, value: Any) -> str | None:
         if value is None:
             return None
@@ -154,6 +230,17 @@ class TrimapEditor(gr.HTML):
                 "Pass a (image, trimap) tuple to postprocess() to include a trimap. "
                 "Output (JS→Python): {image: string (URL), width: int, height: int, "
                 "trimapBase64: string (data URI 'data:image/png;base64,...')}. "
-                "trimapBase64 is absent when no trimap has been drawn yet."
+                "trimapBase64 is absent when no trimap has been drawn yet. "
+                "stats: {counts: {background, unknown, foreground: int}, "
+                "unknownBBox, foregroundBBox: [x0, y0, x1, y1] | null (exclusive ends), "
+                "hash: string (8 hex digits, see trimap_editor.trimap_hash)} accompanies the trimap. "
+                "With value_format='rle', trimapBase64 is replaced by "
+                "trimapRLE: string (base64 LEB128 runs of length*4+class, see trimap_editor.decode_rle). "
+                "With value_format='strokes', trimapBase64 is replaced by "
+                "strokes: {version: 1, ops: [...]} (see trimap_editor.rasterize_strokes). "
+                "trimap_editor.decode_trimap() decodes any of the three. "
+                "With profile=True the output also has profile: {timings: {name: "
+                "{count, meanMs, p95Ms, maxMs}}, memory: {historyBytes, labelBytes, "
+                "canvasBytes}, device: {...}}."
             ),
         }
@@ -0,0 +1,160 @@
+"""Decoders for the trimap payloads the editor commits.
+
+``value_format="rle"`` sends the trimap as ``trimapRLE``: a base64 string of
+LEB128 varints, one per run in row-major order, each holding
+``run_length * 4 + class`` with class 0 (background), 1 (unknown) or
+2 (foreground).  A typical trimap is a few hundred runs, so the payload is
+tiny and decodes with a handful of vectorised NumPy operations.
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+from io import BytesIO
+from typing import Any
+
+import numpy as np
+from PIL import Image
+
+from trimap_editor.strokes import rasterize_strokes
+
+__all__ = ["decode_rle", "decode_trimap", "trimap_hash", "trimap_stats"]
+
+# Class index → trimap value
+_CLASS_VALUES = np.array([0, 128, 255], dtype=np.uint8)
+_NUM_CLASSES = 3
+
+# FNV-1a 32-bit, as in createTrimapStats() / fnv1aWord() in script.js
+_FNV_OFFSET = 0x811C9DC5
+_FNV_PRIME = 0x01000193
+_U32 = 0xFFFFFFFF
+
+
+def decode_rle(data: str | bytes, width: int, height: int) -> np.ndarray:
+    """Decode a ``trimapRLE`` payload into a trimap.
+
+    Args:
+        data: Base64 string (as committed by the editor) or raw bytes.
+        width: Trimap width in pixels.
+        height: Trimap height in pixels.
+
+    Returns:
+        A ``(height, width)`` uint8 array with values 0, 128 and 255.
+
+    Raises:
+        ValueError: If the stream is truncated, has an invalid class, or
+            its runs do not cover exactly ``width * height`` pixels.
+    """
+    raw = base64.b64decode(data) if isinstance(data, str) else data
+    buf = np.frombuffer(raw, dtype=np.uint8)
+    if buf.size == 0 or buf[-1] >= 0x80:  # noqa: PLR2004 — varint continuation bit
+        msg = "Truncated RLE stream"
+        raise ValueError(msg)
+
+    # Each varint ends at a byte without the continuation bit.
+    ends = np.flatnonzero(buf < 0x80)  # noqa: PLR2004
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    group = np.repeat(np.arange(ends.size), ends - starts + 1)
+    shift = (7 * (np.arange(buf.size) - starts[group])).astype(np.uint64)
+    values = np.add.reduceat((buf & 0x7F).astype(np.uint64) << shift, starts)
+
+    classes = (values & np.uint64(3)).astype(np.intp)
+    lengths = (values >> np.uint64(2)).astype(np.int64)
+    if classes.size and classes.max() >= _NUM_CLASSES:
+        msg = "Invalid class in RLE stream"
+        raise ValueError(msg)
+    if int(lengths.sum()) != width * height:
+        msg = f"RLE runs cover {int(lengths.sum())} pixels, expected {width * height}"
+        raise ValueError(msg)
+    return np.repeat(_CLASS_VALUES[classes], lengths).reshape(height, width)
+
+
+def _fnv1a(h: int, data: bytes) -> int:
+    for b in data:
+        h = ((h ^ b) * _FNV_PRIME) & _U32
+    return h
+
+
+def trimap_hash(trimap: np.ndarray) -> str:
+    """Compute the content hash the editor commits in ``stats["hash"]``.
+
+    FNV-1a 32-bit over the width and height (4 little-endian bytes each),
+    then each row-major run as its class byte followed by its length
+    (4 little-endian bytes).  Hashing runs instead of pixels keeps this
+    cheap in Python as well as in the browser.
+
+    Args:
+        trimap: A ``(H, W)`` array with values 0, 128 and 255.
+
+    Returns:
+        The hash as 8 lowercase hex digits.
+    """
+    height, width = trimap.shape
+    classes = np.searchsorted(_CLASS_VALUES, trimap.ravel())
+    starts = np.flatnonzero(np.concatenate(([True], classes[1:] != classes[:-1])))
+    lengths = np.diff(np.append(starts, classes.size))
+    h = _fnv1a(_FNV_OFFSET, width.to_bytes(4, "little") + height.to_bytes(4, "little"))
+    for cls, length in zip(classes[starts].tolist(), lengths.tolist(), strict=True):
+        h = _fnv1a(h, bytes((cls,)) + (length & _U32).to_bytes(4, "little"))
+    return f"{h:08x}"
+
+
+def trimap_stats(trimap: np.ndarray) -> dict[str, Any]:
+    """Compute the ``stats`` object the editor commits alongside the trimap.
+
+    Args:
+        trimap: A ``(H, W)`` array with values 0, 128 and 255.
+
+    Returns:
+        ``{"counts": {"background", "unknown", "foreground"}, "unknownBBox",
+        "foregroundBBox", "hash"}``.  Bounding boxes are ``[x0, y0, x1, y1]``
+        with exclusive ends (PIL crop order), or ``None`` when the class is
+        absent.
+    """
+
+    def bbox(mask: np.ndarray) -> list[int] | None:
+        ys = np.flatnonzero(mask.any(axis=1))
+        if ys.size == 0:
+            return None
+        xs = np.flatnonzero(mask.any(axis=0))
+        return [int(xs[0]), int(ys[0]), int(xs[-1]) + 1, int(ys[-1]) + 1]
+
+    unknown = trimap == _CLASS_VALUES[1]
+    fg = trimap == _CLASS_VALUES[2]
+    n_unknown = int(unknown.sum())
+    n_fg = int(fg.sum())
+    return {
+        "counts": {"background": trimap.size - n_unknown - n_fg, "unknown": n_unknown, "foreground": n_fg},
+        "unknownBBox": bbox(unknown),
+        "foregroundBBox": bbox(fg),
+        "hash": trimap_hash(trimap),
+    }
+
+
+def decode_trimap(value: str | dict[str, Any] | None) -> np.ndarray | None:
+    """Decode the trimap from a committed component value, whatever its format.
+
+    Handles ``trimapRLE`` (``value_format="rle"``), ``trimapBase64``
+    (``value_format="png"``) and ``strokes`` (``value_format="strokes"``).
+
+    Args:
+        value: The component value, as a JSON string or an already-parsed dict.
+
+    Returns:
+        A ``(H, W)`` uint8 array with values 0, 128 and 255, or ``None`` when
+        the value carries no trimap yet.
+    """
+    if not value:
+        return None
+    d = json.loads(value) if isinstance(value, str) else value
+    if "trimapRLE" in d:
+        return decode_rle(d["trimapRLE"], d["width"], d["height"])
+    if "trimapBase64" in d:
+        b64 = d["trimapBase64"]
+        if "," in b64:
+            b64 = b64.split(",", 1)[1]
+        return np.asarray(Image.open(BytesIO(base64.b64decode(b64))).convert("L"))
+    if "strokes" in d:
+        return rasterize_strokes(d["strokes"], d["width"], d["height"])
+    return None
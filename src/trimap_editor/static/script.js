@@ -5,20 +5,78 @@
     var MIN_ZOOM = 0.05;
     var MAX_ZOOM = 20;
     var ZOOM_SENSITIVITY = 0.001;
-    var MAX_HISTORY = 30;
+    // Undo history is kept as tile deltas; the oldest steps are dropped
+    // once their compressed size exceeds this budget.
+    var HISTORY_BUDGET_BYTES = 64 * 1024 * 1024;
+    var HISTORY_TILE = 256;  // tile edge in px
     var DEFAULT_UNKNOWN_COLOR = props.default_unknown_color;
     var DEFAULT_FG_COLOR = props.default_fg_color;
+    var VALUE_FORMAT = props.value_format || "png";  // "png" | "rle" | "strokes"
+    // "lazy" keeps encoded commits out of props.value until a flush point,
+    // so drawing never triggers Gradio's prop-update / morph cycle.
+    var COMMIT_MODE = props.commit_mode || "eager";  // "eager" | "lazy"
+    // Base ops folded out of the undo window are replaced by a raster
+    // keyframe once they exceed this many entries (bounds replay cost).
+    var STROKE_KEYFRAME_INTERVAL = 256;
+    // Stroke points are snapped to 1/8 px so the log stays short and
+    // replays bit-exactly (binary fractions survive JSON round-trips).
+    var POINT_QUANTUM = 8;
+    // Upper bound (ms) a scheduled commit waits for an idle slot.
+    var COMMIT_IDLE_TIMEOUT = 250;
+    // Flood fills yield to input after this many ms of work.
+    var FILL_SLICE_MS = 12;
+    // Pixels the wand's colour scan covers between deadline checks.
+    var WAND_SCAN_CHUNK = 1 << 16;
+    // Masks are checkpointed to IndexedDB at most this often (ms), in idle
+    // time, and restored when the same image is reopened.
+    var AUTOSAVE = props.autosave !== false;
+    var AUTOSAVE_INTERVAL = 2000;
+    // Checkpoints of other images are evicted, least recently saved first,
+    // beyond this many or once older than this (ms).
+    var AUTOSAVE_MAX_CHECKPOINTS = 32;
+    var AUTOSAVE_MAX_AGE = 30 * 24 * 3600 * 1000;
+    // Alpha mattes loaded in the browser: alpha <= lo is background,
+    // >= hi foreground, the band between them unknown.
+    var MATTE_BAND = props.matte_band || [16, 240];
+    // Matte preview (see solveMatte()): how far (px) unknown pixels look
+    // for known colours, then the guided filter's radius (px),
+    // regularisation (on 0..1 luminance) and passes.
+    var MATTE_COLOR_RADIUS = 64;
+    var MATTE_RADIUS = 8;
+    var MATTE_EPS = 1e-3;
+    var MATTE_ITERATIONS = 2;
+    // Side (px) of the tiles the solve is split into: each tile's
+    // scratch is ~37 bytes per pixel of its window (about 55 MB here).
+    var MATTE_TILE = 1024;
+    // Undo steps whose tile deltas stay in memory; older ones are spilled
+    // to IndexedDB by the autosave and read back on undo.
+    var HISTORY_RESIDENT_STEPS = 16;
+    // profile=True times the hot paths (see "Profiling" below); each
+    // metric keeps this many recent samples for its percentiles.
+    var PROFILE = props.profile === true;
+    var PROFILE_SAMPLES = 128;
 
     // ── DOM refs ────────────────────────────────────────────────────
     var container    = element.querySelector(".trimap-editor");
-    var canvas       = element.querySelector(".te-canvas");
+    var canvas       = element.querySelector(".te-canvas");  // content layer, input target
+    var maskLayer    = element.querySelector(".te-mask-layer");
+    var hudLayer     = element.querySelector(".te-hud-layer");
     var canvasWrapper = element.querySelector(".te-canvas-wrapper");
     var fileInput    = element.querySelector("#te-file-input");
+    var trimapInput  = element.querySelector("#te-trimap-input");
 
     var brushSizeSlider  = element.querySelector("#te-brush-size");
     var brushSizeVal     = element.querySelector("#te-brush-size-val");
     var eraserSizeSlider = element.querySelector("#te-eraser-size");
     var eraserSizeVal    = element.querySelector("#te-eraser-size-val");
+    var edgeThreshSlider = element.querySelector("#te-edge-threshold");
+    var edgeThreshVal    = element.querySelector("#te-edge-threshold-val");
+    var wandTolSlider    = element.querySelector("#te-wand-tolerance");
+    var wandTolVal       = element.querySelector("#te-wand-tolerance-val");
+    var morphSizeSlider  = element.querySelector("#te-morph-size");
+    var morphSizeVal     = element.querySelector("#te-morph-size-val");
+    var islandSizeSlider = element.querySelector("#te-island-size");
+    var islandSizeVal    = element.querySelector("#te-island-size-val");
     var fgAlphaSlider      = element.querySelector("#te-fg-alpha");
     var unknownAlphaSlider = element.querySelector("#te-unknown-alpha");
     // Fg group is first in DOM, Unknown second
@@ -37,8 +95,14 @@
     var removeBtn       = element.querySelector("#te-remove-btn");
     var imageToggleBtn  = element.querySelector("#te-image-toggle");
     var clearBtn        = element.querySelector("#te-clear-btn");
+    var loadTrimapBtn   = element.querySelector("#te-load-trimap-btn");
+    var growBtn         = element.querySelector("#te-grow-btn");
+    var shrinkBtn       = element.querySelector("#te-shrink-btn");
+    var islandsBtn      = element.querySelector("#te-islands-btn");
+    var holesBtn        = element.querySelector("#te-holes-btn");
     var viewTrimapBtn   = element.querySelector("#te-view-trimap-btn");
     var viewCutoutBtn   = element.querySelector("#te-view-cutout-btn");
+    var viewMatteBtn    = element.querySelector("#te-view-matte-btn");
     var cutoutInvertBtn = element.querySelector("#te-cutout-invert-btn");
     var fitBtn          = element.querySelector("#te-fit-btn");
     var maximizeBtn     = element.querySelector("#te-maximize-btn");
@@ -47,21 +111,32 @@
     var helpCloseBtn    = element.querySelector(".te-help-close-btn");
 
     var ctx = canvas.getContext("2d");
-
-    // ── Off-screen mask canvases (natural image size) ───────────────
-    var unknownCanvas = document.createElement("canvas");
-    var unknownCtx    = unknownCanvas.getContext("2d");
-    var fgCanvas      = document.createElement("canvas");
-    var fgCtx         = fgCanvas.getContext("2d");
-
-    // Temp canvas for colored overlay compositing
-    var tCanvas = document.createElement("canvas");
-    var tCtx    = tCanvas.getContext("2d");
-
-    // Trimap view canvas: composited grayscale (0/128/255), updated on stroke end
+    var hudCtx = hudLayer.getContext("2d");
+
+    // ── Label map (natural image size) ──────────────────────────────
+    // The source of truth: one byte per pixel, 0 background, 1 unknown,
+    // 2 foreground, so fg ⊆ unknown holds by construction.
+    var labels = new Uint8Array(0);
+    var labelW = 0;
+    var labelH = 0;
+
+    // Cutout preview: the image masked by the active layer, recomposed
+    // only where the mask changed (see updateCutout()).  Like the trimap
+    // view it is sized on first use and released by releaseDisplay().
+    var cutoutCanvas = document.createElement("canvas");
+    var cutoutCtx    = cutoutCanvas.getContext("2d");
+
+    // Trimap view canvas: grayscale (0/128/255) view of the label map,
+    // allocated and updated per dirty rect by updateTrimapView(), which
+    // only the trimap view and the PNG commit fallbacks call
     var trimapViewCanvas = document.createElement("canvas");
     var trimapViewCtx    = trimapViewCanvas.getContext("2d");
 
+    // Matte preview canvas: grayscale approximate alpha, redrawn per solve
+    // result by finishMatte() (see updateMatte())
+    var matteCanvas = document.createElement("canvas");
+    var matteCtx    = matteCanvas.getContext("2d");
+
     // Checkerboard pattern for cutout preview (16x16 tile)
     var checkerCanvas = document.createElement("canvas");
     checkerCanvas.width = 16; checkerCanvas.height = 16;
@@ -69,10 +144,24 @@
     ckCtx.fillStyle = "#ccc"; ckCtx.fillRect(0, 0, 16, 16);
     ckCtx.fillStyle = "#999"; ckCtx.fillRect(0, 0, 8, 8);
     ckCtx.fillStyle = "#999"; ckCtx.fillRect(8, 8, 8, 8);
+    var checkerPattern = ctx.createPattern(checkerCanvas, "repeat");
+
+    // Mip pyramids of the image and the full-size display canvases, so
+    // zoomed-out frames sample a level near screen resolution (see
+    // pyramidLevel()).  The image pyramid follows state.image; the others
+    // keep their source canvas and drop their levels whenever it is
+    // resized (releasePyramid()).
+    var imagePyramid   = null;
+    var trimapPyramid  = createPyramid(trimapViewCanvas);
+    var cutoutPyramid  = createPyramid(cutoutCanvas);
+    var mattePyramid   = createPyramid(matteCanvas);
 
     // ── State ───────────────────────────────────────────────────────
     var state = {
-        image:       null,  // HTMLImageElement
+        image:       null,  // ImageBitmap, closed when replaced or removed
+                            // (a sized stand-in while released, see releaseImage())
+        imageLoadSeq: 0,    // bumped per load; a superseded decode is dropped
+        imageReload: null,  // () => Promise<ImageBitmap> decoding the image again
         imageUrl:    null,  // Python-provided URL (/gradio_api/file=...)
         objectUrl:   null,  // blob URL (user-uploaded)
         fileUrl:     null,  // public URL from upload()
@@ -80,14 +169,20 @@
         pendingCommit: false,  // commit queued while image upload in-flight
 
         layer:       "foreground",  // "foreground" | "unknown"
-        tool:        "brush",    // "brush" | "eraser" | "bucket" | "pan"
+        tool:        "brush",    // "brush" | "eraser" | "edge" | "bucket" | "wand" | "pan"
         prevDrawTool: "brush",  // last non-pan tool (for pan toggle)
         brushSizeBrush:  20,
         brushSizeEraser: 10,
+        morphSize:       10,  // grow / shrink radius in image pixels
+        islandSize:      50,  // islands below this many pixels are removed
+        wandTolerance:   32,  // max per-channel colour difference for the wand
+        edgeThreshold:   24,  // min edge strength (0..255) the edge brush marks
         unknownAlpha: 0.60,
         fgAlpha:     0.60,
         unknownColor: DEFAULT_UNKNOWN_COLOR,
         fgColor:     DEFAULT_FG_COLOR,
+        unknownPixel: colorToPixel(DEFAULT_UNKNOWN_COLOR),  // layer colours as
+        fgPixel:      colorToPixel(DEFAULT_FG_COLOR),       // ImageData Uint32s
         savedFgAlpha:      0.60,  // remembered alpha when visibility toggled off
         savedUnknownAlpha: 0.60,
 
@@ -102,6 +197,8 @@
         panStartPanY: 0,
 
         isDrawing:   false,
+        fillJob:     null,       // time-sliced flood fill in progress
+        maskDirty:   null,       // [x0, y0, x1, y1) of labels not yet on the mask canvases
         pendingDot:  null,       // deferred initial dot {x, y}
         pendingDotTimer: null,   // setTimeout id for deferred dot
         lastIX:      0,
@@ -114,24 +211,75 @@
         showImage:     true,
         showTrimap:    false,   // trimap view mode
         showCutout:    false,   // cutout preview mode
+        showMatte:     false,   // matte preview mode
         cutoutInvert:  false,   // invert cutout (show outside of mask)
         maximized:     false,
 
-        history:     [],  // [{unknown: ImageData, fg: ImageData}]
+        // history[0] is the base state; history[i] holds the tile deltas
+        // from state i-1 to state i: [{id, tiles: [{t, runs}], bytes, ops,
+        // spilled}].  Spilled entries have tiles=null until read back.
+        history:     [],
         historyIndex: -1,
+        historyBytes: 0,
+        historyBase:  null,  // label map at historyIndex (diff reference)
+        editedTiles:  null,  // per-tile flags: labels changed since last snapshot
+        historySeq:   0,     // id of the next history entry (spilled delta key)
+        historyLoading: false,  // an undo/redo waits for a spilled delta
+
+        imageKey:      null,  // image fingerprint keying the autosave
+        autosaveTimer: null,  // pending autosave, see scheduleAutosave()
+
+        // Stroke log (value_format="strokes"): each history entry carries the
+        // ops that produced it; ops pushed out of the undo window are folded
+        // into strokeBaseOps so the committed log always replays from blank.
+        strokeBaseOps: [],
+        pendingOps:    [],    // ops recorded since the last snapshot
+        keyframePending: false,  // log a keyframe before the next snapshot
+        activeStroke:  null,  // stroke op currently being extended
+
+        trimapRLE:   null,  // {bytes, length} run stream (value_format="rle")
+        trimapStats: null,  // counts / bboxes / hash from the last updateTrimapStats()
+        trimapStatsDirty: false,  // labels changed since the last updateTrimapStats()
+        trimapViewRect: null,  // [x0, y0, x1, y1) of trimapViewCanvas not yet redrawn
+        cutoutRect:  null,  // [x0, y0, x1, y1) of cutoutCanvas not yet recomposed
+        cutoutKey:   null,  // layer + invert the cutout was composed for
+        matteRect:   null,  // [x0, y0, x1, y1) of labels changed since the last matte solve
+
+        commitVersion:    0,     // bumped by every scheduleCommit()
+        committedVersion: 0,     // version currently in props.value
+        commitHandle:     null,  // pending idle task, see requestIdle()
+        stagedValue:      null,  // {version, json} held back in lazy commit mode
+
+        inView:      true,  // editor intersects the viewport (see releaseDisplay())
     };
 
+    // Hot-path timings, null unless profiling
+    var profiler = PROFILE ? instrumentHotPaths() : null;
+
+    // Draws the mask layer, in a worker where supported (see postMask())
+    var maskRenderer = startMaskRenderer();
+    postMask({ type: "colors", unknownPixel: state.unknownPixel, fgPixel: state.fgPixel });
+
     // ── Resize Observer ─────────────────────────────────────────────
 
     var resizeObserver = new ResizeObserver(function () {
-        resizeCanvas();
-        if (state.image) {
-            clampPan();
-            render();
-        }
+        invalidateCanvasRect();
+        _resizePending = true;
+        requestRender(LAYER_ALL);
     });
     resizeObserver.observe(canvasWrapper);
 
+    // ── Intersection Observer ───────────────────────────────────────
+    // Editors scrolled well out of view, or hidden in an inactive tab,
+    // give back their display memory; the label map stays, so coming back
+    // into view just redraws.  The margin keeps ordinary scrolling from
+    // thrashing the allocations.
+
+    var intersectionObserver = new IntersectionObserver(function (entries) {
+        setInView(entries[entries.length - 1].isIntersecting);
+    }, { rootMargin: "100% 0px" });
+    intersectionObserver.observe(canvasWrapper);
+
     // ── Watch: value updates from Python (fires only on backend changes) ─
     watch("value", function () { handleValue(); });
 
@@ -148,8 +296,19 @@
 
     // Expose state and canvases on the container element for UI tests (read-only references).
     container._teState = state;
-    container._teUnknownCanvas = unknownCanvas;
-    container._teFgCanvas = fgCanvas;
+    // The coloured mask canvases live in the mask renderer, so these are
+    // composed from the label map on each read.
+    Object.defineProperty(container, "_teUnknownCanvas", {
+        get: function () { return maskCanvasFromLabels([0, state.unknownPixel, state.unknownPixel]); },
+    });
+    Object.defineProperty(container, "_teFgCanvas", {
+        get: function () { return maskCanvasFromLabels([0, 0, state.fgPixel]); },
+    });
+    container._teReadMaskLayer = readMaskLayer;
+    container._teTrimapViewCanvas = trimapViewCanvas;
+    container._teCutoutCanvas = cutoutCanvas;
+    container._teMatteCanvas = matteCanvas;
+    Object.defineProperty(container, "_teLabels", { get: function () { return labels; } });
 
     // Handle initial value
     handleValue();
@@ -171,6 +330,7 @@
         imageToggleBtn.classList.toggle("active", state.showImage);
         viewTrimapBtn.classList.toggle("active", state.showTrimap);
         viewCutoutBtn.classList.toggle("active", state.showCutout);
+        viewMatteBtn.classList.toggle("active", state.showMatte);
         cutoutInvertBtn.classList.toggle("active", state.cutoutInvert);
         cutoutInvertBtn.disabled = !state.showCutout;
         fgVisBtn.classList.toggle("te-vis-off", state.fgAlpha <= 0);
@@ -181,6 +341,14 @@
         brushSizeVal.textContent = state.brushSizeBrush;
         eraserSizeSlider.value = state.brushSizeEraser;
         eraserSizeVal.textContent = state.brushSizeEraser;
+        edgeThreshSlider.value = state.edgeThreshold;
+        edgeThreshVal.textContent = state.edgeThreshold;
+        wandTolSlider.value = state.wandTolerance;
+        wandTolVal.textContent = state.wandTolerance;
+        morphSizeSlider.value = state.morphSize;
+        morphSizeVal.textContent = state.morphSize;
+        islandSizeSlider.value = state.islandSize;
+        islandSizeVal.textContent = state.islandSize;
         var fgPct = Math.round(state.fgAlpha * 100);
         fgAlphaSlider.value = fgPct;
         fgAlphaVal.textContent = fgPct + "%";
@@ -228,6 +396,7 @@
                 state.objectUrl = null;
             }
             state.pendingCommit = false;
+            cancelCommits();
 
             var imageUrl = data.image;
             // Store the stripped path for commitValue(); img.src uses
@@ -241,18 +410,23 @@
 
             var trimapUrl = data.trimap || null;
 
-            var img = new Image();
-            img.onload = function () {
+            var seq = ++state.imageLoadSeq;
+            decodeImage(imageUrl).then(function (img) {
+                if (seq !== state.imageLoadSeq) {
+                    img.close();  // superseded by a later load
+                    return;
+                }
                 // Set up canvas and compute zoom BEFORE setting state.image so
                 // that any ResizeObserver render triggered by canvasWrapper layout
                 // queries finds state.image=null and skips rendering, preventing
                 // a brief zoom=1 flash before the first correct render.
-                initMaskCanvases(img.naturalWidth, img.naturalHeight);
+                flushAutosave();
+                initMaskCanvases(img.width, img.height);
                 clearHistory();
                 canvasWrapper.classList.add("te-has-image");
                 resizeCanvas();
-                var iw = img.naturalWidth;
-                var ih = img.naturalHeight;
+                var iw = img.width;
+                var ih = img.height;
                 var cw = canvas.width;
                 var ch = canvas.height;
                 var z = Math.min(cw / iw, ch / ih);
@@ -264,7 +438,10 @@
                 // MutationObserver needs state.image !== null to re-assert
                 // the te-has-image class if a DOM morph fires while we're
                 // still loading the trimap asynchronously.
+                closeImage();
                 state.image = img;
+                state.imageReload = function () { return decodeImage(imageUrl); };
+                state.imageKey = AUTOSAVE ? imageFingerprint(img) : null;
 
                 // Notify Python that a new image arrived (e.g. for resize
                 // checks). Only .input() handlers fire — commitValue() after
@@ -273,85 +450,154 @@
                 trigger("input");
 
                 if (trimapUrl) {
-                    // Show image immediately (blank mask), then overlay trimap
-                    render();
-                    var trimapImg = new Image();
-                    // Enable CORS so getImageData() works on cross-origin
-                    // trimap images (e.g. HF datasets URLs in the gallery).
-                    trimapImg.crossOrigin = "anonymous";
-                    trimapImg.onload = function () {
-                        parseTrimapIntoCanvases(trimapImg, iw, ih);
-                        updateTrimapView();
-                        snapshotHistory();
-                        render();
-                        // Re-commit so Python sees stripped path + trimapBase64
-                        commitValue();
-                    };
-                    trimapImg.onerror = function () {
+                    // Show image immediately (blank mask), then overlay trimap.
+                    // fetch() is a CORS request, so cross-origin trimaps
+                    // (e.g. HF datasets URLs in the gallery) stay readable.
+                    requestRender();
+                    fetchBlob(trimapUrl).then(function (blob) {
+                        decodeTrimap(blob, iw, ih, null, function (trimapLabels) {
+                            if (seq !== state.imageLoadSeq) return;
+                            if (!trimapLabels) {
+                                // Trimap failed to decode — proceed without it
+                                snapshotHistory();
+                                return;
+                            }
+                            labels.set(trimapLabels);
+                            // Flag every tile: strokes drawn while the trimap
+                            // loaded already took the history base
+                            markMaskDirty(0, 0, iw, ih);
+                            logKeyframe();
+                            snapshotHistory();
+                            requestRender();
+                            // Re-commit so Python sees stripped path + trimapBase64
+                            scheduleCommit();
+                        });
+                    }, function () {
                         // Trimap failed to load — proceed without it
-                        snapshotHistory();
-                    };
-                    trimapImg.src = trimapUrl;
+                        if (seq === state.imageLoadSeq) snapshotHistory();
+                    });
                 } else {
                     snapshotHistory();
-                    render();
+                    requestRender();
+                    restoreAutosave();
                 }
-            };
-            img.onerror = function () {
+            }, function () {
                 // Silently ignore load errors
-            };
-            img.src = imageUrl;
+            });
         }
     }
 
     // ── Mask canvas init ─────────────────────────────────────────────
 
     function initMaskCanvases(w, h) {
-        unknownCanvas.width  = w;
-        unknownCanvas.height = h;
-        fgCanvas.width  = w;
-        fgCanvas.height = h;
-        tCanvas.width   = w;
-        tCanvas.height  = h;
-        trimapViewCanvas.width  = w;
-        trimapViewCanvas.height = h;
-        unknownCtx.clearRect(0, 0, w, h);
-        fgCtx.clearRect(0, 0, w, h);
-    }
-
-    // Parse a trimap image (0/128/255 grayscale) into unknownCanvas and fgCanvas.
-    // Uses generous thresholds (>200 for fg, >64 for unknown) to tolerate slight
-    // value shifts from image format conversions.
-    function parseTrimapIntoCanvases(trimapImg, w, h) {
-        tCanvas.width = w;
-        tCanvas.height = h;
-        var tc = tCanvas.getContext("2d");
-        tc.drawImage(trimapImg, 0, 0, w, h);
-        var trimapData = tc.getImageData(0, 0, w, h).data;
-
-        var unknownImgData = unknownCtx.createImageData(w, h);
-        var fgImgData = fgCtx.createImageData(w, h);
-        var ud = unknownImgData.data;
-        var fd = fgImgData.data;
-
-        for (var i = 0; i < w * h; i++) {
-            var px = i * 4;
-            var val = trimapData[px]; // R channel (grayscale: R==G==B)
-            if (val > 200) {
-                // Foreground (255): paint both canvases
-                ud[px] = fd[px] = 255;
-                ud[px + 1] = fd[px + 1] = 255;
-                ud[px + 2] = fd[px + 2] = 255;
-                ud[px + 3] = fd[px + 3] = 255;
-            } else if (val > 64) {
-                // Unknown (128): paint only unknown canvas
-                ud[px] = ud[px + 1] = ud[px + 2] = ud[px + 3] = 255;
+        state.fillJob = null;
+        state.maskDirty = null;
+        labels = new Uint8Array(w * h);
+        labelW = w;
+        labelH = h;
+        // The trimap view and cutout are reallocated at the new size when
+        // next shown
+        releaseCanvas(trimapViewCanvas);
+        releaseCanvas(cutoutCanvas);
+        releaseCanvas(matteCanvas);
+        releasePyramid(trimapPyramid);
+        releasePyramid(cutoutPyramid);
+        releasePyramid(mattePyramid);
+        state.trimapViewRect = null;
+        state.cutoutRect = null;
+        state.cutoutKey = null;
+        state.matteRect = null;
+        if (state.inView) postMask({ type: "image", width: w, height: h });
+    }
+
+    // Records a label change in [x0, x1) × [y0, y1): grows the pending
+    // display rect (synced by render()) and flags the tiles for history.
+    function markMaskDirty(x0, y0, x1, y1) {
+        var flags = state.editedTiles;
+        if (flags) {
+            var tilesX = Math.ceil(labelW / HISTORY_TILE);
+            var tx1 = Math.ceil(x1 / HISTORY_TILE);
+            var ty1 = Math.ceil(y1 / HISTORY_TILE);
+            for (var ty = Math.floor(y0 / HISTORY_TILE); ty < ty1; ty++) {
+                for (var tx = Math.floor(x0 / HISTORY_TILE); tx < tx1; tx++) {
+                    flags[ty * tilesX + tx] = 1;
+                }
             }
-            // else: background (0) — both stay at 0 (default)
         }
+        state.maskDirty = growRect(state.maskDirty, x0, y0, x1, y1);
+    }
+
+    // Returns rect (or a new one if null) grown to include [x0, x1) × [y0, y1).
+    function growRect(rect, x0, y0, x1, y1) {
+        if (!rect) return [x0, y0, x1, y1];
+        if (x0 < rect[0]) rect[0] = x0;
+        if (y0 < rect[1]) rect[1] = y0;
+        if (x1 > rect[2]) rect[2] = x1;
+        if (y1 > rect[3]) rect[3] = y1;
+        return rect;
+    }
+
+    function flushMaskDisplay() {
+        var d = state.maskDirty;
+        if (!d) return;
+        state.maskDirty = null;
+        syncMaskDisplay(d[0], d[1], d[2], d[3]);
+    }
+
+    // Sends [x0, x1) × [y0, y1) of the label map to the mask renderer and
+    // queues the same rect for the trimap view and the cutout.  Out of
+    // view the renderer holds no masks; setInView() resends everything.
+    function syncMaskDisplay(x0, y0, x1, y1) {
+        var bw = x1 - x0;
+        var bh = y1 - y0;
+        if (bw <= 0 || bh <= 0) return;
+        state.trimapViewRect = growRect(state.trimapViewRect, x0, y0, x1, y1);
+        state.cutoutRect = growRect(state.cutoutRect, x0, y0, x1, y1);
+        state.matteRect = growRect(state.matteRect, x0, y0, x1, y1);
+        if (!state.inView) return;
+        var patch = new Uint8Array(bw * bh);
+        for (var y = 0; y < bh; y++) {
+            var row = (y0 + y) * labelW + x0;
+            patch.set(labels.subarray(row, row + bw), y * bw);
+        }
+        postMask({ type: "labels", x0: x0, y0: y0, x1: x1, y1: y1, labels: patch }, [patch.buffer]);
+    }
+
+    // A full-size canvas with each label drawn as pixels[label].
+    function maskCanvasFromLabels(pixels) {
+        var c = createCanvas(labelW, labelH);
+        if (labelW === 0 || labelH === 0) return c;
+        var mctx = c.getContext("2d");
+        var img = mctx.createImageData(labelW, labelH);
+        composeTrimapRect(new Uint32Array(img.data.buffer), labels, labelW, 0, 0, labelW, labelH,
+                          new Uint32Array(pixels));
+        mctx.putImageData(img, 0, 0);
+        return c;
+    }
+
+    // Opaque ImageData pixel (platform byte order) for a CSS colour.
+    function colorToPixel(color) {
+        var pc = document.createElement("canvas");
+        pc.width = 1;
+        pc.height = 1;
+        var pctx = pc.getContext("2d");
+        pctx.fillStyle = color;
+        pctx.fillRect(0, 0, 1, 1);
+        var d = pctx.getImageData(0, 0, 1, 1).data;
+        return new Uint32Array(new Uint8Array([d[0], d[1], d[2], 255]).buffer)[0];
+    }
 
-        unknownCtx.putImageData(unknownImgData, 0, 0);
-        fgCtx.putImageData(fgImgData, 0, 0);
+    // Recolours the mask canvases after a palette change.
+    function setLayerColor(layer, color) {
+        if (layer === "unknown") {
+            state.unknownColor = color;
+            state.unknownPixel = colorToPixel(color);
+        } else {
+            state.fgColor = color;
+            state.fgPixel = colorToPixel(color);
+        }
+        postMask({ type: "colors", unknownPixel: state.unknownPixel, fgPixel: state.fgPixel });
+        syncMaskDisplay(0, 0, labelW, labelH);
     }
 
     // ── Canvas resize ────────────────────────────────────────────────
@@ -364,8 +610,58 @@
         // the canvas content per HTML5 spec, causing visible flicker during
         // the echo cycle (commitValue → DOM morph → handleValue → resize).
         if (canvas.width === w && canvas.height === h) return;
-        canvas.width  = w;
-        canvas.height = h;
+        [canvas, hudLayer].forEach(function (c) {
+            c.width  = w;
+            c.height = h;
+        });
+        postMask({ type: "size", width: w, height: h });
+    }
+
+    // ── Memory release ───────────────────────────────────────────────
+    // Everything but the label map is a display cache: the screen-size
+    // layers, the pyramids, the trimap view, the cutout, the matte preview
+    // (and its solver's copy of the image) and the renderer's mask
+    // canvases.  They are zero-sized when the editor is emptied or leaves
+    // the viewport and rebuilt by the next render.  Leaving the viewport
+    // also frees the decoded image (see releaseImage()).
+
+    function releaseDisplay() {
+        [canvas, hudLayer].forEach(releaseCanvas);
+        imagePixels = null;
+        wandMask = null;
+        edgeMap = null;
+        _contentView = null;
+        _resizePending = true;
+        if (imagePyramid) releasePyramid(imagePyramid);
+        releasePyramid(trimapPyramid);
+        releasePyramid(cutoutPyramid);
+        releasePyramid(mattePyramid);
+        releaseCanvas(trimapViewCanvas);
+        releaseCanvas(cutoutCanvas);
+        releaseCanvas(matteCanvas);
+        releaseMatteSolver();
+        state.trimapViewRect = null;
+        state.cutoutRect = null;
+        state.cutoutKey = null;
+        state.matteRect = null;
+        postMask({ type: "release" });
+    }
+
+    function setInView(inView) {
+        if (inView === state.inView) return;
+        state.inView = inView;
+        if (!inView) {
+            releaseDisplay();
+            releaseImage();
+            return;
+        }
+        reloadImage();
+        if (labelW > 0) {
+            postMask({ type: "image", width: labelW, height: labelH });
+            syncMaskDisplay(0, 0, labelW, labelH);
+        }
+        _resizePending = true;
+        requestRender(LAYER_ALL);
     }
 
     // ── Zoom helpers ─────────────────────────────────────────────────
@@ -374,13 +670,18 @@
         if (!state.image) return MIN_ZOOM;
         var cw = canvas.width  || 1;
         var ch = canvas.height || 1;
-        return Math.min(cw / state.image.naturalWidth, ch / state.image.naturalHeight);
+        return Math.min(cw / state.image.width, ch / state.image.height);
     }
 
     function resetZoom() {
         if (!state.image) return;
-        var iw = state.image.naturalWidth;
-        var ih = state.image.naturalHeight;
+        fitToCanvas();
+        requestRender();
+    }
+
+    function fitToCanvas() {
+        var iw = state.image.width;
+        var ih = state.image.height;
         var cw = canvas.width;
         var ch = canvas.height;
         // Contain fit: scale image to fit entirely within canvas
@@ -389,13 +690,12 @@
         // Center the image
         state.panX = (cw - iw * zoom) / 2;
         state.panY = (ch - ih * zoom) / 2;
-        render();
     }
 
     function clampPan() {
         if (!state.image) return;
-        var imgW = state.image.naturalWidth  * state.zoom;
-        var imgH = state.image.naturalHeight * state.zoom;
+        var imgW = state.image.width  * state.zoom;
+        var imgH = state.image.height * state.zoom;
         var cw = canvas.width;
         var ch = canvas.height;
 
@@ -420,13 +720,31 @@
         state.panY = cy - (cy - state.panY) * (newZoom / state.zoom);
         state.zoom = newZoom;
         clampPan();
-        render();
+        requestRender();
     }
 
     // ── Coordinate conversion ────────────────────────────────────────
 
+    // Canvas client rect, cached between resizes: reading it forces layout,
+    // which pointermove would otherwise do for every sample.  Dropped by
+    // the ResizeObserver, on scroll, and on every pointerdown/pointerenter.
+    var _canvasRect = null;
+
+    function canvasRect() {
+        if (!_canvasRect) _canvasRect = canvas.getBoundingClientRect();
+        return _canvasRect;
+    }
+
+    function invalidateCanvasRect() {
+        _canvasRect = null;
+    }
+
+    // Capture phase also sees scrolling ancestors
+    window.addEventListener("scroll", invalidateCanvasRect, true);
+    window.addEventListener("resize", invalidateCanvasRect);
+
     function clientToImage(clientX, clientY) {
-        var rect = canvas.getBoundingClientRect();
+        var rect = canvasRect();
         var cssX = clientX - rect.left;
         var cssY = clientY - rect.top;
         // account for CSS vs pixel dimensions
@@ -436,367 +754,2430 @@
         var canvasY = cssY * scaleY;
         // canvas = pan + zoom * image
         return {
-            x: (canvasX - state.panX) / state.zoom,
-            y: (canvasY - state.panY) / state.zoom,
+            x: Math.round((canvasX - state.panX) / state.zoom * POINT_QUANTUM) / POINT_QUANTUM,
+            y: Math.round((canvasY - state.panY) / state.zoom * POINT_QUANTUM) / POINT_QUANTUM,
         };
     }
 
     // ── Rendering ────────────────────────────────────────────────────
 
+    // The display is three stacked canvases, each redrawn only when one
+    // of its inputs changed: callers pass the affected layers.
+    var LAYER_CONTENT = 1;  // background + image, trimap view, cutout or matte
+    var LAYER_MASKS   = 2;  // coloured overlays (normal view)
+    var LAYER_HUD     = 4;  // zoom badge + brush cursor
+    var LAYER_ALL     = 7;
+    // Not a layer: the view was panned, so the content and mask layers
+    // scroll their last frame and redraw only the exposed strips
+    var VIEW_PANNED   = 8;
+
     var _rafId = null;
-    function requestRender() {
+    var _pendingLayers = 0;
+    var _resizePending = false;
+    var _fitPending = false;  // re-fit zoom after the pending resize
+
+    // Coalesces redraws into one per animation frame.
+    function requestRender(layers) {
+        _pendingLayers |= layers === undefined ? LAYER_ALL : layers;
         if (_rafId) return;
-        _rafId = requestAnimationFrame(function () {
-            _rafId = null;
-            render();
-        });
+        _rafId = requestAnimationFrame(render);
+    }
+
+    // Layers that show the label map in the current view.
+    function editLayers() {
+        return state.showTrimap || state.showCutout || state.showMatte ? LAYER_CONTENT : LAYER_MASKS;
     }
 
     function render() {
-        if (!state.image) return;
+        var layers = _pendingLayers;
+        _rafId = null;
+        _pendingLayers = 0;
+        // Out of view, empty or while the image is decoded again nothing
+        // is drawn (and the released layers stay unallocated); setInView(),
+        // image loads and reloadImage() redraw everything
+        if (!state.inView || !state.image || state.image.released) return;
+        if (_resizePending) {
+            // Resizing clears the canvases, so it happens in the frame
+            // that redraws them
+            _resizePending = false;
+            resizeCanvas();
+            layers = LAYER_ALL;
+            if (_fitPending) fitToCanvas();
+            clampPan();
+            _fitPending = false;
+        }
+        flushMaskDisplay();
+        if (layers & (LAYER_CONTENT | VIEW_PANNED)) {
+            var view = { zoom: state.zoom, panX: state.panX, panY: state.panY };
+            paintLayer(ctx, _contentView, view, layers & LAYER_CONTENT, renderContent);
+            _contentView = view;
+        }
+        if (layers & (LAYER_MASKS | VIEW_PANNED)) renderMasks(layers & LAYER_MASKS);
+        // The profile overlay is redrawn with every frame
+        if (profiler) layers |= LAYER_HUD;
+        if (layers & LAYER_HUD) renderHud();
+        if (profiler && profiler.inputTime) {
+            profileSince("strokeLatency", profiler.inputTime);
+            profiler.inputTime = 0;
+        }
+    }
+
+    // View (zoom, panX, panY) the content layer was last drawn at
+    var _contentView = null;
+
+    // Redraws a layer for view, or — when only the pan moved since last,
+    // by whole pixels — scrolls its last frame and redraws just the newly
+    // exposed strips.  Closure-free (the mask renderer uses it too).
+    function paintLayer(layerCtx, last, view, full, draw) {
+        var cw = layerCtx.canvas.width;
+        var ch = layerCtx.canvas.height;
+        var dx = last ? view.panX - last.panX : 0;
+        var dy = last ? view.panY - last.panY : 0;
+        if (full || !last || last.zoom !== view.zoom || dx % 1 !== 0 || dy % 1 !== 0 ||
+            Math.abs(dx) >= cw || Math.abs(dy) >= ch) {
+            draw();
+            return;
+        }
+        if (dx === 0 && dy === 0) return;
+        layerCtx.setTransform(1, 0, 0, 1, 0, 0);
+        layerCtx.globalCompositeOperation = "copy";
+        layerCtx.drawImage(layerCtx.canvas, dx, dy);
+        layerCtx.globalCompositeOperation = "source-over";
+        layerCtx.save();
+        layerCtx.beginPath();
+        if (dx > 0) layerCtx.rect(0, 0, dx, ch);
+        else if (dx < 0) layerCtx.rect(cw + dx, 0, -dx, ch);
+        if (dy > 0) layerCtx.rect(0, 0, cw, dy);
+        else if (dy < 0) layerCtx.rect(0, ch + dy, cw, -dy);
+        layerCtx.clip();
+        draw();
+        layerCtx.restore();
+    }
 
+    function renderContent() {
         ctx.setTransform(1, 0, 0, 1, 0, 0);
-        ctx.clearRect(0, 0, canvas.width, canvas.height);
 
         // Dark background
         ctx.fillStyle = "#1a1a1a";
         ctx.fillRect(0, 0, canvas.width, canvas.height);
 
-        var iw = state.image.naturalWidth;
-        var ih = state.image.naturalHeight;
+        var iw = state.image.width;
+        var ih = state.image.height;
 
         // Apply zoom + pan
         ctx.setTransform(state.zoom, 0, 0, state.zoom, state.panX, state.panY);
 
         if (state.showTrimap) {
             // Trimap view: draw grayscale trimap (0/128/255)
+            updateTrimapView();
             ctx.imageSmoothingEnabled = false;
-            ctx.drawImage(trimapViewCanvas, 0, 0, iw, ih);
+            drawPyramid(ctx, trimapPyramid, iw, ih, state);
         } else if (state.showCutout) {
             // Cutout preview: active layer mask on checkerboard
-            // Mask canvas: fg or unknown depending on active layer
-            var maskSrc = state.layer === "foreground" ? fgCanvas : unknownCanvas;
-
             // 1. Fill image area with checkerboard
-            var checkerPattern = ctx.createPattern(checkerCanvas, "repeat");
             ctx.fillStyle = checkerPattern;
             ctx.fillRect(0, 0, iw, ih);
             ctx.imageSmoothingEnabled = false;
 
             // 2. Image masked by the active layer (or its inverse)
-            tCtx.clearRect(0, 0, iw, ih);
-            tCtx.globalCompositeOperation = "source-over";
-            tCtx.drawImage(state.image, 0, 0);
-            if (state.cutoutInvert) {
-                // Invert: remove mask region, keep outside
-                tCtx.globalCompositeOperation = "destination-out";
-            } else {
-                // Normal: keep only mask region
-                tCtx.globalCompositeOperation = "destination-in";
-            }
-            tCtx.drawImage(maskSrc, 0, 0);
-            tCtx.globalCompositeOperation = "source-over";
-            ctx.drawImage(tCanvas, 0, 0, iw, ih);
-        } else {
-            // Normal view: image + colored overlays
-            if (state.showImage) {
-                ctx.imageSmoothingEnabled = true;
-                ctx.drawImage(state.image, 0, 0, iw, ih);
-            }
-
+            updateCutout();
+            drawPyramid(ctx, cutoutPyramid, iw, ih, state);
+        } else if (state.showMatte) {
+            // Matte preview: grayscale approximate alpha
+            updateMatte();
             ctx.imageSmoothingEnabled = false;
-            // 2. Draw unknown overlay
-            drawMaskOverlay(unknownCanvas, unknownCtx, state.unknownColor, state.unknownAlpha);
-            // 3. Draw foreground overlay (on top)
-            drawMaskOverlay(fgCanvas, fgCtx, state.fgColor, state.fgAlpha);
+            drawPyramid(ctx, mattePyramid, iw, ih, state);
+        } else if (state.showImage) {
+            if (!imagePyramid || imagePyramid.levels[0] !== state.image) {
+                if (imagePyramid) releasePyramid(imagePyramid);
+                imagePyramid = createPyramid(state.image);
+            }
+            ctx.imageSmoothingEnabled = true;
+            drawPyramid(ctx, imagePyramid, iw, ih, state);
         }
+    }
 
-        // Back to screen space for UI elements
-        ctx.setTransform(1, 0, 0, 1, 0, 0);
+    // The mask layer is drawn by the mask renderer; full=false allows it
+    // to scroll its last frame.
+    function renderMasks(full) {
+        postMask({
+            type: "frame",
+            full: !!full,
+            view: { zoom: state.zoom, panX: state.panX, panY: state.panY },
+            unknownAlpha: state.unknownAlpha,
+            fgAlpha: state.fgAlpha,
+            // Trimap, cutout and matte views show the masks in the content layer
+            visible: !(state.showTrimap || state.showCutout || state.showMatte),
+        });
+    }
 
-        // 4. Zoom badge
+    function renderHud() {
+        hudCtx.clearRect(0, 0, hudLayer.width, hudLayer.height);
+
+        // Zoom badge
         var zoomText = Math.round(state.zoom * 100) + "%";
-        ctx.font = "bold 12px -apple-system, BlinkMacSystemFont, sans-serif";
-        var tm = ctx.measureText(zoomText);
-        var px = canvas.width  - tm.width - 16;
-        var py = canvas.height - 24;
-        ctx.fillStyle = "rgba(0,0,0,0.55)";
-        ctx.beginPath();
-        ctx.roundRect(px - 5, py - 2, tm.width + 10, 18, 3);
-        ctx.fill();
-        ctx.fillStyle = "#fff";
-        ctx.textBaseline = "top";
-        ctx.fillText(zoomText, px, py + 1);
-
-        // 5. Cursor circle (skip if outside image, pan mode, or bucket tool)
+        hudCtx.font = "bold 12px -apple-system, BlinkMacSystemFont, sans-serif";
+        var tm = hudCtx.measureText(zoomText);
+        var px = hudLayer.width  - tm.width - 16;
+        var py = hudLayer.height - 24;
+        hudCtx.fillStyle = "rgba(0,0,0,0.55)";
+        hudCtx.beginPath();
+        hudCtx.roundRect(px - 5, py - 2, tm.width + 10, 18, 3);
+        hudCtx.fill();
+        hudCtx.fillStyle = "#fff";
+        hudCtx.textBaseline = "top";
+        hudCtx.fillText(zoomText, px, py + 1);
+
+        if (profiler) drawProfileOverlay();
+
+        // Cursor circle (skip if outside image, pan mode, or bucket tool)
         var inPanMode = state.isPanning || state.spaceHeld || state.tool === "pan";
-        if (state.mouseInsideCanvas && state.cursorOverImage && state.cursorX >= 0 && !inPanMode && state.tool !== "bucket") {
+        if (state.mouseInsideCanvas && state.cursorOverImage && state.cursorX >= 0 && !inPanMode && state.tool !== "bucket" && state.tool !== "wand") {
             drawCursor(state.cursorX, state.cursorY);
         }
     }
 
-    function drawMaskOverlay(maskCanvas, maskCtxArg, colorHex, alpha) {
-        if (alpha <= 0) return;
-        var iw = maskCanvas.width;
-        var ih = maskCanvas.height;
-        // Composite: mask → color, then draw with alpha
-        tCtx.clearRect(0, 0, iw, ih);
-        tCtx.drawImage(maskCanvas, 0, 0);
-        tCtx.globalCompositeOperation = "source-in";
-        tCtx.fillStyle = colorHex;
-        tCtx.fillRect(0, 0, iw, ih);
-        tCtx.globalCompositeOperation = "source-over";
-
-        ctx.globalAlpha = alpha;
-        ctx.drawImage(tCanvas, 0, 0, iw, ih);
-        ctx.globalAlpha = 1;
+    // ── Mip pyramids ─────────────────────────────────────────────────
+    // levels[0] is the source (image or canvas); level k is a canvas of
+    // ceil(size / 2^k), each pixel the 2×2 average of level k-1.  Levels
+    // are built on first use and afterwards refreshed only over the rects
+    // invalidated since (dirty[k], in level-0 pixels), so a stroke costs
+    // a few small downsamples instead of a full-size one per frame.
+    // Closure-free apart from growRect and createCanvas.
+
+    // A canvas that also works in a worker.
+    function createCanvas(w, h) {
+        if (typeof document === "undefined") return new OffscreenCanvas(w, h);
+        var c = document.createElement("canvas");
+        c.width = w;
+        c.height = h;
+        return c;
+    }
+
+    function createPyramid(source) {
+        return { levels: [source], dirty: [null] };
+    }
+
+    function invalidatePyramid(pyramid, x0, y0, x1, y1) {
+        for (var k = 1; k < pyramid.levels.length; k++) {
+            pyramid.dirty[k] = growRect(pyramid.dirty[k], x0, y0, x1, y1);
+        }
+    }
+
+    // Frees the built levels, keeping the source; they are rebuilt on use.
+    function releasePyramid(pyramid) {
+        for (var k = 1; k < pyramid.levels.length; k++) releaseCanvas(pyramid.levels[k]);
+        pyramid.levels.length = 1;
+        pyramid.dirty.length = 1;
+    }
+
+    // Zero-sizing a canvas frees its backing store now rather than at GC.
+    function releaseCanvas(c) {
+        c.width = 0;
+        c.height = 0;
+    }
+
+    // Finest level that is still no larger than screen resolution.
+    function mipLevel(zoom, iw, ih) {
+        if (zoom >= 1) return 0;
+        var k = Math.floor(Math.log2(1 / zoom));
+        return Math.min(k, Math.floor(Math.log2(Math.max(iw, ih))));
+    }
+
+    // Returns level k of a pyramid over an iw × ih source, bringing levels
+    // 1..k up to date first.
+    function pyramidLevel(pyramid, k, iw, ih) {
+        for (var i = 1; i <= k; i++) {
+            var scale = 1 << i;
+            var lw = Math.ceil(iw / scale);
+            var lh = Math.ceil(ih / scale);
+            if (i === pyramid.levels.length) {
+                pyramid.levels.push(createCanvas(lw, lh));
+                pyramid.dirty.push([0, 0, iw, ih]);
+            }
+            var r = pyramid.dirty[i];
+            if (!r) continue;
+            pyramid.dirty[i] = null;
+            // Level-i pixels covering r, and the level-(i-1) pixels they average
+            var x0 = Math.floor(r[0] / scale);
+            var y0 = Math.floor(r[1] / scale);
+            var x1 = Math.min(lw, Math.ceil(r[2] / scale));
+            var y1 = Math.min(lh, Math.ceil(r[3] / scale));
+            var sw = Math.min(2 * (x1 - x0), Math.ceil(iw / (scale >> 1)) - 2 * x0);
+            var sh = Math.min(2 * (y1 - y0), Math.ceil(ih / (scale >> 1)) - 2 * y0);
+            var lctx = pyramid.levels[i].getContext("2d");
+            lctx.clearRect(x0, y0, x1 - x0, y1 - y0);
+            lctx.imageSmoothingEnabled = true;
+            // An odd-sized edge stretches its last column/row over a whole pixel
+            lctx.drawImage(pyramid.levels[i - 1], 2 * x0, 2 * y0, sw, sh, x0, y0, x1 - x0, y1 - y0);
+        }
+        return pyramid.levels[k];
+    }
+
+    // Draws the visible part of an iw × ih pyramid source through the
+    // view's zoom + pan transform, sampled from the level nearest the zoom.
+    function drawPyramid(target, pyramid, iw, ih, view) {
+        var k = mipLevel(view.zoom, iw, ih);
+        var scale = 1 << k;
+        var level = pyramidLevel(pyramid, k, iw, ih);
+        var z = view.zoom * scale;
+        // Visible source rect, in level pixels
+        var x0 = Math.max(0, Math.floor(-view.panX / z));
+        var y0 = Math.max(0, Math.floor(-view.panY / z));
+        var x1 = Math.min(Math.ceil(iw / scale), Math.ceil((target.canvas.width  - view.panX) / z));
+        var y1 = Math.min(Math.ceil(ih / scale), Math.ceil((target.canvas.height - view.panY) / z));
+        if (x0 >= x1 || y0 >= y1) return;
+        target.setTransform(z, 0, 0, z, view.panX, view.panY);
+        target.drawImage(level, x0, y0, x1 - x0, y1 - y0, x0, y0, x1 - x0, y1 - y0);
+    }
+
+    // Recomposes the dirty part of cutoutCanvas: the image kept (or, when
+    // inverted, removed) where the active layer's mask is set.  Switching
+    // layer or invert recomposes everything.
+    function updateCutout() {
+        var iw = labelW;
+        var ih = labelH;
+        var key = state.layer + (state.cutoutInvert ? ":invert" : "");
+        if (cutoutCanvas.width !== iw || cutoutCanvas.height !== ih) {
+            cutoutCanvas.width = iw;
+            cutoutCanvas.height = ih;
+            releasePyramid(cutoutPyramid);
+            state.cutoutKey = null;
+        }
+        if (state.cutoutKey !== key) {
+            state.cutoutKey = key;
+            state.cutoutRect = [0, 0, iw, ih];
+        }
+        var r = state.cutoutRect;
+        if (!r) return;
+        state.cutoutRect = null;
+        invalidatePyramid(cutoutPyramid, r[0], r[1], r[2], r[3]);
+        var bw = r[2] - r[0];
+        var bh = r[3] - r[1];
+        // Alpha mask of the active layer over the rect, from the label map
+        var opaque = TRIMAP_PIXELS[2];
+        var mask = createCanvas(bw, bh);
+        var mctx = mask.getContext("2d");
+        var img = mctx.createImageData(bw, bh);
+        composeTrimapRect(new Uint32Array(img.data.buffer), labels, labelW, r[0], r[1], r[2], r[3],
+                          new Uint32Array(state.layer === "foreground" ? [0, 0, opaque] : [0, opaque, opaque]));
+        mctx.putImageData(img, 0, 0);
+        cutoutCtx.save();
+        // destination-in clears everything outside the drawn source, so clip
+        cutoutCtx.beginPath();
+        cutoutCtx.rect(r[0], r[1], bw, bh);
+        cutoutCtx.clip();
+        cutoutCtx.clearRect(r[0], r[1], bw, bh);
+        cutoutCtx.drawImage(state.image, r[0], r[1], bw, bh, r[0], r[1], bw, bh);
+        cutoutCtx.globalCompositeOperation = state.cutoutInvert ? "destination-out" : "destination-in";
+        cutoutCtx.drawImage(mask, r[0], r[1]);
+        cutoutCtx.restore();
+    }
+
+    function drawCursor(canvasX, canvasY) {
+        var r = getBrushSize();
+        hudCtx.save();
+        hudCtx.setLineDash([3, 3]);
+        hudCtx.lineWidth = 1.5;
+        hudCtx.strokeStyle = state.tool === "eraser" ? "rgba(255,60,60,0.9)" : "rgba(255,255,255,0.9)";
+        hudCtx.beginPath();
+        hudCtx.arc(canvasX, canvasY, Math.max(1, r), 0, Math.PI * 2);
+        hudCtx.stroke();
+        hudCtx.restore();
+    }
+
+    // ── Drawing ──────────────────────────────────────────────────────
+
+    // Stamps queued by paintAt() since the last flushStamps(): centers as
+    // [x0, y0, x1, y1, ...], all with the same radius and label op.
+    var stampQueue = { centers: [], r: 0, value: 0, raise: true, edges: null, minEdge: 0 };
+
+    function paintAt(ix, iy) {
+        var r = getBrushSize() / state.zoom;
+        // Brush raises labels to the layer's class; eraser lowers them to the
+        // class below it (erasing unknown also erases fg, fg stays unknown).
+        // The edge brush always marks unknown, and only on strong edges.
+        var edge = state.tool === "edge";
+        if (edge && !edgeMapReady()) return;
+        var cls = edge || state.layer === "unknown" ? 1 : 2;
+        var erase = state.tool === "eraser";
+        var value = erase ? cls - 1 : cls;
+        var edges = edge ? edgeMap.data : null;
+        var q = stampQueue;
+        if (q.centers.length && (q.r !== r || q.value !== value || q.raise === erase ||
+                                 q.edges !== edges || q.minEdge !== state.edgeThreshold)) {
+            flushStamps();
+        }
+        q.r = r;
+        q.value = value;
+        q.raise = !erase;
+        q.edges = edges;
+        q.minEdge = state.edgeThreshold;
+        q.centers.push(ix, iy);
+    }
+
+    // Writes the queued stamps to the label map as one batch.  Input
+    // handlers flush once per event, i.e. once per frame of samples.
+    function flushStamps() {
+        var q = stampQueue;
+        if (q.centers.length === 0) return;
+        var rect = stampDisks(labels, labelW, labelH,
+                              q.centers, q.r, q.value, q.raise, q.edges, q.minEdge);
+        q.centers.length = 0;
+        if (rect) markMaskDirty(rect[0], rect[1], rect[2], rect[3]);
+    }
+
+    // ── Brush kernel ─────────────────────────────────────────────────
+    // Hard-edged disk stamps on the label map: pixel (x, y) is covered when
+    // its center lies within r of a stamp center — the same rule as
+    // rasterize_strokes() in Python, so replays are bit-exact.  The disks'
+    // spans are merged per row, so pixels shared by overlapping stamps
+    // (most of them, at 0.3 × r spacing) are written once per batch.
+    // raise=true sets covered labels to max(label, value), false to
+    // min(label, value).  With an edge map, only pixels whose edges[] is at
+    // least minEdge are written.  Returns the touched rect [x0, y0, x1, y1)
+    // or null.  Closure-free.
+    function stampDisks(labelData, w, h, centers, r, value, raise, edges, minEdge) {
+        var n = centers.length >> 1;
+        var r2 = r * r;
+        var cyMin = Infinity;
+        var cyMax = -Infinity;
+        for (var k = 1; k < centers.length; k += 2) {
+            if (centers[k] < cyMin) cyMin = centers[k];
+            if (centers[k] > cyMax) cyMax = centers[k];
+        }
+        var y0 = Math.max(0, Math.floor(cyMin - r - 1));
+        var y1 = Math.min(h, Math.ceil(cyMax + r + 1));
+        var spans = new Int32Array(n * 2);
+        var bx0 = w;
+        var bx1 = 0;
+        var by0 = h;
+        var by1 = 0;
+        for (var y = y0; y < y1; y++) {
+            // Each disk's span on this row, insertion-sorted by start
+            var m = 0;
+            for (var s = 0; s < n; s++) {
+                var cx = centers[2 * s];
+                var dy = y + 0.5 - centers[2 * s + 1];
+                var rem = r2 - dy * dy;
+                if (rem < 0) continue;
+                // Span estimate from the circle equation, then exact edge checks
+                var half = Math.sqrt(rem);
+                var xl = Math.max(0, Math.ceil(cx - half - 0.5));
+                var xr = Math.min(w - 1, Math.floor(cx + half - 0.5));
+                var dx;
+                while (xl <= xr && (dx = xl + 0.5 - cx, dy * dy + dx * dx > r2)) xl++;
+                while (xl > 0 && (dx = xl - 0.5 - cx, dy * dy + dx * dx <= r2)) xl--;
+                while (xr >= xl && (dx = xr + 0.5 - cx, dy * dy + dx * dx > r2)) xr--;
+                while (xr < w - 1 && (dx = xr + 1.5 - cx, dy * dy + dx * dx <= r2)) xr++;
+                if (xl > xr) continue;
+                var j = m++;
+                while (j > 0 && spans[2 * j - 2] > xl) {
+                    spans[2 * j] = spans[2 * j - 2];
+                    spans[2 * j + 1] = spans[2 * j - 1];
+                    j--;
+                }
+                spans[2 * j] = xl;
+                spans[2 * j + 1] = xr;
+            }
+            if (m === 0) continue;
+            // Merge overlapping or adjacent spans and write each run once
+            var row = y * w;
+            var a = spans[0];
+            var b = spans[1];
+            for (var t = 1; t <= m; t++) {
+                if (t < m && spans[2 * t] <= b + 1) {
+                    if (spans[2 * t + 1] > b) b = spans[2 * t + 1];
+                    continue;
+                }
+                for (var i = row + a; i <= row + b; i++) {
+                    if (edges && edges[i] < minEdge) continue;
+                    if (raise ? labelData[i] < value : labelData[i] > value) labelData[i] = value;
+                }
+                if (t < m) {
+                    a = spans[2 * t];
+                    b = spans[2 * t + 1];
+                }
+            }
+            // Sorted and merged: the first start and the last end are extremes
+            if (spans[0] < bx0) bx0 = spans[0];
+            if (b + 1 > bx1) bx1 = b + 1;
+            if (y < by0) by0 = y;
+            by1 = y + 1;
+        }
+        if (bx0 >= bx1) return null;
+        return [bx0, by0, bx1, by1];
+    }
+
+    // Start a stroke at (ix, iy): paints the initial dot and opens a log op.
+    function strokeDot(ix, iy) {
+        paintAt(ix, iy);
+        logStrokeStart(ix, iy);
+    }
+
+    // Extend the current stroke from (lastIX, lastIY) to (ix, iy).
+    function strokeTo(ix, iy) {
+        var op = state.activeStroke;
+        if (op && op.r !== getBrushSize() / state.zoom) {
+            // Zoom changed mid-stroke: the log records one radius per op,
+            // so restart the op (with its dot) at the current point.
+            strokeDot(state.lastIX, state.lastIY);
+        }
+        paintInterpolated(state.lastIX, state.lastIY, ix, iy);
+        if (state.activeStroke) state.activeStroke.pts.push(ix, iy);
+        state.lastIX = ix;
+        state.lastIY = iy;
+    }
+
+    function paintInterpolated(x0, y0, x1, y1) {
+        var dx = x1 - x0;
+        var dy = y1 - y0;
+        var dist = Math.sqrt(dx * dx + dy * dy);
+        var imageRadius = getBrushSize() / state.zoom;
+        var steps = Math.max(1, Math.ceil(dist / (imageRadius * 0.3)));
+        for (var i = 1; i <= steps; i++) {
+            var t = i / steps;
+            paintAt(x0 + dx * t, y0 + dy * t);
+        }
+    }
+
+    // ── Flood fill (bucket tool) ────────────────────────────────────
+
+    // Fills the 4-connected region around (ix, iy) that is below the
+    // active layer's class.  Large fills are time-sliced; done() runs once
+    // the fill has finished.  Returns false if nothing was filled.
+    function floodFillAt(ix, iy, done) {
+        var px = Math.floor(ix);
+        var py = Math.floor(iy);
+        var w = labelW;
+        var h = labelH;
+        if (px < 0 || px >= w || py < 0 || py >= h) return false;
+        if (state.fillJob) return false;
+
+        // Fg fills claim background and unknown; unknown fills claim background
+        var cls = state.layer === "foreground" ? 2 : 1;
+        if (labels[py * w + px] >= cls) return false;
+        logOp({ op: "fill", layer: state.layer, x: px, y: py });
+
+        var job = {
+            stack: [py * w + px],
+            x0: px, y0: py, x1: px, y1: py,  // inclusive bbox of filled pixels
+            data: labels,  // filled in place: values below limit become fillValue
+            limit: cls,
+            fillValue: cls,
+            w: w,
+            h: h,
+            finish: null,  // writes the result back into the label map
+            done: done,
+        };
+        state.fillJob = job;
+        runFillSlice(job);
+        return true;
+    }
+
+    // Magic wand: fills the 4-connected region whose image colour is within
+    // state.wandTolerance of the clicked pixel into the active layer.  The
+    // same time-sliced fill as the bucket, run over a colour-match mask
+    // that is itself built in slices first (see runFillSlice()), into a
+    // scratch buffer reused between clicks.
+    // Returns false if nothing was filled (or the image can't be read).
+    function wandFillAt(ix, iy, done) {
+        var px = Math.floor(ix);
+        var py = Math.floor(iy);
+        var w = labelW;
+        var h = labelH;
+        if (px < 0 || px >= w || py < 0 || py >= h) return false;
+        if (state.fillJob) return false;
+        var rgba = getImagePixels();
+        if (!rgba) return false;
+
+        var cls = state.layer === "foreground" ? 2 : 1;
+        if (!wandMask || wandMask.length !== w * h) wandMask = new Uint8Array(w * h);
+        var mask = wandMask;
+        var seed = py * w + px;
+        var tol = state.wandTolerance;
+        var scanned = 0;
+        var job = {
+            stack: [py * w + px],
+            x0: px, y0: py, x1: px, y1: py,
+            data: mask,  // 0 matching, 1 not; filled pixels become 2
+            limit: 1,
+            fillValue: 2,
+            w: w,
+            h: h,
+            prepare: function (deadline) {
+                while (scanned < mask.length) {
+                    var end = Math.min(scanned + WAND_SCAN_CHUNK, mask.length);
+                    colorMatchMask(rgba, seed, tol, mask, scanned, end);
+                    scanned = end;
+                    if (performance.now() > deadline) break;
+                }
+                return scanned === mask.length;
+            },
+            finish: function (job) {
+                for (var y = job.y0; y <= job.y1; y++) {
+                    for (var i = y * w + job.x0, end = y * w + job.x1; i <= end; i++) {
+                        if (mask[i] === 2 && labels[i] < cls) labels[i] = cls;
+                    }
+                }
+            },
+            done: function () {
+                // The replay has no image to match colours against
+                logKeyframe();
+                if (done) done();
+            },
+        };
+        state.fillJob = job;
+        runFillSlice(job);
+        return true;
+    }
+
+    // A job's prepare(deadline), if any, runs in slices first and returns
+    // true once done.
+    function runFillSlice(job) {
+        if (state.fillJob !== job) return;  // cancelled by a new image
+        var deadline = performance.now() + FILL_SLICE_MS;
+        if (job.prepare && job.prepare(deadline)) job.prepare = null;
+        if (job.prepare || !scanlineFill(job, job.data, 1, job.limit, job.fillValue, job.w, job.h, deadline)) {
+            updateCursor();
+            setTimeout(runFillSlice, 0, job);
+            return;
+        }
+        state.fillJob = null;
+        updateCursor();
+        if (job.finish) job.finish(job);
+        markMaskDirty(job.x0, job.y0, job.x1 + 1, job.y1 + 1);
+        if (job.done) job.done();
+    }
+
+    // RGBA pixels of state.image, read back once per image and kept until
+    // the display is released.  null for a cross-origin image without CORS.
+    var imagePixels = null;  // {image, data}
+    var wandMask = null;     // wandFillAt() scratch, label-map sized
+
+    function getImagePixels() {
+        if (imagePixels && imagePixels.image === state.image) return imagePixels.data;
+        imagePixels = null;
+        if (state.image.released) return null;
+        var iw = state.image.width;
+        var ih = state.image.height;
+        var c = createCanvas(iw, ih);
+        var cctx = c.getContext("2d", { willReadFrequently: true });
+        cctx.drawImage(state.image, 0, 0);
+        var data;
+        try {
+            data = cctx.getImageData(0, 0, iw, ih).data;
+        } catch (e) {
+            return null;
+        } finally {
+            releaseCanvas(c);
+        }
+        imagePixels = { image: state.image, data: data };
+        return data;
+    }
+
+    // Sets out[i] for start <= i < end to 0 where pixel i of rgba is
+    // within tol of the seed pixel's colour (every RGB channel), else 1 —
+    // a scanlineFill() mask.  Closure-free.
+    function colorMatchMask(rgba, seed, tol, out, start, end) {
+        var r = rgba[seed * 4];
+        var g = rgba[seed * 4 + 1];
+        var b = rgba[seed * 4 + 2];
+        for (var i = start, j = start * 4; i < end; i++, j += 4) {
+            var dr = rgba[j] - r;
+            var dg = rgba[j + 1] - g;
+            var db = rgba[j + 2] - b;
+            out[i] = dr <= tol && dr >= -tol && dg <= tol && dg >= -tol && db <= tol && db >= -tol ? 0 : 1;
+        }
+    }
+
+    // ── Edge map (edge brush) ────────────────────────────────────────
+    // Per-pixel edge strength of the image, computed once per image in a
+    // worker (on this thread without Worker / OffscreenCanvas) as soon as
+    // the edge brush is picked or hovers the canvas.  Until it arrives the
+    // edge brush shows a busy cursor and doesn't paint.
+
+    var edgeMap = null;  // {image, data: Uint8Array, failed}; data null while pending
+
+    function edgeMapReady() {
+        return !!(edgeMap && edgeMap.image === state.image && edgeMap.data);
+    }
+
+    function edgeMapPending() {
+        return state.tool === "edge" && !!state.image && !edgeMapReady() && !(edgeMap && edgeMap.failed);
+    }
+
+    function requestEdgeMap() {
+        if (!state.image || state.image.released || (edgeMap && edgeMap.image === state.image)) return;
+        var job = edgeMap = { image: state.image, data: null, failed: false };
+        function finish(data) {
+            if (edgeMap !== job) return;  // image replaced or display released
+            job.data = data;
+            job.failed = !data;
+            updateCursor();
+        }
+        if (typeof Worker === "undefined" || typeof OffscreenCanvas === "undefined") {
+            var rgba = getImagePixels();
+            finish(rgba ? sobelMagnitude(rgba, job.image.width, job.image.height) : null);
+            return;
+        }
+        // The worker gets its own copy of the bitmap and reads it back there
+        createImageBitmap(job.image).then(function (copy) {
+            var worker = createKernelWorker([sobelMagnitude], edgeWorkerMain);
+            worker.onmessage = function (e) {
+                worker.terminate();
+                finish(e.data);
+            };
+            worker.onerror = function () {
+                worker.terminate();
+                var pixels = edgeMap === job ? getImagePixels() : null;
+                finish(pixels ? sobelMagnitude(pixels, job.image.width, job.image.height) : null);
+            };
+            worker.postMessage(copy, [copy]);
+        }, function () { finish(null); });
+        updateCursor();
+    }
+
+    // Worker entry point: ImageBitmap in, edge map (or null if the image
+    // is unreadable) out.
+    function edgeWorkerMain() {
+        self.onmessage = function (e) {
+            var bitmap = e.data;
+            var oc = new OffscreenCanvas(bitmap.width, bitmap.height);
+            var octx = oc.getContext("2d");
+            octx.drawImage(bitmap, 0, 0);
+            bitmap.close();
+            var out = null;
+            try {
+                out = sobelMagnitude(octx.getImageData(0, 0, oc.width, oc.height).data, oc.width, oc.height);
+            } catch (err) {
+                // Cross-origin image without CORS
+            }
+            self.postMessage(out, out ? [out.buffer] : []);
+        };
+    }
+
+    // Sobel gradient magnitude, the largest over the RGB channels, scaled
+    // so a hard 0→255 step reads 255 (clamped).  Edge pixels repeat the
+    // border.  Closure-free.
+    function sobelMagnitude(rgba, w, h) {
+        var out = new Uint8Array(w * h);
+        for (var y = 0; y < h; y++) {
+            var up = (y > 0 ? y - 1 : y) * w;
+            var mid = y * w;
+            var down = (y < h - 1 ? y + 1 : y) * w;
+            for (var x = 0; x < w; x++) {
+                var l = x > 0 ? x - 1 : x;
+                var r = x < w - 1 ? x + 1 : x;
+                var best = 0;
+                for (var c = 0; c < 3; c++) {
+                    var tl = rgba[(up + l) * 4 + c];
+                    var tr = rgba[(up + r) * 4 + c];
+                    var bl = rgba[(down + l) * 4 + c];
+                    var br = rgba[(down + r) * 4 + c];
+                    var gx = tr + 2 * rgba[(mid + r) * 4 + c] + br - tl - 2 * rgba[(mid + l) * 4 + c] - bl;
+                    var gy = bl + 2 * rgba[(down + x) * 4 + c] + br - tl - 2 * rgba[(up + x) * 4 + c] - tr;
+                    var m = gx * gx + gy * gy;
+                    if (m > best) best = m;
+                }
+                out[mid + x] = Math.min(255, Math.sqrt(best) / 4);
+            }
+        }
+        return out;
+    }
+
+    // ── Matte preview ────────────────────────────────────────────────
+    // The matte view shows an approximate alpha matte: the unknown band
+    // solved by solveMatte() against the image.  The solve runs in a
+    // worker that keeps the image's luminance between solves (on this
+    // thread without Worker / OffscreenCanvas).  Edits grow
+    // state.matteRect; once no stroke or fill is in progress the next
+    // render re-solves around it and the result is drawn into
+    // matteCanvas.  One solve runs at a time; edits made meanwhile are
+    // picked up by the render that follows its result.
+
+    var matte = null;  // {image, worker, ready, guide, busy}; guide only without a worker
+    var matteWorkerFailed = false;
+
+    // Re-solves the changed part of the matte if it's stale and no
+    // solve, stroke or fill is in progress.  Called by render() in matte view.
+    function updateMatte() {
+        var iw = labelW;
+        var ih = labelH;
+        if (matteCanvas.width !== iw || matteCanvas.height !== ih) {
+            matteCanvas.width = iw;
+            matteCanvas.height = ih;
+            releasePyramid(mattePyramid);
+            state.matteRect = [0, 0, iw, ih];
+        }
+        if (!matte || matte.image !== state.image) {
+            releaseMatteSolver();
+            matte = { image: state.image, worker: null, ready: null, guide: undefined, busy: false, start: 0 };
+            state.matteRect = [0, 0, iw, ih];
+        }
+        if (!state.matteRect || matte.busy || state.isDrawing || state.fillJob) return;
+        var rect = state.matteRect;
+        state.matteRect = null;
+        matte.busy = true;
+        var job = matte;
+        job.start = performance.now();
+        if (matteWorkerFailed || typeof Worker === "undefined" || typeof OffscreenCanvas === "undefined") {
+            if (job.guide === undefined) {
+                var rgba = getImagePixels();
+                job.guide = rgba ? matteGuide(rgba) : null;
+            }
+            finishMatte(job, solveMatte(job.guide, labels, iw, ih, rect, MATTE_COLOR_RADIUS,
+                                        MATTE_RADIUS, MATTE_EPS, MATTE_ITERATIONS, MATTE_TILE));
+            return;
+        }
+        if (!job.worker) {
+            job.worker = createKernelWorker([matteGuide, boxMean, solveMatte, solveMatteTile], matteWorkerMain);
+            job.worker.onmessage = function (e) { finishMatte(job, e.data); };
+            job.worker.onerror = function () {
+                // Redo the whole matte on this thread
+                matteWorkerFailed = true;
+                job.worker.terminate();
+                if (matte !== job) return;
+                matte = null;
+                requestRender(LAYER_CONTENT);
+            };
+            // The worker gets its own copy of the bitmap and reads it back
+            // there; solves are posted after it
+            job.ready = createImageBitmap(job.image).then(function (copy) {
+                job.worker.postMessage({ type: "image", bitmap: copy }, [copy]);
+            }, function () {
+                job.worker.postMessage({ type: "image", bitmap: null });
+            });
+        }
+        var copy = labels.slice();
+        job.ready.then(function () {
+            job.worker.postMessage({
+                type: "solve", labels: copy.buffer, width: iw, height: ih, rect: rect,
+                colorRadius: MATTE_COLOR_RADIUS, radius: MATTE_RADIUS, eps: MATTE_EPS,
+                iterations: MATTE_ITERATIONS, tile: MATTE_TILE,
+            }, [copy.buffer]);
+        });
+    }
+
+    // Draws a solve result ({rect, alpha}) into matteCanvas.
+    function finishMatte(job, result) {
+        job.busy = false;
+        if (matte !== job || matteCanvas.width !== labelW || matteCanvas.height !== labelH) return;
+        if (profiler) profileSince("matte", job.start);
+        var r = result.rect;
+        var bw = r[2] - r[0];
+        var bh = r[3] - r[1];
+        var out = matteCtx.createImageData(bw, bh);
+        var px = out.data;
+        for (var i = 0, j = 0; i < result.alpha.length; i++, j += 4) {
+            px[j] = px[j + 1] = px[j + 2] = result.alpha[i];
+            px[j + 3] = 255;
+        }
+        matteCtx.putImageData(out, r[0], r[1]);
+        invalidatePyramid(mattePyramid, r[0], r[1], r[2], r[3]);
+        if (state.showMatte) requestRender(LAYER_CONTENT);
+    }
+
+    function releaseMatteSolver() {
+        if (matte && matte.worker) matte.worker.terminate();
+        matte = null;
+    }
+
+    // Worker entry point: {type: "image", bitmap} sets the image (bitmap
+    // null if unreadable); {type: "solve", ...solveMatte() arguments}
+    // replies with its {rect, alpha}.
+    function matteWorkerMain() {
+        var guide = null;
+        self.onmessage = function (e) {
+            var msg = e.data;
+            if (msg.type === "image") {
+                guide = null;
+                var bitmap = msg.bitmap;
+                if (!bitmap) return;
+                var oc = new OffscreenCanvas(bitmap.width, bitmap.height);
+                var octx = oc.getContext("2d");
+                octx.drawImage(bitmap, 0, 0);
+                bitmap.close();
+                try {
+                    guide = matteGuide(octx.getImageData(0, 0, oc.width, oc.height).data);
+                } catch (err) {
+                    // Cross-origin image without CORS
+                }
+                return;
+            }
+            var res = solveMatte(guide, new Uint8Array(msg.labels), msg.width, msg.height, msg.rect,
+                                 msg.colorRadius, msg.radius, msg.eps, msg.iterations, msg.tile);
+            self.postMessage(res, [res.alpha.buffer]);
+        };
+    }
+
+    // ── Matte kernels ────────────────────────────────────────────────
+    // Each unknown pixel starts from a local colour-line estimate,
+    // alpha = (I - B) / (F - B) with F and B the mean luminance of the
+    // known foreground and background within colorRadius px (0.5 where
+    // either is missing or they match).  Guided-filter passes (He et al.)
+    // against the luminance then smooth that estimate along image edges,
+    // known pixels staying 0 / 1.  All of it is box sums, so the cost is
+    // linear in the window and independent of the radii.  An edit only
+    // changes unknown pixels within colorRadius + iterations * 2 * radius
+    // of it, and solving a window that much larger than them gives the
+    // same values as solving the whole image.  Closure-free.
+
+    // 8-bit luminance of RGBA pixels (a quarter of the size of floats;
+    // the solver scales it to 0..1 per window).
+    function matteGuide(rgba) {
+        var out = new Uint8Array(rgba.length >> 2);
+        for (var i = 0, j = 0; i < out.length; i++, j += 4) {
+            out[i] = Math.round(0.299 * rgba[j] + 0.587 * rgba[j + 1] + 0.114 * rgba[j + 2]);
+        }
+        return out;
+    }
+
+    // Sum of src over the (2r + 1)² box around each pixel of a w × h
+    // grid, the box clipped at the edges, into out (which may be src);
+    // divided by the box area when mean is set.  Running sums along rows,
+    // then per column a row at a time, so the cost doesn't depend on r.
+    // tmp is w × h scratch.
+    function boxMean(src, w, h, r, out, tmp, mean) {
+        var x, y, row, s;
+        for (y = 0; y < h; y++) {
+            row = y * w;
+            s = 0;
+            for (x = 0; x < r && x < w; x++) s += src[row + x];
+            for (x = 0; x < w; x++) {
+                if (x + r < w) s += src[row + x + r];
+                if (x > r) s -= src[row + x - r - 1];
+                tmp[row + x] = s;
+            }
+        }
+        var col = new Float64Array(w);
+        var nx = new Float64Array(w);
+        for (x = 0; x < w; x++) nx[x] = mean ? Math.min(x + r, w - 1) - Math.max(x - r, 0) + 1 : 1;
+        for (y = 0; y < r && y < h; y++) {
+            for (x = 0, row = y * w; x < w; x++) col[x] += tmp[row + x];
+        }
+        for (y = 0; y < h; y++) {
+            if (y + r < h) {
+                for (x = 0, row = (y + r) * w; x < w; x++) col[x] += tmp[row + x];
+            }
+            if (y > r) {
+                for (x = 0, row = (y - r - 1) * w; x < w; x++) col[x] -= tmp[row + x];
+            }
+            var ny = mean ? Math.min(y + r, h - 1) - Math.max(y - r, 0) + 1 : 1;
+            for (x = 0, row = y * w; x < w; x++) out[row + x] = col[x] / (nx[x] * ny);
+        }
+        return out;
+    }
+
+    // Approximate alpha (0..255) over rect = [x0, y0, x1, y1) grown by
+    // the reach of an edit: background 0, foreground 255 and unknown
+    // solved against guide (left at 128 when guide is null).  Returns
+    // {rect, alpha} for the grown rect.  Solved in tile × tile pieces,
+    // each with its own window, so scratch memory stays bounded however
+    // large the rect (tiles overlap only in the context they read).
+    function solveMatte(guide, labelData, w, h, rect, colorRadius, r, eps, iterations, tile) {
+        var rc = Math.max(colorRadius, 2 * r);
+        var reach = rc + iterations * 2 * r;
+        var ox0 = Math.max(rect[0] - reach, 0);
+        var oy0 = Math.max(rect[1] - reach, 0);
+        var ox1 = Math.min(rect[2] + reach, w);
+        var oy1 = Math.min(rect[3] + reach, h);
+        var ow = ox1 - ox0;
+        var alpha = new Uint8Array(ow * (oy1 - oy0));
+        var x, y, i, k;
+        for (y = oy0; y < oy1; y++) {
+            for (x = ox0, i = y * w + x, k = (y - oy0) * ow; x < ox1; x++, i++, k++) {
+                alpha[k] = labelData[i] === 2 ? 255 : labelData[i] === 1 ? 128 : 0;
+            }
+        }
+        var result = { rect: [ox0, oy0, ox1, oy1], alpha: alpha };
+        if (!guide) return result;
+        var scratch = {};
+        for (var ty = oy0; ty < oy1; ty += tile) {
+            for (var tx = ox0; tx < ox1; tx += tile) {
+                solveMatteTile(guide, labelData, w, h, [tx, ty, Math.min(tx + tile, ox1), Math.min(ty + tile, oy1)],
+                               rc, reach, r, eps, iterations, result, scratch);
+            }
+        }
+        return result;
+    }
+
+    // Solves the unknown pixels of t = [x0, y0, x1, y1) (inside
+    // result.rect) into result.alpha.  scratch keeps the window buffers
+    // between tiles.
+    function solveMatteTile(guide, labelData, w, h, t, rc, reach, r, eps, iterations, result, scratch) {
+        var ox0 = result.rect[0];
+        var oy0 = result.rect[1];
+        var ow = result.rect[2] - ox0;
+        var alpha = result.alpha;
+        var x, y, i, k;
+
+        // Window: the unknown pixels that affect the tile, plus the
+        // context each one's estimate reads
+        var sx0 = Math.max(t[0] - reach, 0);
+        var sy0 = Math.max(t[1] - reach, 0);
+        var sx1 = Math.min(t[2] + reach, w);
+        var sy1 = Math.min(t[3] + reach, h);
+        var ux0 = sx1, uy0 = sy1, ux1 = -1, uy1 = -1;
+        for (y = sy0; y < sy1; y++) {
+            for (x = sx0, i = y * w + x; x < sx1; x++, i++) {
+                if (labelData[i] !== 1) continue;
+                if (x < ux0) ux0 = x;
+                if (x > ux1) ux1 = x;
+                if (y < uy0) uy0 = y;
+                uy1 = y;
+            }
+        }
+        if (ux1 < 0) return;
+        var wx0 = Math.max(ux0 - rc, sx0);
+        var wy0 = Math.max(uy0 - rc, sy0);
+        var wx1 = Math.min(ux1 + 1 + rc, sx1);
+        var wy1 = Math.min(uy1 + 1 + rc, sy1);
+        var ww = wx1 - wx0;
+        var wh = wy1 - wy0;
+        var n = ww * wh;
+        if (!scratch.unknown || scratch.unknown.length < n) {
+            scratch.unknown = new Uint8Array(n);
+            scratch.f = [];
+            for (k = 0; k < 9; k++) scratch.f.push(new Float32Array(n));
+        }
+        var unknown = scratch.unknown.subarray(0, n);
+        var f = scratch.f.map(function (buf) { return buf.subarray(0, n); });
+        var I = f[0];
+        var p = f[1];
+        var tmp = f[2];
+        var fgSum = f[3];  // then fg count, F
+        var bgSum = f[4];  // then bg count, B
+        var fgN = f[5];
+        var bgN = f[6];
+        for (y = wy0, k = 0; y < wy1; y++) {
+            for (x = wx0, i = y * w + x; x < wx1; x++, i++, k++) {
+                var v = guide[i] / 255;
+                var lab = labelData[i];
+                I[k] = v;
+                unknown[k] = lab === 1 ? 1 : 0;
+                p[k] = lab === 2 ? 1 : 0;
+                fgSum[k] = lab === 2 ? v : 0;
+                bgSum[k] = lab === 0 ? v : 0;
+                fgN[k] = lab === 2 ? 1 : 0;
+                bgN[k] = lab === 0 ? 1 : 0;
+            }
+        }
+        boxMean(fgSum, ww, wh, rc, fgSum, tmp, false);
+        boxMean(bgSum, ww, wh, rc, bgSum, tmp, false);
+        boxMean(fgN, ww, wh, rc, fgN, tmp, false);
+        boxMean(bgN, ww, wh, rc, bgN, tmp, false);
+        for (k = 0; k < n; k++) {
+            if (!unknown[k]) continue;
+            p[k] = 0.5;
+            if (fgN[k] < 0.5 || bgN[k] < 0.5) continue;
+            var F = fgSum[k] / fgN[k];
+            var B = bgSum[k] / bgN[k];
+            if (Math.abs(F - B) < 0.02) continue;
+            var est = (I[k] - B) / (F - B);
+            p[k] = est < 0 ? 0 : est > 1 ? 1 : est;
+        }
+
+        var meanI = boxMean(I, ww, wh, r, f[7], tmp, true);
+        var varI = f[8];
+        for (k = 0; k < n; k++) varI[k] = I[k] * I[k];
+        boxMean(varI, ww, wh, r, varI, tmp, true);
+        for (k = 0; k < n; k++) varI[k] -= meanI[k] * meanI[k];
+        var meanP = fgN;  // reused scratch
+        var a = fgSum;
+        var b = bgSum;
+        for (var it = 0; it < iterations; it++) {
+            boxMean(p, ww, wh, r, meanP, tmp, true);
+            for (k = 0; k < n; k++) a[k] = I[k] * p[k];
+            boxMean(a, ww, wh, r, a, tmp, true);
+            for (k = 0; k < n; k++) {
+                a[k] = (a[k] - meanI[k] * meanP[k]) / (varI[k] + eps);
+                b[k] = meanP[k] - a[k] * meanI[k];
+            }
+            boxMean(a, ww, wh, r, a, tmp, true);
+            boxMean(b, ww, wh, r, b, tmp, true);
+            for (k = 0; k < n; k++) {
+                if (!unknown[k]) continue;
+                var q = a[k] * I[k] + b[k];
+                p[k] = q < 0 ? 0 : q > 1 ? 1 : q;
+            }
+        }
+
+        // Solved unknown pixels inside the tile
+        for (y = Math.max(wy0, t[1]); y < Math.min(wy1, t[3]); y++) {
+            for (x = Math.max(wx0, t[0]); x < Math.min(wx1, t[2]); x++) {
+                k = (y - wy0) * ww + (x - wx0);
+                if (unknown[k]) alpha[(y - oy0) * ow + (x - ox0)] = Math.round(p[k] * 255);
+            }
+        }
+    }
+
+    // ── Fill kernel ──────────────────────────────────────────────────
+    // Scanline flood fill over a typed array.  Each pixel is `stride`
+    // bytes and its last byte is tested: values below `limit` are
+    // fillable.  Filled pixels get every byte set to fillValue (>= limit),
+    // so the array doubles as the visited set.  Seeds are popped from
+    // job.stack; each claims its whole horizontal run and pushes only the
+    // run starts on the rows above and below.  job.x0..y1 grows to the
+    // filled bbox.  Returns false if `deadline` (performance.now() ms)
+    // passed first — call again with the same job to resume.
+    // Closure-free so it can be shipped to a worker via toString().
+    function scanlineFill(job, data, stride, limit, fillValue, w, h, deadline) {
+        var stack = job.stack;
+        var off = stride - 1;
+        var n = 0;
+        while (stack.length > 0) {
+            if ((++n & 63) === 0 && performance.now() > deadline) return false;
+            var seed = stack.pop();
+            var y = Math.floor(seed / w);
+            var row = y * w;
+            var l = seed - row;
+            if (data[seed * stride + off] >= limit) continue;
+            var r = l;
+            while (l > 0 && data[(row + l - 1) * stride + off] < limit) l--;
+            while (r < w - 1 && data[(row + r + 1) * stride + off] < limit) r++;
+            for (var i = (row + l) * stride, end = (row + r + 1) * stride; i < end; i++) {
+                data[i] = fillValue;
+            }
+            if (l < job.x0) job.x0 = l;
+            if (r > job.x1) job.x1 = r;
+            if (y < job.y0) job.y0 = y;
+            if (y > job.y1) job.y1 = y;
+
+            for (var ny = y - 1; ny <= y + 1; ny += 2) {
+                if (ny < 0 || ny >= h) continue;
+                var nrow = ny * w;
+                var inRun = false;
+                for (var x = l; x <= r; x++) {
+                    var open = data[(nrow + x) * stride + off] < limit;
+                    if (open && !inRun) stack.push(nrow + x);
+                    inRun = open;
+                }
+            }
+        }
+        return true;
+    }
+
+    // ── Grow / shrink ────────────────────────────────────────────────
+
+    // Grows (dilates) or shrinks (erodes) the active layer by
+    // state.morphSize image pixels, as one history entry.  Growing
+    // foreground also claims unknown; shrinking it leaves unknown behind,
+    // and shrinking unknown takes foreground with it, so fg ⊆ unknown holds.
+    function morphActiveLayer(grow) {
+        if (!state.image || state.isDrawing || state.fillJob || state.historyLoading) return;
+        var r = state.morphSize;
+        var cls = state.layer === "foreground" ? 2 : 1;
+        if (state.historyIndex < 0) snapshotHistory();
+        var rect = morphLabels(labels, labelW, labelH, cls, grow, r);
+        if (!rect) return;
+        logOp({ op: grow ? "grow" : "shrink", layer: state.layer, r: r });
+        markMaskDirty(rect[0], rect[1], rect[2], rect[3]);
+        snapshotHistory();
+        scheduleCommit();
+        requestRender(editLayers());
+    }
+
+    // ── Hole filling / island removal ────────────────────────────────
+
+    // Fills every hole in the active layer (a pocket of lower classes the
+    // layer fully encloses) or, with holes false, removes its islands
+    // smaller than state.islandSize pixels, as one history entry.
+    function cleanupActiveLayer(holes) {
+        if (!state.image || state.isDrawing || state.fillJob || state.historyLoading) return;
+        var cls = state.layer === "foreground" ? 2 : 1;
+        var size = state.islandSize;
+        if (state.historyIndex < 0) snapshotHistory();
+        var rect = holes
+            ? fillHoles(labels, labelW, labelH, cls)
+            : removeIslands(labels, labelW, labelH, cls, size);
+        if (!rect) return;
+        logOp(holes
+            ? { op: "fill_holes", layer: state.layer }
+            : { op: "remove_islands", layer: state.layer, size: size });
+        markMaskDirty(rect[0], rect[1], rect[2], rect[3]);
+        snapshotHistory();
+        scheduleCommit();
+        requestRender(editLayers());
+    }
+
+    // ── Connected-component kernels ──────────────────────────────────
+    // One two-pass labelling (union-find on provisional ids) per click,
+    // linear in the label map and touching nothing but it.  The class is
+    // 8-connected and its complement 4-connected, so a diagonal wall still
+    // encloses a hole, as it stops the fill tool.  Same rules as
+    // trimap_editor.rasterize_strokes().  Closure-free.
+
+    // Labels the connected components of the pixels where
+    // (labelData[i] >= cls) === inside.  Returns {ids, count, sizes,
+    // border}: ids[i] is pixel i's component (1..count, 0 outside the
+    // set), sizes[c] its pixel count and border[c] 1 if it touches the
+    // image edge.
+    function labelComponents(labelData, w, h, cls, inside, eight) {
+        var ids = new Int32Array(w * h);
+        var parent = new Int32Array(1024);
+        var next = 1;
+
+        function find(a) {
+            while (parent[a] !== a) {
+                parent[a] = parent[parent[a]];
+                a = parent[a];
+            }
+            return a;
+        }
+
+        // The smaller root wins, so a root always precedes its members
+        function union(a, b) {
+            a = find(a);
+            b = find(b);
+            if (a < b) { parent[b] = a; return a; }
+            parent[a] = b;
+            return b;
+        }
+
+        var x, y, i;
+        for (y = 0; y < h; y++) {
+            var row = y * w;
+            for (x = 0; x < w; x++) {
+                i = row + x;
+                if ((labelData[i] >= cls) !== inside) continue;
+                var id = x > 0 ? ids[i - 1] : 0;
+                if (y > 0) {
+                    var up = ids[i - w];
+                    if (up) id = id ? union(id, up) : up;
+                    if (eight) {
+                        var ul = x > 0 ? ids[i - w - 1] : 0;
+                        var ur = x < w - 1 ? ids[i - w + 1] : 0;
+                        if (ul) id = id ? union(id, ul) : ul;
+                        if (ur) id = id ? union(id, ur) : ur;
+                    }
+                }
+                if (!id) {
+                    if (next === parent.length) {
+                        var grown = new Int32Array(parent.length * 2);
+                        grown.set(parent);
+                        parent = grown;
+                    }
+                    parent[next] = next;
+                    id = next++;
+                }
+                ids[i] = id;
+            }
+        }
+
+        // Number the roots consecutively
+        var remap = new Int32Array(next);
+        var count = 0;
+        for (var c = 1; c < next; c++) {
+            var root = find(c);
+            remap[c] = root === c ? ++count : remap[root];
+        }
+
+        var sizes = new Int32Array(count + 1);
+        var border = new Uint8Array(count + 1);
+        for (y = 0; y < h; y++) {
+            var edgeRow = y === 0 || y === h - 1;
+            for (x = 0, i = y * w; x < w; x++, i++) {
+                if (!ids[i]) continue;
+                var comp = remap[ids[i]];
+                ids[i] = comp;
+                sizes[comp]++;
+                if (edgeRow || x === 0 || x === w - 1) border[comp] = 1;
+            }
+        }
+        return { ids: ids, count: count, sizes: sizes, border: border };
+    }
+
+    // Raises every component of the lower classes that doesn't touch the
+    // image edge to cls.  Returns the changed rect [x0, y0, x1, y1), or
+    // null if there were no holes.
+    function fillHoles(labelData, w, h, cls) {
+        var cc = labelComponents(labelData, w, h, cls, false, false);
+        var x0 = w, y0 = h, x1 = -1, y1 = -1;
+        for (var y = 0; y < h; y++) {
+            for (var x = 0, i = y * w; x < w; x++, i++) {
+                var c = cc.ids[i];
+                if (!c || cc.border[c]) continue;
+                labelData[i] = cls;
+                if (x < x0) x0 = x;
+                if (x > x1) x1 = x;
+                if (y < y0) y0 = y;
+                y1 = y;
+            }
+        }
+        return x1 < 0 ? null : [x0, y0, x1 + 1, y1 + 1];
+    }
+
+    // Lowers every component of class cls (labels >= cls) smaller than
+    // minSize pixels to cls - 1.  Returns the changed rect, or null.
+    function removeIslands(labelData, w, h, cls, minSize) {
+        var cc = labelComponents(labelData, w, h, cls, true, true);
+        var x0 = w, y0 = h, x1 = -1, y1 = -1;
+        for (var y = 0; y < h; y++) {
+            for (var x = 0, i = y * w; x < w; x++, i++) {
+                var c = cc.ids[i];
+                if (!c || cc.sizes[c] >= minSize) continue;
+                labelData[i] = cls - 1;
+                if (x < x0) x0 = x;
+                if (x > x1) x1 = x;
+                if (y < y0) y0 = y;
+                y1 = y;
+            }
+        }
+        return x1 < 0 ? null : [x0, y0, x1 + 1, y1 + 1];
+    }
+
+    // ── Morphology kernels ───────────────────────────────────────────
+    // Grow / shrink by a Euclidean disk through an exact distance
+    // transform, so the cost is linear in the pixels of the window around
+    // the class and independent of the radius.  Pixel-center distances,
+    // matching trimap_editor.rasterize_strokes().  Closure-free.
+
+    // Raises pixels within r of class cls (labels >= cls) to cls, or,
+    // shrinking, lowers class pixels within r of the rest to cls - 1.
+    // Pixels outside the image count as neither, so nothing erodes from
+    // the image border.  Returns the rect [x0, y0, x1, y1) that may have
+    // changed, or null if nothing did.
+    function morphLabels(labelData, w, h, cls, grow, r) {
+        // Only pixels within r of the class's bbox can change or matter
+        var bx0 = w;
+        var by0 = h;
+        var bx1 = -1;
+        var by1 = -1;
+        for (var y = 0; y < h; y++) {
+            for (var x = 0, row = y * w; x < w; x++) {
+                if (labelData[row + x] < cls) continue;
+                if (x < bx0) bx0 = x;
+                if (x > bx1) bx1 = x;
+                if (y < by0) by0 = y;
+                by1 = y;
+            }
+        }
+        if (bx1 < 0) return null;
+        var ri = Math.ceil(r);
+        var x0 = Math.max(0, bx0 - ri);
+        var y0 = Math.max(0, by0 - ri);
+        var x1 = Math.min(w, bx1 + 1 + ri);
+        var y1 = Math.min(h, by1 + 1 + ri);
+        var ww = x1 - x0;
+        var wh = y1 - y0;
+
+        // Squared distance to the nearest seed: the class when growing,
+        // its complement when shrinking
+        var d = new Float32Array(ww * wh);
+        for (y = 0; y < wh; y++) {
+            for (x = 0; x < ww; x++) {
+                var inClass = labelData[(y0 + y) * w + x0 + x] >= cls;
+                d[y * ww + x] = inClass === grow ? 0 : 1e20;
+            }
+        }
+        distanceTransform(d, ww, wh);
+
+        var r2 = r * r;
+        var value = grow ? cls : cls - 1;
+        var changed = false;
+        for (y = 0; y < wh; y++) {
+            for (x = 0; x < ww; x++) {
+                var dist = d[y * ww + x];
+                if (dist > 0 && dist <= r2) {
+                    labelData[(y0 + y) * w + x0 + x] = value;
+                    changed = true;
+                }
+            }
+        }
+        return changed ? [x0, y0, x1, y1] : null;
+    }
+
+    // In-place exact squared Euclidean distance transform of d (w × h;
+    // 0 at seeds, 1e20 elsewhere): the Felzenszwalb–Huttenlocher lower
+    // envelope of parabolas down every column, then along every row.
+    function distanceTransform(d, w, h) {
+        var n = Math.max(w, h);
+        var f = new Float64Array(n);
+        var out = new Float64Array(n);
+        var v = new Int32Array(n);
+        var z = new Float64Array(n + 1);
+
+        function envelope(len) {
+            var k = 0;
+            v[0] = 0;
+            z[0] = -Infinity;
+            z[1] = Infinity;
+            for (var q = 1; q < len; q++) {
+                var s = ((f[q] + q * q) - (f[v[k]] + v[k] * v[k])) / (2 * (q - v[k]));
+                while (s <= z[k]) {
+                    k--;
+                    s = ((f[q] + q * q) - (f[v[k]] + v[k] * v[k])) / (2 * (q - v[k]));
+                }
+                k++;
+                v[k] = q;
+                z[k] = s;
+                z[k + 1] = Infinity;
+            }
+            k = 0;
+            for (q = 0; q < len; q++) {
+                while (z[k + 1] < q) k++;
+                var dq = q - v[k];
+                out[q] = dq * dq + f[v[k]];
+            }
+        }
+
+        var x, y;
+        for (x = 0; x < w; x++) {
+            for (y = 0; y < h; y++) f[y] = d[y * w + x];
+            envelope(h);
+            for (y = 0; y < h; y++) d[y * w + x] = out[y];
+        }
+        for (y = 0; y < h; y++) {
+            var row = y * w;
+            for (x = 0; x < w; x++) f[x] = d[row + x];
+            envelope(w);
+            for (x = 0; x < w; x++) d[row + x] = out[x];
+        }
+    }
+
+    // ── History ──────────────────────────────────────────────────────
+
+    function clearHistory() {
+        state.history = [];
+        state.historyIndex = -1;
+        state.historyBytes = 0;
+        state.historyBase = null;
+        state.editedTiles = null;
+        state.strokeBaseOps = [];
+        state.pendingOps = [];
+        state.activeStroke = null;
+        updateHistoryButtons();
+    }
+
+    function tileRect(t) {
+        var w = labelW;
+        var tilesX = Math.ceil(w / HISTORY_TILE);
+        var x0 = (t % tilesX) * HISTORY_TILE;
+        var y0 = Math.floor(t / tilesX) * HISTORY_TILE;
+        return [x0, y0, Math.min(w, x0 + HISTORY_TILE), Math.min(labelH, y0 + HISTORY_TILE)];
+    }
+
+    function snapshotHistory() {
+        var w = labelW;
+        var h = labelH;
+        if (w === 0 || h === 0) return;
+        if (state.keyframePending) {
+            state.keyframePending = false;
+            logKeyframe();
+        }
+
+        // Truncate redo stack
+        state.history = state.history.slice(0, state.historyIndex + 1);
+        var entry = { id: state.historySeq++, tiles: [], bytes: 0, ops: state.pendingOps, spilled: false };
+        if (!state.historyBase) {
+            // First entry: the base state every delta applies on top of
+            state.historyBase = labels.slice();
+            state.editedTiles = new Uint8Array(Math.ceil(w / HISTORY_TILE) * Math.ceil(h / HISTORY_TILE));
+        } else {
+            // Diff only the tiles edited since the last snapshot
+            var flags = state.editedTiles;
+            for (var t = 0; t < flags.length; t++) {
+                if (!flags[t]) continue;
+                flags[t] = 0;
+                var r = tileRect(t);
+                var runs = diffTile(labels, state.historyBase, w, r[0], r[1], r[2], r[3]);
+                if (!runs) continue;
+                applyTileDelta(state.historyBase, w, r[0], r[1], r[2], r[3], runs);
+                entry.tiles.push({ t: t, runs: runs });
+                entry.bytes += runs.length;
+            }
+        }
+        state.history.push(entry);
+        state.pendingOps = [];
+        state.activeStroke = null;
+        state.historyIndex = state.history.length - 1;
+
+        var total = 0;
+        for (var i = 0; i < state.history.length; i++) total += state.history[i].bytes;
+        state.historyBytes = total;
+        // Keep at least one undo step even if it alone exceeds the budget
+        while (state.historyBytes > HISTORY_BUDGET_BYTES && state.history.length > 2) {
+            dropOldestHistory();
+        }
+        updateHistoryButtons();
+    }
+
+    // Makes state 1 the new base: its delta is no longer needed.
+    function dropOldestHistory() {
+        foldStrokeOps(state.history[0]);
+        state.history.shift();
+        state.historyBytes -= state.history[0].bytes;
+        state.history[0].tiles = [];
+        state.history[0].bytes = 0;
+        state.history[0].spilled = false;
+        state.historyIndex--;
+    }
+
+    // Whether labelsAtHistory(i) can run: no delta it undoes is spilled.
+    function historyResident(i) {
+        for (var k = state.historyIndex; k > i; k--) {
+            if (state.history[k].spilled) return false;
+        }
+        return true;
+    }
+
+    // Label map at history index i (i <= historyIndex), rebuilt by undoing
+    // deltas from a copy of the current base.
+    function labelsAtHistory(i) {
+        var out = state.historyBase.slice();
+        for (var k = state.historyIndex; k > i; k--) {
+            applyEntry(out, state.history[k], false);
+        }
+        return out;
+    }
+
+    // XOR deltas are their own inverse, so one routine serves undo and redo.
+    // sync=true also updates historyBase and the touched display tiles.
+    function applyEntry(target, entry, sync) {
+        var w = labelW;
+        for (var i = 0; i < entry.tiles.length; i++) {
+            var tile = entry.tiles[i];
+            var r = tileRect(tile.t);
+            applyTileDelta(target, w, r[0], r[1], r[2], r[3], tile.runs);
+            if (sync) {
+                applyTileDelta(state.historyBase, w, r[0], r[1], r[2], r[3], tile.runs);
+                syncMaskDisplay(r[0], r[1], r[2], r[3]);
+            }
+        }
+    }
+
+    function undo() {
+        if (state.historyIndex <= 0 || state.fillJob || state.historyLoading) return;
+        var entry = state.history[state.historyIndex];
+        if (entry.spilled) {
+            loadSpilledEntry(entry, undo);
+            return;
+        }
+        applyEntry(labels, entry, true);
+        state.historyIndex--;
+        updateHistoryButtons();
+        scheduleCommit();
+        requestRender(editLayers());
+    }
+
+    function redo() {
+        if (state.historyIndex >= state.history.length - 1 || state.fillJob || state.historyLoading) return;
+        var entry = state.history[state.historyIndex + 1];
+        if (entry.spilled) {
+            loadSpilledEntry(entry, redo);
+            return;
+        }
+        state.historyIndex++;
+        applyEntry(labels, entry, true);
+        updateHistoryButtons();
+        scheduleCommit();
+        requestRender(editLayers());
+    }
+
+    // ── Tile delta kernel ────────────────────────────────────────────
+    // A tile delta is the XOR of two label maps over [x0, x1) × [y0, y1),
+    // run-length encoded in row-major order with writeRun() varints
+    // (len * 4 + xor, xor in 0..3).  Closure-free apart from writeRun.
+
+    // Returns the encoded delta as a Uint8Array, or null if a == b there.
+    function diffTile(a, b, w, x0, y0, x1, y1) {
+        var rle = { bytes: new Uint8Array(256), length: 0 };
+        var runVal = 0;
+        var runLen = 0;
+        var changed = false;
+        for (var y = y0; y < y1; y++) {
+            for (var i = y * w + x0, end = y * w + x1; i < end; i++) {
+                var v = a[i] ^ b[i];
+                if (v === runVal) {
+                    runLen++;
+                } else {
+                    if (runLen > 0) writeRun(rle, runVal, runLen);
+                    runVal = v;
+                    runLen = 1;
+                    changed = true;
+                }
+            }
+        }
+        if (!changed) return null;
+        writeRun(rle, runVal, runLen);
+        return rle.bytes.slice(0, rle.length);
+    }
+
+    function applyTileDelta(target, w, x0, y0, x1, y1, runs) {
+        var tw = x1 - x0;
+        var y = y0;
+        var col = 0;  // column within the tile
+        var pos = 0;
+        while (pos < runs.length) {
+            var v = 0;
+            var mul = 1;
+            var b;
+            do {
+                b = runs[pos++];
+                v += (b & 127) * mul;
+                mul *= 128;
+            } while (b >= 128);
+            var xor = v % 4;
+            var len = (v - xor) / 4;
+            // A run may wrap across tile rows
+            while (len > 0) {
+                var n = Math.min(len, tw - col);
+                if (xor !== 0) {
+                    for (var i = y * w + x0 + col, end = i + n; i < end; i++) target[i] ^= xor;
+                }
+                len -= n;
+                col += n;
+                if (col === tw) {
+                    col = 0;
+                    y++;
+                }
+            }
+        }
+    }
+
+    function updateHistoryButtons() {
+        undoBtn.disabled = state.historyIndex <= 0;
+        redoBtn.disabled = state.historyIndex >= state.history.length - 1;
+    }
+
+    // ── Stroke log (value_format="strokes") ──────────────────────────
+    //
+    // Mirrors paintAt / paintInterpolated / floodFillAt / morphActiveLayer /
+    // cleanupActiveLayer as an ordered op list that trimap_editor.rasterize_strokes() replays
+    // on the server:
+    //   {op: "stroke", layer, tool, r, pts: [x0, y0, x1, y1, ...]}
+    //   {op: "fill", layer, x, y}
+    //   {op: "grow" | "shrink", layer, r}
+    //   {op: "fill_holes", layer}
+    //   {op: "remove_islands", layer, size}
+    //   {op: "clear"}
+    //   {op: "keyframe", trimap: "data:image/png;base64,..."}  (trimap loads, wand fills)
+
+    function logOp(op) {
+        if (VALUE_FORMAT !== "strokes") return;
+        state.pendingOps.push(op);
+    }
+
+    // Logs the whole current trimap, for edits the replay can't reproduce.
+    // Always called just before snapshotHistory(), so a keyframe is the
+    // last op of its history entry and that entry's raster is its image.
+    // The PNG is encoded only when the keyframe is committed (see
+    // encodeLatestKeyframe()): a run of edge strokes encodes one, not one
+    // per stroke.
+    function logKeyframe() {
+        if (VALUE_FORMAT !== "strokes") return;
+        state.pendingOps.push({ op: "keyframe", trimap: null });
+    }
+
+    function logStrokeStart(ix, iy) {
+        if (VALUE_FORMAT !== "strokes") return;
+        if (state.tool === "edge") {
+            // Depends on the image: logged as a keyframe by snapshotHistory()
+            state.keyframePending = true;
+            return;
+        }
+        state.activeStroke = {
+            op:    "stroke",
+            layer: state.layer,
+            tool:  state.tool === "eraser" ? "eraser" : "brush",
+            r:     getBrushSize() / state.zoom,
+            pts:   [ix, iy],
+        };
+        state.pendingOps.push(state.activeStroke);
+    }
+
+    // Fold a history entry that fell off the undo stack into the base ops.
+    // Once the base grows past STROKE_KEYFRAME_INTERVAL it collapses into a
+    // single keyframe of that entry's raster (the state after the base ops)
+    // unless later deltas are spilled, in which case it waits for the
+    // keyframe settleStrokeKeyframes() left at the end of the spilled run.
+    function foldStrokeOps(entry) {
+        if (VALUE_FORMAT !== "strokes") return;
+        state.strokeBaseOps = state.strokeBaseOps.concat(entry.ops);
+        var last = entry.ops[entry.ops.length - 1];
+        var i = state.history.indexOf(entry);
+        if (endsWithKeyframe(entry) && last.trimap) {
+            state.strokeBaseOps = [last];
+        } else if ((state.strokeBaseOps.length > STROKE_KEYFRAME_INTERVAL || endsWithKeyframe(entry))
+                   && historyResident(i)) {
+            // (An unencoded keyframe can't be rebuilt once its entry is gone)
+            state.strokeBaseOps = [{
+                op: "keyframe",
+                trimap: encodeKeyframe(labelsAtHistory(i)),
+            }];
+        }
+    }
+
+    function encodeKeyframe(labelData) {
+        var kc = document.createElement("canvas");
+        kc.width  = labelW;
+        kc.height = labelH;
+        var kctx = kc.getContext("2d");
+        var out = kctx.createImageData(kc.width, kc.height);
+        composeTrimapRect(new Uint32Array(out.data.buffer), labelData, kc.width,
+                          0, 0, kc.width, kc.height, TRIMAP_PIXELS);
+        kctx.putImageData(out, 0, 0);
+        return kc.toDataURL("image/png");
+    }
+
+    function endsWithKeyframe(entry) {
+        var ops = entry.ops;
+        return ops.length > 0 && ops[ops.length - 1].op === "keyframe";
+    }
+
+    // History index of the latest keyframe up to historyIndex, or -1.
+    function latestKeyframe() {
+        for (var i = state.historyIndex; i >= 0; i--) {
+            if (endsWithKeyframe(state.history[i])) return i;
+        }
+        return -1;
+    }
+
+    // Encodes the latest keyframe's PNG if it hasn't been yet, then calls
+    // done().  In the encode worker unless sync (or no worker), where it
+    // encodes on the main thread before returning.
+    function encodeLatestKeyframe(sync, done) {
+        var i = latestKeyframe();
+        var entry = i < 0 ? null : state.history[i];
+        var op = entry && entry.ops[entry.ops.length - 1];
+        if (!op || op.trimap) {
+            done();
+            return;
+        }
+        if (sync || !encodeWorkerAvailable()) {
+            op.trimap = encodeKeyframe(labelsAtHistory(i));
+            done();
+            return;
+        }
+        encodeTrimapInWorker(labelsAtHistory(i), labelW, labelH, function (dataUrl) {
+            // The entry may since have been undone past or folded away
+            if (op.trimap || state.history[i] !== entry) return;
+            op.trimap = dataUrl || encodeKeyframe(labelsAtHistory(i));
+            done();
+        });
+    }
+
+    // Ops that replay into the state at historyIndex.  Replay restarts at
+    // a keyframe, so everything before the latest one is left out.
+    function collectStrokeOps() {
+        var i = latestKeyframe();
+        var ops = i < 0 ? state.strokeBaseOps.slice() : state.history[i].ops.slice(-1);
+        for (i++; i <= state.historyIndex; i++) {
+            ops = ops.concat(state.history[i].ops);
+        }
+        return ops.concat(state.pendingOps);
+    }
+
+    // ── Trimap view & value commit ───────────────────────────────────
+
+    // Redraws the dirty rect of trimapViewCanvas (0/128/255 grayscale)
+    // from the label map.  Called by render() in trimap view and before a
+    // PNG commit, so drawing only pays for the pixels it touched.
+    function updateTrimapView() {
+        flushMaskDisplay();
+        if (trimapViewCanvas.width !== labelW || trimapViewCanvas.height !== labelH) {
+            trimapViewCanvas.width = labelW;
+            trimapViewCanvas.height = labelH;
+            releasePyramid(trimapPyramid);
+            state.trimapViewRect = [0, 0, labelW, labelH];
+        }
+        var r = state.trimapViewRect;
+        if (!r) return;
+        state.trimapViewRect = null;
+        invalidatePyramid(trimapPyramid, r[0], r[1], r[2], r[3]);
+        var out = trimapViewCtx.createImageData(r[2] - r[0], r[3] - r[1]);
+        composeTrimapRect(new Uint32Array(out.data.buffer), labels, labelW,
+                          r[0], r[1], r[2], r[3], TRIMAP_PIXELS);
+        trimapViewCtx.putImageData(out, r[0], r[1]);
+    }
+
+    // Recomputes the committed stats (and the RLE stream) from the label map.
+    function updateTrimapStats() {
+        var iw = labelW;
+        var ih = labelH;
+        if (iw === 0 || ih === 0) return;
+        var rle = VALUE_FORMAT === "rle" ? { bytes: new Uint8Array(4096), length: 0 } : null;
+        var stats = createTrimapStats(iw, ih);
+        scanTrimapRuns(labels, iw, ih, rle, stats);
+        state.trimapRLE = rle;
+        state.trimapStats = finishTrimapStats(stats);
+        state.trimapStatsDirty = false;
+    }
+
+    // Opaque grayscale pixel per class, in the platform's byte order
+    var TRIMAP_PIXELS = (function () {
+        var px = new Uint32Array(3);
+        var bytes = new Uint8Array(px.buffer);
+        [0, 128, 255].forEach(function (v, i) {
+            bytes.set([v, v, v, 255], i * 4);
+        });
+        return px;
+    })();
+
+    // Writes [x0, x1) × [y0, y1) of labelData as trimap pixels into out32,
+    // a Uint32 view of ImageData covering exactly that rect.  Closure-free.
+    function composeTrimapRect(out32, labelData, w, x0, y0, x1, y1, pixels) {
+        var bw = x1 - x0;
+        for (var y = y0, j = 0; y < y1; y++) {
+            for (var i = y * w + x0, end = i + bw; i < end; i++, j++) {
+                out32[j] = pixels[labelData[i]];
+            }
+        }
+    }
+
+    // Accumulates the run stream and the per-class counts, bboxes and
+    // content hash of labelData in one row-major pass.
+    function scanTrimapRuns(labelData, iw, ih, rle, stats) {
+        var runCls = -1;
+        var runLen = 0;
+        for (var y = 0, i = 0; y < ih; y++) {
+            for (var x = 0; x < iw; x++, i++) {
+                var cls = labelData[i];
+                if (cls > 0) {
+                    var box = stats.bbox[cls];
+                    if (x < box[0]) box[0] = x;
+                    if (y < box[1]) box[1] = y;
+                    if (x > box[2]) box[2] = x;
+                    if (y > box[3]) box[3] = y;
+                }
+                if (cls === runCls) {
+                    runLen++;
+                } else {
+                    if (runLen > 0) flushRun(rle, stats, runCls, runLen);
+                    runCls = cls;
+                    runLen = 1;
+                }
+            }
+        }
+        if (runLen > 0) flushRun(rle, stats, runCls, runLen);
+    }
+
+    function flushRun(rle, stats, cls, len) {
+        if (rle) writeRun(rle, cls, len);
+        stats.counts[cls] += len;
+        stats.hash = fnv1aWord(fnv1aByte(stats.hash, cls), len);
+    }
+
+    // Trimap stats: per-class pixel counts, bboxes of the unknown (128)
+    // and foreground (255) pixels, and a FNV-1a 32-bit hash over (width,
+    // height, runs).  Each run feeds its class byte then its length as 4
+    // little-endian bytes; trimap_editor.trimap_hash() computes the same.
+
+    var FNV_OFFSET = 0x811c9dc5;
+    var FNV_PRIME  = 0x01000193;
+
+    function fnv1aByte(h, b) {
+        return Math.imul(h ^ b, FNV_PRIME);
+    }
+
+    function fnv1aWord(h, w) {
+        h = fnv1aByte(h, w & 255);
+        h = fnv1aByte(h, (w >>> 8) & 255);
+        h = fnv1aByte(h, (w >>> 16) & 255);
+        return fnv1aByte(h, (w >>> 24) & 255);
+    }
+
+    function createTrimapStats(iw, ih) {
+        return {
+            counts: [0, 0, 0],
+            // [minX, minY, maxX, maxY] inclusive while scanning; index = class
+            bbox:   [null, [iw, ih, -1, -1], [iw, ih, -1, -1]],
+            hash:   fnv1aWord(fnv1aWord(FNV_OFFSET, iw), ih),
+        };
+    }
+
+    // Converts accumulated stats into the committed shape.  Bboxes are
+    // [x0, y0, x1, y1] with exclusive ends (PIL crop order), null if empty.
+    function finishTrimapStats(stats) {
+        function box(b) {
+            return b[2] < 0 ? null : [b[0], b[1], b[2] + 1, b[3] + 1];
+        }
+        var hex = (stats.hash >>> 0).toString(16);
+        return {
+            counts: {
+                background: stats.counts[0],
+                unknown:    stats.counts[1],
+                foreground: stats.counts[2],
+            },
+            unknownBBox:    box(stats.bbox[1]),
+            foregroundBBox: box(stats.bbox[2]),
+            hash:           "00000000".slice(hex.length) + hex,
+        };
+    }
+
+    // Appends one run as a LEB128 varint of (len * 4 + cls).  Arithmetic
+    // rather than bit ops so runs longer than 2^29 px don't overflow.
+    function writeRun(rle, cls, len) {
+        if (rle.length + 8 > rle.bytes.length) {
+            var grown = new Uint8Array(rle.bytes.length * 2);
+            grown.set(rle.bytes);
+            rle.bytes = grown;
+        }
+        var v = len * 4 + cls;
+        while (v >= 128) {
+            rle.bytes[rle.length++] = (v % 128) | 128;
+            v = Math.floor(v / 128);
+        }
+        rle.bytes[rle.length++] = v;
+    }
+
+    function bytesToBase64(bytes, length) {
+        var parts = [];
+        for (var i = 0; i < length; i += 0x8000) {
+            parts.push(String.fromCharCode.apply(null, bytes.subarray(i, Math.min(length, i + 0x8000))));
+        }
+        return btoa(parts.join(""));
+    }
+
+    // ── Encode worker ────────────────────────────────────────────────
+    // Idle-time PNG commits are composed and encoded in a dedicated worker,
+    // so a multi-megapixel encode never competes with input.  The worker is
+    // built from the closure-free kernels' source; each job transfers a
+    // copy of the label map and gets back the PNG data URL.  While one job
+    // runs only the newest is kept waiting (older ones are stale anyway).
+    // Without Worker / OffscreenCanvas, or if the worker fails to start,
+    // commits fall back to toBlob on the main thread.
+
+    // Worker entry point: labels in, data URL (or null on failure) out.
+    function encodeWorkerMain() {
+        self.onmessage = function (e) {
+            var job = e.data;
+            var oc = new OffscreenCanvas(job.width, job.height);
+            var octx = oc.getContext("2d");
+            var img = octx.createImageData(job.width, job.height);
+            composeTrimapRect(new Uint32Array(img.data.buffer), new Uint8Array(job.labels),
+                              job.width, 0, 0, job.width, job.height, job.pixels);
+            octx.putImageData(img, 0, 0);
+            oc.convertToBlob({ type: "image/png" }).then(function (blob) {
+                self.postMessage(new FileReaderSync().readAsDataURL(blob));
+            }, function () {
+                self.postMessage(null);
+            });
+        };
+    }
+
+    // Starts a worker that runs main() with the given helpers in scope.
+    function createKernelWorker(helpers, main) {
+        var src = helpers.concat(main).map(String).join("\n") + "\n" + main.name + "();\n";
+        var url = URL.createObjectURL(new Blob([src], { type: "text/javascript" }));
+        // The constructor resolves the blob URL, so it can go straight away
+        try {
+            return new Worker(url);
+        } finally {
+            URL.revokeObjectURL(url);
+        }
+    }
+
+    var encoder = { worker: null, failed: false, busy: null, next: null };
+
+    // ── Image decoding ───────────────────────────────────────────────
+    // Images are decoded with createImageBitmap, off the main thread, and
+    // kept as ImageBitmaps so their memory can be freed with close().
+    // Trimaps go to a decode worker as blobs — decode, resize to the image
+    // and thresholding all happen there — and come back as a label map.
+    // Without Worker / OffscreenCanvas, or if the worker fails to start,
+    // the same kernel runs on the main thread.
+
+    // Fetches url as a Blob; rejects on network or HTTP errors.
+    function fetchBlob(url) {
+        return fetch(url).then(function (res) {
+            if (!res.ok) throw new Error("HTTP " + res.status);
+            return res.blob();
+        });
+    }
+
+    // Decodes url into an ImageBitmap; options are passed through to
+    // createImageBitmap (e.g. resizeWidth for a downscaled proxy).  A
+    // cross-origin URL without CORS headers can't be fetched, so it loads
+    // through an <img> as before (and stays unreadable, see imageFingerprint()).
+    function decodeImage(url, options) {
+        return fetchBlob(url).then(function (blob) {
+            return createImageBitmap(blob, options);
+        }, function () {
+            return new Promise(function (resolve, reject) {
+                var img = new Image();
+                img.onload = function () { resolve(createImageBitmap(img, options)); };
+                img.onerror = reject;
+                img.src = url;
+            });
+        });
+    }
+
+    // Frees the decoded pixels of the current image.
+    function closeImage() {
+        if (state.image) state.image.close();
+        state.image = null;
+        state.imageReload = null;
+    }
+
+    // Frees the decoded pixels while the editor is out of view, leaving a
+    // stand-in that keeps the size (nothing draws it: render() and the
+    // pointer handlers don't run out of view).  reloadImage() decodes the
+    // image again when the editor comes back.
+    function releaseImage() {
+        var img = state.image;
+        if (!img || img.released || !state.imageReload) return;
+        state.image = { width: img.width, height: img.height, released: true, reloading: false, close: function () {} };
+        img.close();
+    }
+
+    function reloadImage() {
+        var stub = state.image;
+        if (!stub || !stub.released || stub.reloading) return;
+        stub.reloading = true;
+        state.imageReload().then(function (img) {
+            // Removed, replaced or already reloaded meanwhile
+            if (state.image !== stub) {
+                img.close();
+                return;
+            }
+            state.image = img;
+            requestRender(LAYER_ALL);
+        }, function () {
+            stub.reloading = false;
+        });
+    }
+
+    // Label map of a trimap bitmap already sized w × h.  Uses generous
+    // thresholds (>200 for fg, >64 for unknown) to tolerate slight value
+    // shifts from image format conversions.  With band = [lo, hi] the
+    // bitmap may also be an alpha matte: values <= lo become background,
+    // >= hi foreground and the rest unknown.  It is read as a trimap only
+    // if every value is one both readings agree on: <= lo (and <= 64),
+    // >= hi (and >= 201), or within max(lo, 255 - hi) of 128 (inside the
+    // band and 65..200).  Images with transparency are read from their
+    // alpha channel.  Closure-free apart from createCanvas and releaseCanvas
+    // (runs in the decode worker).
+    function trimapBitmapLabels(bitmap, w, h, band) {
+        var c = createCanvas(w, h);
+        var cctx = c.getContext("2d");
+        cctx.drawImage(bitmap, 0, 0);
+        var data = cctx.getImageData(0, 0, w, h).data;
+        releaseCanvas(c);
+        var ch = 0;  // R channel (grayscale: R==G==B)
+        var lo = 65;
+        var hi = 201;
+        var i;
+        if (band) {
+            for (i = 3; i < data.length; i += 4) {
+                if (data[i] < 255) { ch = 3; break; }
+            }
+            var zero = Math.min(band[0], lo - 1);
+            var full = Math.max(band[1], hi);
+            var tol = Math.max(band[0], 255 - band[1]);
+            var midLo = Math.max(128 - tol, band[0] + 1, lo);
+            var midHi = Math.min(128 + tol, band[1] - 1, hi - 1);
+            for (i = ch; i < data.length; i += 4) {
+                var v = data[i];
+                if (v > zero && v < full && (v < midLo || v > midHi)) {
+                    lo = band[0] + 1;
+                    hi = band[1];
+                    break;
+                }
+            }
+        }
+        var out = new Uint8Array(w * h);
+        for (i = 0; i < out.length; i++) {
+            var val = data[i * 4 + ch];
+            out[i] = val >= hi ? 2 : val >= lo ? 1 : 0;
+        }
+        return out;
+    }
+
+    // Decodes a trimap (or, with band, alpha matte) blob stretched to
+    // w × h, as a label map (or null).
+    function decodeTrimapBlob(blob, w, h, band) {
+        var options = { resizeWidth: w, resizeHeight: h, resizeQuality: "pixelated" };
+        return createImageBitmap(blob, options).then(function (bitmap) {
+            var out = trimapBitmapLabels(bitmap, w, h, band);
+            bitmap.close();
+            return out;
+        }).catch(function () { return null; });
+    }
+
+    // Worker entry point: {id, blob, width, height, band} in, {id, labels} out.
+    function decodeWorkerMain() {
+        self.onmessage = function (e) {
+            var job = e.data;
+            decodeTrimapBlob(job.blob, job.width, job.height, job.band).then(function (out) {
+                self.postMessage({ id: job.id, labels: out }, out ? [out.buffer] : []);
+            });
+        };
+    }
+
+    var decoder = { worker: null, failed: false, jobs: {}, nextId: 1 };
+
+    // Decodes a trimap blob into a w × h label map; band = [lo, hi] also
+    // accepts alpha mattes (see trimapBitmapLabels()).  done(labels) gets
+    // null if the blob isn't a readable image.
+    function decodeTrimap(blob, w, h, band, done) {
+        if (decoder.failed || typeof Worker === "undefined" || typeof OffscreenCanvas === "undefined") {
+            decodeTrimapBlob(blob, w, h, band).then(done);
+            return;
+        }
+        if (!decoder.worker) {
+            decoder.worker = createKernelWorker(
+                [createCanvas, releaseCanvas, trimapBitmapLabels, decodeTrimapBlob], decodeWorkerMain);
+            decoder.worker.onmessage = function (e) {
+                var job = decoder.jobs[e.data.id];
+                delete decoder.jobs[e.data.id];
+                job.done(e.data.labels);
+            };
+            decoder.worker.onerror = function () {
+                // Retry whatever was in flight on this thread
+                decoder.failed = true;
+                decoder.worker.terminate();
+                var jobs = decoder.jobs;
+                decoder.jobs = {};
+                Object.keys(jobs).forEach(function (id) {
+                    var job = jobs[id];
+                    decodeTrimap(job.blob, job.width, job.height, job.band, job.done);
+                });
+            };
+        }
+        var id = decoder.nextId++;
+        decoder.jobs[id] = { blob: blob, width: w, height: h, band: band, done: done };
+        decoder.worker.postMessage({ id: id, blob: blob, width: w, height: h, band: band });
+    }
+
+    function encodeWorkerAvailable() {
+        return !encoder.failed && typeof Worker !== "undefined" && typeof OffscreenCanvas !== "undefined";
+    }
+
+    // Encodes labelData (w × h) as a trimap PNG in the worker; done(dataUrl)
+    // gets the data URL, or null if the worker failed.
+    function encodeTrimapInWorker(labelData, w, h, done) {
+        if (!encoder.worker) {
+            encoder.worker = createKernelWorker([composeTrimapRect], encodeWorkerMain);
+            encoder.worker.onmessage = function (e) { finishEncode(e.data); };
+            encoder.worker.onerror = function () {
+                encoder.failed = true;
+                encoder.worker.terminate();
+                var pending = [encoder.busy, encoder.next];
+                encoder.busy = encoder.next = null;
+                pending.forEach(function (job) { if (job) job.done(null); });
+            };
+        }
+        var job = { width: w, height: h, labels: labelData.slice().buffer, done: done };
+        if (encoder.busy) {
+            encoder.next = job;
+        } else {
+            sendEncode(job);
+        }
+    }
+
+    function sendEncode(job) {
+        encoder.busy = job;
+        encoder.worker.postMessage({
+            width: job.width, height: job.height, labels: job.labels, pixels: TRIMAP_PIXELS,
+        }, [job.labels]);
+    }
+
+    function finishEncode(dataUrl) {
+        var job = encoder.busy;
+        encoder.busy = null;
+        if (encoder.next) {
+            var next = encoder.next;
+            encoder.next = null;
+            sendEncode(next);
+        }
+        if (job) job.done(dataUrl);
+    }
+
+    // ── Mask layer renderer ──────────────────────────────────────────
+    // The coloured mask canvases (unknown = labels >= 1, fg = labels == 2,
+    // pre-filled with the layer colour so overlays draw with a single
+    // drawImage), their pyramids and the mask layer itself belong to
+    // createMaskRenderer(), which postMask() feeds with label-map patches
+    // and view state.  Where the browser supports it the renderer runs in
+    // a worker that owns the mask layer (transferControlToOffscreen), so
+    // stroke feedback is coloured, composited and painted off the main
+    // thread; otherwise, or if the worker fails to start, it runs here.
+    // The label map itself stays on the main thread.
+    //   size   {width, height}          mask layer (screen) size
+    //   image  {width, height}          allocate the mask canvases
+    //   clear  {}                       empty masks and layer
+    //   colors {unknownPixel, fgPixel}  layer colours (resend labels after)
+    //   labels {x0, y0, x1, y1, labels} label rect, row-major Uint8Array
+    //   frame  {view, full, visible, unknownAlpha, fgAlpha}
+    //   read   {}                       → mask layer pixels (tests)
+
+    // Returns handle(msg) for the messages above.  Closure-free apart from
+    // the pyramid kernels, paintLayer and composeTrimapRect.
+    function createMaskRenderer(layer) {
+        var layerCtx = layer.getContext("2d");
+        var w = 0;
+        var h = 0;
+        var unknown = null;  // {canvas, ctx, pyramid}
+        var fg = null;
+        var unknownPixels = new Uint32Array(3);  // per label value
+        var fgPixels = new Uint32Array(3);
+        var lastView = null;
+
+        function createMask() {
+            var c = createCanvas(w, h);
+            return { canvas: c, ctx: c.getContext("2d"), pyramid: createPyramid(c) };
+        }
+
+        function drawMask(mask, pixels, msg) {
+            var bw = msg.x1 - msg.x0;
+            var bh = msg.y1 - msg.y0;
+            var img = mask.ctx.createImageData(bw, bh);
+            composeTrimapRect(new Uint32Array(img.data.buffer), msg.labels, bw, 0, 0, bw, bh, pixels);
+            mask.ctx.putImageData(img, msg.x0, msg.y0);
+            invalidatePyramid(mask.pyramid, msg.x0, msg.y0, msg.x1, msg.y1);
+        }
+
+        // Mask canvases are already coloured; alpha is applied at draw time.
+        function drawOverlay(mask, alpha, view) {
+            if (alpha <= 0) return;
+            layerCtx.globalAlpha = alpha;
+            drawPyramid(layerCtx, mask.pyramid, w, h, view);
+            layerCtx.globalAlpha = 1;
+        }
+
+        function clearLayer() {
+            layerCtx.setTransform(1, 0, 0, 1, 0, 0);
+            layerCtx.clearRect(0, 0, layer.width, layer.height);
+        }
+
+        return function handle(msg) {
+            var type = msg.type;
+            if (type === "size") {
+                layer.width = msg.width;
+                layer.height = msg.height;
+                lastView = null;
+            } else if (type === "image") {
+                w = msg.width;
+                h = msg.height;
+                unknown = createMask();
+                fg = createMask();
+            } else if (type === "release") {
+                // Masks are rebuilt by a later image + labels
+                [unknown, fg].forEach(function (mask) {
+                    if (!mask) return;
+                    releasePyramid(mask.pyramid);
+                    releaseCanvas(mask.canvas);
+                });
+                unknown = fg = null;
+                releaseCanvas(layer);
+                lastView = null;
+            } else if (type === "clear") {
+                [unknown, fg].forEach(function (mask) {
+                    if (!mask) return;
+                    mask.ctx.clearRect(0, 0, w, h);
+                    invalidatePyramid(mask.pyramid, 0, 0, w, h);
+                });
+                clearLayer();
+                lastView = null;
+            } else if (type === "colors") {
+                unknownPixels[1] = unknownPixels[2] = msg.unknownPixel;
+                fgPixels[2] = msg.fgPixel;
+            } else if (type === "labels") {
+                if (!unknown) return null;
+                drawMask(unknown, unknownPixels, msg);
+                drawMask(fg, fgPixels, msg);
+            } else if (type === "frame") {
+                paintLayer(layerCtx, lastView, msg.view, msg.full, function () {
+                    clearLayer();
+                    if (!msg.visible || !unknown) return;
+                    layerCtx.imageSmoothingEnabled = false;
+                    // Unknown overlay, then foreground on top
+                    drawOverlay(unknown, msg.unknownAlpha, msg.view);
+                    drawOverlay(fg, msg.fgAlpha, msg.view);
+                });
+                lastView = msg.view;
+            } else if (type === "read") {
+                if (layer.width === 0 || layer.height === 0) return new Uint8ClampedArray(0);
+                return layerCtx.getImageData(0, 0, layer.width, layer.height).data;
+            }
+            return null;
+        };
+    }
+
+    // Worker entry point: the first message hands over the mask layer.
+    function maskWorkerMain() {
+        var handle = null;
+        self.onmessage = function (e) {
+            var msg = e.data;
+            if (msg.type === "init") {
+                handle = createMaskRenderer(msg.canvas);
+                return;
+            }
+            var result = handle(msg);
+            if (msg.type === "read") self.postMessage(result, [result.buffer]);
+        };
     }
 
-    function drawCursor(canvasX, canvasY) {
-        var r = getBrushSize();
-        ctx.save();
-        ctx.setLineDash([3, 3]);
-        ctx.lineWidth = 1.5;
-        ctx.strokeStyle = state.tool === "eraser" ? "rgba(255,60,60,0.9)" : "rgba(255,255,255,0.9)";
-        ctx.beginPath();
-        ctx.arc(canvasX, canvasY, Math.max(1, r), 0, Math.PI * 2);
-        ctx.stroke();
-        ctx.setLineDash([]);
-        ctx.restore();
+    function startMaskRenderer() {
+        var renderer = { worker: null, handle: null, reads: [] };
+        if (typeof Worker === "undefined" || !maskLayer.transferControlToOffscreen) {
+            renderer.handle = createMaskRenderer(maskLayer);
+            return renderer;
+        }
+        var worker = createKernelWorker(
+            [growRect, createCanvas, releaseCanvas, createPyramid, invalidatePyramid, releasePyramid,
+             mipLevel, pyramidLevel, drawPyramid, paintLayer, composeTrimapRect, createMaskRenderer],
+            maskWorkerMain);
+        var offscreen = maskLayer.transferControlToOffscreen();
+        worker.postMessage({ type: "init", canvas: offscreen }, [offscreen]);
+        worker.onmessage = function (e) { renderer.reads.shift()(e.data); };
+        worker.onerror = fallBackToLocalMaskRenderer;
+        renderer.worker = worker;
+        return renderer;
     }
 
-    // ── Drawing ──────────────────────────────────────────────────────
-
-    function paintAt(ix, iy) {
-        var r = getBrushSize() / state.zoom;
-        if (state.tool === "brush") {
-            if (state.layer === "unknown") {
-                unknownCtx.globalCompositeOperation = "source-over";
-                unknownCtx.fillStyle = "rgba(255,255,255,1)";
-                unknownCtx.beginPath();
-                unknownCtx.arc(ix, iy, r, 0, Math.PI * 2);
-                unknownCtx.fill();
-            } else {
-                // Foreground: paint both fg AND unknown
-                fgCtx.globalCompositeOperation = "source-over";
-                fgCtx.fillStyle = "rgba(255,255,255,1)";
-                fgCtx.beginPath();
-                fgCtx.arc(ix, iy, r, 0, Math.PI * 2);
-                fgCtx.fill();
-
-                unknownCtx.globalCompositeOperation = "source-over";
-                unknownCtx.fillStyle = "rgba(255,255,255,1)";
-                unknownCtx.beginPath();
-                unknownCtx.arc(ix, iy, r, 0, Math.PI * 2);
-                unknownCtx.fill();
-            }
+    function postMask(msg, transfer) {
+        if (maskRenderer.worker) {
+            maskRenderer.worker.postMessage(msg, transfer || []);
         } else {
-            // Eraser
-            if (state.layer === "unknown") {
-                // Erase unknown AND fg (fg ⊆ unknown constraint)
-                unknownCtx.globalCompositeOperation = "destination-out";
-                unknownCtx.fillStyle = "rgba(255,255,255,1)";
-                unknownCtx.beginPath();
-                unknownCtx.arc(ix, iy, r, 0, Math.PI * 2);
-                unknownCtx.fill();
-                unknownCtx.globalCompositeOperation = "source-over";
-
-                fgCtx.globalCompositeOperation = "destination-out";
-                fgCtx.fillStyle = "rgba(255,255,255,1)";
-                fgCtx.beginPath();
-                fgCtx.arc(ix, iy, r, 0, Math.PI * 2);
-                fgCtx.fill();
-                fgCtx.globalCompositeOperation = "source-over";
-            } else {
-                // Erase fg only (stays unknown)
-                fgCtx.globalCompositeOperation = "destination-out";
-                fgCtx.fillStyle = "rgba(255,255,255,1)";
-                fgCtx.beginPath();
-                fgCtx.arc(ix, iy, r, 0, Math.PI * 2);
-                fgCtx.fill();
-                fgCtx.globalCompositeOperation = "source-over";
-            }
+            maskRenderer.handle(msg);
         }
     }
 
-    function paintInterpolated(x0, y0, x1, y1) {
-        var dx = x1 - x0;
-        var dy = y1 - y0;
-        var dist = Math.sqrt(dx * dx + dy * dy);
-        var imageRadius = getBrushSize() / state.zoom;
-        var steps = Math.max(1, Math.ceil(dist / (imageRadius * 0.3)));
-        for (var i = 1; i <= steps; i++) {
-            var t = i / steps;
-            paintAt(x0 + dx * t, y0 + dy * t);
+    // The worker failed: swap in a fresh mask layer (the old one belongs to
+    // the dead worker) and replay the renderer's inputs on this thread.
+    function fallBackToLocalMaskRenderer() {
+        var r = maskRenderer;
+        if (!r.worker) return;
+        r.worker.terminate();
+        r.worker = null;
+        var fresh = maskLayer.cloneNode(false);
+        maskLayer.parentNode.replaceChild(fresh, maskLayer);
+        maskLayer = fresh;
+        r.handle = createMaskRenderer(maskLayer);
+        r.reads.splice(0).forEach(function (done) { done(new Uint8ClampedArray(0)); });
+        postMask({ type: "size", width: canvas.width, height: canvas.height });
+        postMask({ type: "colors", unknownPixel: state.unknownPixel, fgPixel: state.fgPixel });
+        if (labelW > 0 && state.inView) {
+            postMask({ type: "image", width: labelW, height: labelH });
+            syncMaskDisplay(0, 0, labelW, labelH);
         }
+        requestRender(LAYER_MASKS);
     }
 
-    // ── Flood fill (bucket tool) ────────────────────────────────────
+    // Pixels of the mask layer as last drawn (a Promise, for UI tests).
+    function readMaskLayer() {
+        var r = maskRenderer;
+        if (!r.worker) return Promise.resolve(r.handle({ type: "read" }));
+        return new Promise(function (resolve) {
+            r.reads.push(resolve);
+            r.worker.postMessage({ type: "read" });
+        });
+    }
 
-    function floodFillAt(ix, iy) {
-        var px = Math.floor(ix);
-        var py = Math.floor(iy);
-        var w = unknownCanvas.width;
-        var h = unknownCanvas.height;
-        if (px < 0 || px >= w || py < 0 || py >= h) return;
-
-        // Choose the active canvas to read boundaries from
-        var activeCanvas = state.layer === "foreground" ? fgCanvas : unknownCanvas;
-        var activeCtx    = state.layer === "foreground" ? fgCtx   : unknownCtx;
-        var imgData = activeCtx.getImageData(0, 0, w, h);
-        var data = imgData.data;
-
-        // If start pixel is already painted (alpha > 127), nothing to fill
-        var startIdx = (py * w + px) * 4;
-        if (data[startIdx + 3] > 127) return;
-
-        // BFS
-        var visited = new Uint8Array(w * h);
-        var queue = [py * w + px];
-        visited[py * w + px] = 1;
-        var filled = [py * w + px];
-
-        while (queue.length > 0) {
-            var idx = queue.shift();
-            var cx = idx % w;
-            var cy = (idx - cx) / w;
-
-            var neighbors = [];
-            if (cx > 0)     neighbors.push(idx - 1);
-            if (cx < w - 1) neighbors.push(idx + 1);
-            if (cy > 0)     neighbors.push(idx - w);
-            if (cy < h - 1) neighbors.push(idx + w);
-
-            for (var i = 0; i < neighbors.length; i++) {
-                var ni = neighbors[i];
-                if (visited[ni]) continue;
-                visited[ni] = 1;
-                // Boundary: painted pixels (alpha > 127)
-                if (data[ni * 4 + 3] > 127) continue;
-                queue.push(ni);
-                filled.push(ni);
-            }
+    // ── Commit scheduler ────────────────────────────────────────────
+    // Edits call scheduleCommit() instead of committing directly.  Pending
+    // commits coalesce into one idle-time task, and each commit carries the
+    // version it was scheduled at, so a slow async PNG encode can never
+    // overwrite a newer value.  flushCommit() runs the pending commit
+    // synchronously just before a Python event reads props.value.
+    // In lazy commit mode encoded values are only staged in JS state and
+    // published to props.value by flushCommit().
+
+    function requestIdle(fn) {
+        if (window.requestIdleCallback) {
+            return { idle: true, id: window.requestIdleCallback(fn, { timeout: COMMIT_IDLE_TIMEOUT }) };
         }
+        return { idle: false, id: setTimeout(fn, 0) };
+    }
 
-        // Write filled pixels to active canvas
-        for (var j = 0; j < filled.length; j++) {
-            var fi = filled[j] * 4;
-            data[fi]     = 255;  // R
-            data[fi + 1] = 255;  // G
-            data[fi + 2] = 255;  // B
-            data[fi + 3] = 255;  // A
-        }
-        activeCtx.putImageData(imgData, 0, 0);
-
-        // fg ⊆ unknown: if foreground layer, also fill unknownCanvas
-        if (state.layer === "foreground") {
-            var uData = unknownCtx.getImageData(0, 0, w, h);
-            var ud = uData.data;
-            for (var k = 0; k < filled.length; k++) {
-                var ui = filled[k] * 4;
-                ud[ui]     = 255;
-                ud[ui + 1] = 255;
-                ud[ui + 2] = 255;
-                ud[ui + 3] = 255;
-            }
-            unknownCtx.putImageData(uData, 0, 0);
+    function cancelIdle(handle) {
+        if (handle.idle) {
+            window.cancelIdleCallback(handle.id);
+        } else {
+            clearTimeout(handle.id);
         }
     }
 
-    // ── History ──────────────────────────────────────────────────────
-
-    function clearHistory() {
-        state.history = [];
-        state.historyIndex = -1;
-        updateHistoryButtons();
+    function scheduleCommit() {
+        state.commitVersion++;
+        state.trimapStatsDirty = true;
+        scheduleAutosave();
+        if (state.commitHandle) return;
+        state.commitHandle = requestIdle(runScheduledCommit);
     }
 
-    function snapshotHistory() {
-        var w = unknownCanvas.width;
-        var h = unknownCanvas.height;
-        if (w === 0 || h === 0) return;
-
-        // Truncate redo stack
-        state.history = state.history.slice(0, state.historyIndex + 1);
-        state.history.push({
-            unknown: unknownCtx.getImageData(0, 0, w, h),
-            fg:      fgCtx.getImageData(0, 0, w, h),
-        });
-        if (state.history.length > MAX_HISTORY) {
-            state.history.shift();
+    // Drops every commit of the current image: encodes still in flight
+    // fail their version check and a staged (lazy) value is discarded, so
+    // nothing is left to flush.  Called when the image is removed or
+    // replaced.
+    function cancelCommits() {
+        state.commitVersion++;
+        state.committedVersion = state.commitVersion;
+        state.stagedValue = null;
+        if (state.commitHandle) {
+            cancelIdle(state.commitHandle);
+            state.commitHandle = null;
         }
-        state.historyIndex = state.history.length - 1;
-        updateHistoryButtons();
     }
 
-    function undo() {
-        if (state.historyIndex <= 0) return;
-        state.historyIndex--;
-        restoreSnapshot(state.history[state.historyIndex]);
-        updateHistoryButtons();
-        updateTrimapView();
-        commitValue();
-        render();
+    function runScheduledCommit() {
+        state.commitHandle = null;
+        // The label map is half-filled while a fill runs; it commits when done
+        if (state.fillJob) return;
+        if (state.trimapStatsDirty) updateTrimapStats();
+        commitValue(false);
     }
 
-    function redo() {
-        if (state.historyIndex >= state.history.length - 1) return;
-        state.historyIndex++;
-        restoreSnapshot(state.history[state.historyIndex]);
-        updateHistoryButtons();
-        updateTrimapView();
-        commitValue();
-        render();
+    function flushCommit() {
+        if (state.committedVersion === state.commitVersion || state.fillJob) return;
+        var staged = state.stagedValue;
+        if (staged && staged.version === state.commitVersion) {
+            publishValue(staged.version, staged.json);
+            return;
+        }
+        if (state.commitHandle) {
+            cancelIdle(state.commitHandle);
+            state.commitHandle = null;
+        }
+        if (state.trimapStatsDirty) updateTrimapStats();
+        commitValue(true);
     }
 
-    function restoreSnapshot(snap) {
-        unknownCtx.putImageData(snap.unknown, 0, 0);
-        fgCtx.putImageData(snap.fg, 0, 0);
+    // Python events are dispatched from clicks and key presses on other
+    // components; capture-phase listeners run before Gradio reads the value.
+    function flushBeforeExternalEvent(e) {
+        if (element.contains(e.target)) return;
+        flushCommit();
     }
-
-    function updateHistoryButtons() {
-        undoBtn.disabled = state.historyIndex <= 0;
-        redoBtn.disabled = state.historyIndex >= state.history.length - 1;
+    document.addEventListener("pointerdown", flushBeforeExternalEvent, true);
+    document.addEventListener("keydown", flushBeforeExternalEvent, true);
+    if (COMMIT_MODE === "lazy") {
+        // Also publish when focus or the page goes away, so programmatic
+        // reads (timers, other components' change events) are rarely stale.
+        container.addEventListener("focusout", function (e) {
+            if (!element.contains(e.relatedTarget)) flushCommit();
+        });
+        document.addEventListener("visibilitychange", function () {
+            if (document.visibilityState === "hidden") flushCommit();
+        });
     }
 
-    // ── Trimap view & value commit ───────────────────────────────────
-
-    // Composites unknownCanvas + fgCanvas into trimapViewCanvas (0/128/255 grayscale).
-    // Called after each stroke end, undo/redo, clear.
-    function updateTrimapView() {
-        var iw = unknownCanvas.width;
-        var ih = unknownCanvas.height;
-        if (iw === 0 || ih === 0) return;
-
-        trimapViewCanvas.width  = iw;
-        trimapViewCanvas.height = ih;
-
-        var unknownData = unknownCtx.getImageData(0, 0, iw, ih).data;
-        var fgData      = fgCtx.getImageData(0, 0, iw, ih).data;
-        var out = trimapViewCtx.createImageData(iw, ih);
-        var d   = out.data;
-
-        for (var i = 0; i < iw * ih; i++) {
-            var a = i * 4 + 3;
-            var val;
-            if (fgData[a] > 127) {
-                val = 255;
-            } else if (unknownData[a] > 127) {
-                val = 128;
-            } else {
-                val = 0;
-            }
-            d[i * 4]     = val;
-            d[i * 4 + 1] = val;
-            d[i * 4 + 2] = val;
-            d[i * 4 + 3] = 255;
+    // publish=false (idle-time commits) only stages the value in lazy mode.
+    function writeValue(version, value, publish) {
+        // Stale: a newer commit was scheduled, or this one was already flushed
+        if (version !== state.commitVersion || version === state.committedVersion) return;
+        var json = JSON.stringify(value);
+        if (COMMIT_MODE === "lazy" && !publish) {
+            state.stagedValue = { version: version, json: json };
+            return;
         }
-        trimapViewCtx.putImageData(out, 0, 0);
+        publishValue(version, json);
+    }
+
+    function publishValue(version, json) {
+        state.committedVersion = version;
+        state.stagedValue = null;
+        props.value = json;
     }
 
-    // Encodes the current trimap as a base64 PNG and stores it in props.value.
+    // Encodes the current trimap and stores it in props.value.  sync=true
+    // encodes PNGs with toDataURL so the value is current on return;
+    // otherwise they are encoded in the encode worker.
     // No trigger("input") — value is picked up lazily when another button fires.
-    function commitValue() {
+    function commitValue(sync) {
         if (!state.image) return;
 
         // Build image reference
@@ -818,24 +3199,329 @@
             imageRef = imageRef.substring(idx + marker.length);
         }
 
-        var iw = unknownCanvas.width;
-        var ih = unknownCanvas.height;
-        var imageRefCopy = imageRef;
+        var version = state.commitVersion;
+        var value = {
+            image:  imageRef,
+            stats:  state.trimapStats,
+            width:  labelW,
+            height: labelH,
+        };
+        if (profiler) value.profile = profileSummary();
+
+        if (VALUE_FORMAT === "rle" && state.trimapRLE) {
+            // Runs were built with the stats by updateTrimapStats(), so commit synchronously.
+            value.trimapRLE = bytesToBase64(state.trimapRLE.bytes, state.trimapRLE.length);
+            writeValue(version, value, sync);
+            return;
+        }
+
+        if (VALUE_FORMAT === "strokes") {
+            // Ops are plain JSON; only a new keyframe needs encoding.
+            encodeLatestKeyframe(sync, function () {
+                if (version !== state.commitVersion) return;
+                value.strokes = { version: 1, ops: collectStrokeOps() };
+                writeValue(version, value, sync);
+            });
+            return;
+        }
+
+        if (sync) {
+            updateTrimapView();
+            value.trimapBase64 = trimapViewCanvas.toDataURL("image/png");
+            writeValue(version, value, true);
+            return;
+        }
+        if (!encodeWorkerAvailable()) {
+            encodePngOnMainThread(version, value);
+            return;
+        }
+        var t0 = performance.now();
+        encodeTrimapInWorker(labels, value.width, value.height, function (dataUrl) {
+            if (version !== state.commitVersion) return;
+            if (dataUrl === null) {
+                encodePngOnMainThread(version, value);
+                return;
+            }
+            if (profiler) profileSince("encode", t0);
+            value.trimapBase64 = dataUrl;
+            writeValue(version, value, false);
+        });
+    }
 
+    // Main-thread fallback for the encode worker: async toBlob, then base64.
+    function encodePngOnMainThread(version, value) {
+        var t0 = performance.now();
+        updateTrimapView();
         trimapViewCanvas.toBlob(function (blob) {
+            // Skip the FileReader pass if the result is already stale
+            if (version !== state.commitVersion) return;
             var reader = new FileReader();
             reader.onload = function () {
-                props.value = JSON.stringify({
-                    image:       imageRefCopy,
-                    trimapBase64: reader.result,  // "data:image/png;base64,..."
-                    width:       iw,
-                    height:      ih,
-                });
+                if (profiler) profileSince("encode", t0);
+                value.trimapBase64 = reader.result;  // "data:image/png;base64,..."
+                writeValue(version, value, false);
             };
             reader.readAsDataURL(blob);
         }, "image/png");
     }
 
+    // ── Autosave (IndexedDB) ─────────────────────────────────────────
+    // A checkpoint of the history base (the label map at historyIndex, as a
+    // writeRun() stream) and the undo entries up to it is written in idle
+    // time, keyed by a fingerprint of the image, and restored when the same
+    // image is reopened without a trimap.  The same transaction spills the
+    // tile deltas of entries older than HISTORY_RESIDENT_STEPS into the
+    // "deltas" store, so long sessions keep only recent undo steps in
+    // memory.  Each save also evicts other images' checkpoints (and their
+    // deltas) past AUTOSAVE_MAX_CHECKPOINTS or AUTOSAVE_MAX_AGE, found
+    // through the savedAt index without reading them.  Any IndexedDB
+    // failure (private mode, quota) just means no autosave.
+    //   checkpoints: imageKey → {width, height, base, history, strokeBaseOps, nextId, savedAt}
+    //                (indexed by savedAt)
+    //   deltas:      [imageKey, entry id] → [{t, runs}]
+
+    var _dbPromise = null;
+
+    function openDb() {
+        if (!_dbPromise) {
+            _dbPromise = new Promise(function (resolve, reject) {
+                if (typeof indexedDB === "undefined") {
+                    reject(new Error("IndexedDB unavailable"));
+                    return;
+                }
+                var req = indexedDB.open("trimap-editor", 2);
+                req.onupgradeneeded = function (e) {
+                    if (e.oldVersion < 1) {
+                        req.result.createObjectStore("checkpoints");
+                        req.result.createObjectStore("deltas");
+                    }
+                    if (e.oldVersion < 2) {
+                        req.transaction.objectStore("checkpoints").createIndex("savedAt", "savedAt");
+                    }
+                };
+                req.onsuccess = function () { resolve(req.result); };
+                req.onerror = function () { reject(req.error); };
+            });
+        }
+        return _dbPromise;
+    }
+
+    // Runs fn(tx) in one transaction; resolves with the result of the
+    // request fn returns (if any) once the transaction has committed.
+    function idbTransaction(storeNames, mode, fn) {
+        return openDb().then(function (db) {
+            return new Promise(function (resolve, reject) {
+                var tx = db.transaction(storeNames, mode);
+                var req = fn(tx);
+                tx.oncomplete = function () { resolve(req ? req.result : undefined); };
+                tx.onerror = tx.onabort = function () { reject(tx.error); };
+            });
+        });
+    }
+
+    // FNV-1a over the image size and a 32×32 thumbnail, so the key is the
+    // same whether the image comes from Python or an upload.  null when the
+    // pixels can't be read (cross-origin image without CORS).
+    function imageFingerprint(img) {
+        var fc = document.createElement("canvas");
+        fc.width = 32;
+        fc.height = 32;
+        var fctx = fc.getContext("2d");
+        fctx.drawImage(img, 0, 0, 32, 32);
+        var px;
+        try {
+            px = fctx.getImageData(0, 0, 32, 32).data;
+        } catch (e) {
+            return null;
+        }
+        var h = fnv1aWord(fnv1aWord(FNV_OFFSET, img.width), img.height);
+        for (var i = 0; i < px.length; i++) h = fnv1aByte(h, px[i]);
+        return img.width + "x" + img.height + ":" + (h >>> 0).toString(16);
+    }
+
+    function scheduleAutosave() {
+        if (!state.imageKey || state.autosaveTimer) return;
+        state.autosaveTimer = setTimeout(function () {
+            state.autosaveTimer = requestIdle(runAutosave);
+        }, AUTOSAVE_INTERVAL);
+    }
+
+    // Saves now if a save is pending, e.g. before the image is replaced.
+    function flushAutosave() {
+        var handle = state.autosaveTimer;
+        if (!handle) return;
+        if (typeof handle === "object") {
+            cancelIdle(handle);
+        } else {
+            clearTimeout(handle);
+        }
+        runAutosave();
+    }
+    document.addEventListener("visibilitychange", function () {
+        if (document.visibilityState === "hidden") flushAutosave();
+    });
+
+    function runAutosave() {
+        state.autosaveTimer = null;
+        var key = state.imageKey;
+        if (!key || !state.historyBase) return;
+        // Only checkpoint settled states: historyBase must match the labels
+        if (state.isDrawing || state.pendingDot || state.fillJob || state.historyLoading) {
+            scheduleAutosave();
+            return;
+        }
+        var w = labelW;
+        var h = labelH;
+        var history = state.history.slice(0, state.historyIndex + 1);
+        var spill = history.filter(function (entry, i) {
+            return !entry.spilled && entry.tiles.length > 0 && i < history.length - HISTORY_RESIDENT_STEPS;
+        });
+        if (spill.length > 0) settleStrokeKeyframes(history.indexOf(spill[spill.length - 1]));
+        var live = {};
+        var saved = history.map(function (entry) {
+            var out = entry.spilled || spill.indexOf(entry) !== -1;
+            if (out) live[entry.id] = true;
+            return { id: entry.id, tiles: out ? null : entry.tiles, bytes: entry.bytes, ops: entry.ops };
+        });
+        var checkpoint = {
+            width:  w,
+            height: h,
+            // XOR against a blank map is the map itself
+            base:   diffTile(state.historyBase, new Uint8Array(w * h), w, 0, 0, w, h),
+            history: saved,
+            strokeBaseOps: state.strokeBaseOps,
+            nextId:  state.historySeq,
+            savedAt: Date.now(),
+        };
+        idbTransaction(["checkpoints", "deltas"], "readwrite", function (tx) {
+            var deltas = tx.objectStore("deltas");
+            spill.forEach(function (entry) {
+                deltas.put(entry.tiles, [key, entry.id]);
+            });
+            // Drop deltas of entries that were undone past or aged out
+            var cursorReq = deltas.openKeyCursor(IDBKeyRange.bound([key, 0], [key, Infinity]));
+            cursorReq.onsuccess = function () {
+                var cursor = cursorReq.result;
+                if (!cursor) return;
+                if (!live[cursor.primaryKey[1]]) deltas.delete(cursor.primaryKey);
+                cursor.continue();
+            };
+            var checkpoints = tx.objectStore("checkpoints");
+            checkpoints.put(checkpoint, key);
+            evictCheckpoints(checkpoints, deltas, key, checkpoint.savedAt);
+        }).then(function () {
+            spill.forEach(function (entry) {
+                entry.tiles = null;
+                entry.spilled = true;
+            });
+        }).catch(function () {});
+    }
+
+    // Before the deltas up to history index last are spilled: labelsAtHistory()
+    // can no longer reach past them, so the strokes log encodes every
+    // keyframe up to last now and ends entry last with one, which the log
+    // restarts from and foldStrokeOps() collapses the base into.
+    function settleStrokeKeyframes(last) {
+        if (VALUE_FORMAT !== "strokes") return;
+        if (!endsWithKeyframe(state.history[last])) {
+            state.history[last].ops.push({ op: "keyframe", trimap: null });
+        }
+        for (var i = 0; i <= last; i++) {
+            var entry = state.history[i];
+            var op = entry.ops[entry.ops.length - 1];
+            if (endsWithKeyframe(entry) && !op.trimap && historyResident(i)) {
+                op.trimap = encodeKeyframe(labelsAtHistory(i));
+            }
+        }
+    }
+
+    // Deletes the checkpoints (other than key's) beyond the newest
+    // AUTOSAVE_MAX_CHECKPOINTS or saved before now - AUTOSAVE_MAX_AGE,
+    // with their spilled deltas, within the caller's transaction.
+    function evictCheckpoints(checkpoints, deltas, key, now) {
+        var kept = 0;
+        var cursorReq = checkpoints.index("savedAt").openKeyCursor(null, "prev");
+        cursorReq.onsuccess = function () {
+            var cursor = cursorReq.result;
+            if (!cursor) return;
+            var other = cursor.primaryKey;
+            if (other !== key) {
+                kept++;
+                if (kept >= AUTOSAVE_MAX_CHECKPOINTS || cursor.key < now - AUTOSAVE_MAX_AGE) {
+                    checkpoints.delete(other);
+                    deltas.delete(IDBKeyRange.bound([other, 0], [other, Infinity]));
+                }
+            }
+            cursor.continue();
+        };
+    }
+
+    // Reads a spilled entry's deltas back and retries (undo or redo).  If
+    // they are gone, the history beyond the entry is dropped instead.
+    function loadSpilledEntry(entry, retry) {
+        var key = state.imageKey;
+        state.historyLoading = true;
+        idbTransaction(["deltas"], "readonly", function (tx) {
+            return tx.objectStore("deltas").get([key, entry.id]);
+        }).then(function (tiles) {
+            if (!tiles) throw new Error("Spilled history entry missing");
+            entry.tiles = tiles;
+            entry.spilled = false;
+        }).catch(function () {
+            var i = state.history.indexOf(entry);
+            if (i > state.historyIndex) {
+                // Redo steps from the entry on are lost
+                state.history.length = i;
+                state.historyBytes = 0;
+                state.history.forEach(function (e) { state.historyBytes += e.bytes; });
+            } else {
+                // The entry's result becomes the oldest state
+                while (state.history.indexOf(entry) > 0) dropOldestHistory();
+            }
+            updateHistoryButtons();
+        }).then(function () {
+            state.historyLoading = false;
+            if (state.history.indexOf(entry) !== -1) retry();
+        });
+    }
+
+    // Replaces a fresh image's blank masks and history with its autosave.
+    // Skipped if the image changed or editing started while reading.
+    function restoreAutosave() {
+        var key = state.imageKey;
+        var seq = state.imageLoadSeq;
+        if (!key) return;
+        idbTransaction(["checkpoints"], "readonly", function (tx) {
+            return tx.objectStore("checkpoints").get(key);
+        }).then(function (cp) {
+            var w = labelW;
+            var h = labelH;
+            if (!cp || seq !== state.imageLoadSeq || state.imageKey !== key) return;
+            if (cp.width !== w || cp.height !== h) return;
+            if (state.historyIndex > 0 || state.isDrawing || state.pendingDot || state.fillJob) return;
+            labels.fill(0);
+            applyTileDelta(labels, w, 0, 0, w, h, cp.base);
+            state.historyBase = labels.slice();
+            state.editedTiles = new Uint8Array(Math.ceil(w / HISTORY_TILE) * Math.ceil(h / HISTORY_TILE));
+            state.history = cp.history.map(function (entry) {
+                return { id: entry.id, tiles: entry.tiles, bytes: entry.bytes, ops: entry.ops, spilled: entry.tiles === null };
+            });
+            state.history[0].tiles = [];
+            state.history[0].spilled = false;
+            state.historyIndex = state.history.length - 1;
+            state.historyBytes = 0;
+            state.history.forEach(function (entry) { state.historyBytes += entry.bytes; });
+            state.historySeq = cp.nextId;
+            state.strokeBaseOps = cp.strokeBaseOps;
+            state.pendingOps = [];
+            state.activeStroke = null;
+            syncMaskDisplay(0, 0, w, h);
+            updateHistoryButtons();
+            scheduleCommit();
+            requestRender(editLayers());
+        }).catch(function () {});
+    }
+
     // ── File upload ──────────────────────────────────────────────────
 
     function loadImageFile(file) {
@@ -850,19 +3536,27 @@
         state.imageUrl   = null;
         state.imageSource = "upload";
         state.pendingCommit = false;
-
-        var img = new Image();
-        img.onload = function () {
+        cancelCommits();
+
+        // The blob URL only identifies this upload; the pixels are decoded
+        // straight from the file
+        var seq = ++state.imageLoadSeq;
+        createImageBitmap(file).then(function (img) {
+            if (seq !== state.imageLoadSeq) {
+                img.close();  // superseded by a later load
+                return;
+            }
             // Set up canvas and compute zoom BEFORE setting state.image so
             // that any ResizeObserver render triggered by canvasWrapper layout
             // queries finds state.image=null and skips rendering, preventing
             // a brief zoom=1 flash before the first correct render.
-            initMaskCanvases(img.naturalWidth, img.naturalHeight);
+            flushAutosave();
+            initMaskCanvases(img.width, img.height);
             clearHistory();
             canvasWrapper.classList.add("te-has-image");
             resizeCanvas();
-            var iw = img.naturalWidth;
-            var ih = img.naturalHeight;
+            var iw = img.width;
+            var ih = img.height;
             var cw = canvas.width;
             var ch = canvas.height;
             var z = Math.min(cw / iw, ch / ih);
@@ -870,11 +3564,16 @@
             state.panX = (cw - iw * z) / 2;
             state.panY = (ch - ih * z) / 2;
             // Set state.image last: first render() always has correct zoom/pan,
-            // and mousedown's state.image guard blocks clicks until ready.
+            // and pointerdown's state.image guard blocks clicks until ready.
+            closeImage();
             state.image = img;
-            render();
-        };
-        img.src = url;
+            state.imageReload = function () { return createImageBitmap(file); };
+            state.imageKey = AUTOSAVE ? imageFingerprint(img) : null;
+            requestRender();
+            restoreAutosave();
+        }, function () {
+            // Undecodable file — keep the current image
+        });
 
         // Upload to server in parallel; image is rendered immediately from blob URL
         uploadToServer(file, url);
@@ -889,27 +3588,71 @@
             // server path as a Python-provided image and call initMaskCanvases +
             // clearHistory, wiping any masks the user has already drawn and
             // causing a visible re-initialization flicker.
-            // props.value is set by commitValue() (with trimapBase64) when
+            // props.value is set by commitValue() (with the trimap) when
             // the user draws a stroke or explicitly exports the trimap.
             if (state.pendingCommit) {
                 state.pendingCommit = false;
-                updateTrimapView();
-                commitValue();
+                scheduleCommit();
             }
         }).catch(function () {
             if (state.objectUrl !== capturedUrl) return;
         });
     }
 
+    // Replaces the masks with a trimap or alpha-matte file, decoded and
+    // thresholded (MATTE_BAND) in the decode worker, as one history entry.
+    // The file never leaves the browser.
+    function loadTrimapFile(file) {
+        if (!file || !file.type.startsWith("image/") || !state.image) return;
+        var seq = state.imageLoadSeq;
+        var iw = labelW;
+        var ih = labelH;
+        decodeTrimap(file, iw, ih, MATTE_BAND, function (fileLabels) {
+            if (!fileLabels || seq !== state.imageLoadSeq) return;
+            // Busy with a stroke, fill or undo — drop the load rather than
+            // interleave it (the user can drop the file again)
+            if (state.isDrawing || state.fillJob || state.historyLoading) return;
+            if (state.historyIndex < 0) snapshotHistory();
+            labels.set(fileLabels);
+            markMaskDirty(0, 0, iw, ih);
+            logKeyframe();
+            snapshotHistory();
+            scheduleCommit();
+            requestRender(editLayers());
+        });
+    }
+
     // ── Focus on hover so keyboard shortcuts work without a click ────
-    canvas.addEventListener("mouseenter", function () {
+    canvas.addEventListener("pointerenter", function () {
+        invalidateCanvasRect();
         container.focus();
+        if (state.tool === "edge") requestEdgeMap();
     });
 
-    // ── Canvas mouse/pointer events ──────────────────────────────────
+    // ── Canvas pointer events ────────────────────────────────────────
+    // Mouse, pen and touch share one path; only the primary pointer draws.
+
+    // pointerdown carries no click count (its detail is 0), so count
+    // presses the way the browser does for dblclick: a second press soon
+    // after the first, in about the same place.
+    var DBLCLICK_MS = 500;
+    var _lastPress = { time: -Infinity, x: 0, y: 0, count: 0 };
+
+    function countClicks(e) {
+        var p = _lastPress;
+        var repeat = e.pointerType === "mouse" && e.timeStamp - p.time < DBLCLICK_MS &&
+                     Math.abs(e.clientX - p.x) < 5 && Math.abs(e.clientY - p.y) < 5;
+        p.count = repeat ? p.count + 1 : 1;
+        p.time = e.timeStamp;
+        p.x = e.clientX;
+        p.y = e.clientY;
+        return p.count;
+    }
 
-    canvas.addEventListener("mousedown", function (e) {
-        if (!state.image) return;
+    canvas.addEventListener("pointerdown", function (e) {
+        if (!state.image || !e.isPrimary) return;
+        invalidateCanvasRect();
+        var clicks = countClicks(e);
         // Note: drawing is allowed in trimap view mode so users can fix holes directly
 
         var panActive = state.spaceHeld || state.tool === "pan";
@@ -929,19 +3672,28 @@
 
         e.preventDefault();
 
-        // Skip drawing on the 2nd click of a double-click (detail >= 2).
+        // Skip drawing on the 2nd click of a double-click.
         // The dblclick handler will undo the 1st click's dot and reset zoom.
-        if (e.detail >= 2) return;
+        if (clicks >= 2) return;
+        // A time-sliced fill is still running; edits would race its write-back
+        if (state.fillJob) return;
 
-        // Bucket tool: single-click flood fill, no drag
-        if (state.tool === "bucket") {
+        // Bucket and wand: single-click flood fill, no drag
+        if (state.tool === "bucket" || state.tool === "wand") {
             var bpt = clientToImage(e.clientX, e.clientY);
             if (state.historyIndex < 0) snapshotHistory();
-            floodFillAt(bpt.x, bpt.y);
-            snapshotHistory();
-            updateTrimapView();
-            commitValue();
-            requestRender();
+            var fillAt = state.tool === "wand" ? wandFillAt : floodFillAt;
+            fillAt(bpt.x, bpt.y, function () {
+                snapshotHistory();
+                scheduleCommit();
+                requestRender(editLayers());
+            });
+            return;
+        }
+
+        // The edge brush waits for its edge map (requested on hover)
+        if (state.tool === "edge" && !edgeMapReady()) {
+            requestEdgeMap();
             return;
         }
 
@@ -950,41 +3702,41 @@
         state.lastIX = pt.x;
         state.lastIY = pt.y;
         // Defer the initial dot so double-click doesn't flash a painted pixel.
-        // The dot is flushed immediately on mousemove (drag) or after a short
-        // timeout (single click without drag).  dblclick cancels it entirely.
+        // The dot is flushed immediately on pointermove (drag) or after a
+        // short timeout (single click without drag).  dblclick cancels it.
         state.pendingDot = { x: pt.x, y: pt.y };
         state.pendingDotTimer = setTimeout(function () {
             if (!state.pendingDot) return;
             if (state.historyIndex < 0) snapshotHistory();
-            paintAt(state.pendingDot.x, state.pendingDot.y);
+            strokeDot(state.pendingDot.x, state.pendingDot.y);
+            flushStamps();
             state.pendingDot = null;
             state.pendingDotTimer = null;
-            requestRender();
-            // mouseup already fired (click without drag) → finalize stroke
+            requestRender(editLayers());
+            // pointerup already fired (click without drag) → finalize stroke
             if (!state.isDrawing) {
                 snapshotHistory();
-                updateTrimapView();
-                commitValue();
+                scheduleCommit();
             }
         }, 300);
     });
 
-    window.addEventListener("mousemove", function (e) {
-        if (!state.image) return;
+    window.addEventListener("pointermove", function (e) {
+        if (!state.image || !e.isPrimary) return;
 
         if (state.isPanning) {
             var dx = e.clientX - state.panStartX;
             var dy = e.clientY - state.panStartY;
-            var rect = canvas.getBoundingClientRect();
+            var rect = canvasRect();
             state.panX = state.panStartPanX + dx * (canvas.width  / rect.width);
             state.panY = state.panStartPanY + dy * (canvas.height / rect.height);
             clampPan();
-            requestRender();
+            requestRender(VIEW_PANNED | LAYER_HUD);
             return;
         }
 
         // Update cursor position for rendering
-        var rect = canvas.getBoundingClientRect();
+        var rect = canvasRect();
         if (e.clientX >= rect.left && e.clientX <= rect.right &&
             e.clientY >= rect.top  && e.clientY <= rect.bottom) {
             var scaleX = canvas.width  / rect.width;
@@ -995,8 +3747,8 @@
             // Check if cursor is over the actual image area
             var ix = (state.cursorX - state.panX) / state.zoom;
             var iy = (state.cursorY - state.panY) / state.zoom;
-            var iw = state.image.naturalWidth;
-            var ih = state.image.naturalHeight;
+            var iw = state.image.width;
+            var ih = state.image.height;
             state.cursorOverImage = ix >= 0 && ix < iw && iy >= 0 && iy < ih;
         } else {
             state.mouseInsideCanvas = false;
@@ -1005,26 +3757,32 @@
         updateCursor();
 
         if (state.isDrawing) {
+            // Stroke latency runs from the oldest input not yet on screen
+            if (profiler && !profiler.inputTime) profiler.inputTime = e.timeStamp;
             // Flush deferred dot on first drag move
             if (state.pendingDot) {
                 clearTimeout(state.pendingDotTimer);
                 state.pendingDotTimer = null;
                 if (state.historyIndex < 0) snapshotHistory();
-                paintAt(state.pendingDot.x, state.pendingDot.y);
+                strokeDot(state.pendingDot.x, state.pendingDot.y);
                 state.pendingDot = null;
             }
-            var pt = clientToImage(e.clientX, e.clientY);
-            paintInterpolated(state.lastIX, state.lastIY, pt.x, pt.y);
-            state.lastIX = pt.x;
-            state.lastIY = pt.y;
-            // Keep trimapViewCanvas current so strokes are visible in real-time
-            if (state.showTrimap) updateTrimapView();
+            // The browser coalesces high-rate input into one event per
+            // frame; stroke through every sample, then stamp them as a batch.
+            var samples = e.getCoalescedEvents ? e.getCoalescedEvents() : [];
+            if (samples.length === 0) samples = [e];
+            for (var i = 0; i < samples.length; i++) {
+                var pt = clientToImage(samples[i].clientX, samples[i].clientY);
+                strokeTo(pt.x, pt.y);
+            }
+            flushStamps();
         }
 
-        requestRender();
+        requestRender(state.isDrawing ? editLayers() | LAYER_HUD : LAYER_HUD);
     });
 
-    window.addEventListener("mouseup", function (e) {
+    function endPointer(e) {
+        if (!e.isPrimary) return;
         if (state.isPanning) {
             state.isPanning = false;
             updateCursor();
@@ -1036,14 +3794,16 @@
         // handle painting + snapshotting.  dblclick may cancel it.
         if (state.pendingDot) return;
         snapshotHistory();
-        updateTrimapView();
-        commitValue();
-        requestRender();
-    });
+        scheduleCommit();
+        requestRender(editLayers());
+    }
+
+    window.addEventListener("pointerup", endPointer);
+    window.addEventListener("pointercancel", endPointer);
 
-    canvas.addEventListener("mouseleave", function () {
+    canvas.addEventListener("pointerleave", function () {
         state.mouseInsideCanvas = false;
-        requestRender();
+        requestRender(LAYER_HUD);
     });
 
     canvas.addEventListener("contextmenu", function (e) {
@@ -1051,7 +3811,7 @@
     });
 
     // Double-click anywhere → reset zoom to contain-fit
-    // The initial dot from the 1st mousedown is deferred (pendingDot),
+    // The initial dot from the 1st pointerdown is deferred (pendingDot),
     // so we just cancel it here — no undo needed, no visual flicker.
     canvas.addEventListener("dblclick", function (e) {
         if (!state.image) return;
@@ -1079,7 +3839,7 @@
         newZoom = Math.max(minZoom(), Math.min(MAX_ZOOM, newZoom));
 
         // Zoom toward cursor
-        var rect = canvas.getBoundingClientRect();
+        var rect = canvasRect();
         var mx = (e.clientX - rect.left) * (canvas.width  / rect.width);
         var my = (e.clientY - rect.top)  * (canvas.height / rect.height);
         state.panX = mx - (mx - state.panX) * (newZoom / state.zoom);
@@ -1094,10 +3854,7 @@
     // Layer buttons
     element.querySelectorAll("[data-layer]").forEach(function (btn) {
         btn.addEventListener("click", function () {
-            state.layer = this.getAttribute("data-layer");
-            element.querySelectorAll("[data-layer]").forEach(function (b) {
-                b.classList.toggle("active", b.getAttribute("data-layer") === state.layer);
-            });
+            activateLayer(this.getAttribute("data-layer"));
         });
     });
 
@@ -1112,28 +3869,56 @@
     brushSizeSlider.addEventListener("input", function () {
         state.brushSizeBrush = parseInt(this.value, 10);
         brushSizeVal.textContent = this.value;
-        requestRender();
+        requestRender(LAYER_HUD);
     });
 
     // Eraser size slider
     eraserSizeSlider.addEventListener("input", function () {
         state.brushSizeEraser = parseInt(this.value, 10);
         eraserSizeVal.textContent = this.value;
-        requestRender();
+        requestRender(LAYER_HUD);
+    });
+
+    // Edge brush threshold slider
+    edgeThreshSlider.addEventListener("input", function () {
+        state.edgeThreshold = parseInt(this.value, 10);
+        edgeThreshVal.textContent = this.value;
+    });
+
+    // Wand tolerance slider
+    wandTolSlider.addEventListener("input", function () {
+        state.wandTolerance = parseInt(this.value, 10);
+        wandTolVal.textContent = this.value;
+    });
+
+    // Grow / shrink
+    morphSizeSlider.addEventListener("input", function () {
+        state.morphSize = parseInt(this.value, 10);
+        morphSizeVal.textContent = this.value;
     });
+    growBtn.addEventListener("click", function () { morphActiveLayer(true); });
+    shrinkBtn.addEventListener("click", function () { morphActiveLayer(false); });
+
+    // Remove islands / fill holes
+    islandSizeSlider.addEventListener("input", function () {
+        state.islandSize = parseInt(this.value, 10);
+        islandSizeVal.textContent = this.value;
+    });
+    islandsBtn.addEventListener("click", function () { cleanupActiveLayer(false); });
+    holesBtn.addEventListener("click", function () { cleanupActiveLayer(true); });
 
     // Unknown alpha slider
     unknownAlphaSlider.addEventListener("input", function () {
         state.unknownAlpha = parseInt(this.value, 10) / 100;
         unknownAlphaVal.textContent = this.value + "%";
-        requestRender();
+        requestRender(LAYER_MASKS);
     });
 
     // Fg alpha slider
     fgAlphaSlider.addEventListener("input", function () {
         state.fgAlpha = parseInt(this.value, 10) / 100;
         fgAlphaVal.textContent = this.value + "%";
-        requestRender();
+        requestRender(LAYER_MASKS);
     });
 
     // ── Color palette ──────────────────────────────────────────────
@@ -1177,14 +3962,14 @@
         if (!item) return;
         var color = item.getAttribute("data-color");
         if (_activeColorTarget === "unknown") {
-            state.unknownColor = color;
+            setLayerColor("unknown", color);
             unknownColorSwatch.style.background = color;
         } else if (_activeColorTarget === "foreground") {
-            state.fgColor = color;
+            setLayerColor("foreground", color);
             fgColorSwatch.style.background = color;
         }
         closeColorPalette();
-        requestRender();
+        requestRender(LAYER_MASKS);
     });
 
     // Close palette on outside click
@@ -1225,7 +4010,7 @@
             unknownAlphaVal.textContent = pct + "%";
             unknownVisBtn.classList.toggle("te-vis-off", state.unknownAlpha <= 0);
         }
-        requestRender();
+        requestRender(LAYER_MASKS);
     }
 
     fgVisBtn.addEventListener("click", function () { toggleVisibility("foreground"); });
@@ -1247,7 +4032,7 @@
     imageToggleBtn.addEventListener("click", function () {
         state.showImage = !state.showImage;
         imageToggleBtn.classList.toggle("active", state.showImage);
-        requestRender();
+        requestRender(LAYER_CONTENT);
     });
 
     // Clear (two-click confirm)
@@ -1258,7 +4043,7 @@
         clearConfirmTimer = null;
     }
     clearBtn.addEventListener("click", function () {
-        if (!state.image) return;
+        if (!state.image || state.fillJob || state.historyLoading) return;
         if (!clearConfirmTimer) {
             // First click — ask for confirmation
             clearBtn.textContent = "Sure?";
@@ -1269,15 +4054,13 @@
         // Second click — confirmed
         clearTimeout(clearConfirmTimer);
         resetClearBtn();
-        snapshotHistory(); // save before clear
-        var w = unknownCanvas.width;
-        var h = unknownCanvas.height;
-        unknownCtx.clearRect(0, 0, w, h);
-        fgCtx.clearRect(0, 0, w, h);
+        if (state.historyIndex < 0) snapshotHistory(); // save before clear
+        labels.fill(0);
+        markMaskDirty(0, 0, labelW, labelH);
+        logOp({ op: "clear" });
         snapshotHistory();
-        updateTrimapView();
-        commitValue();
-        render();
+        scheduleCommit();
+        requestRender(editLayers());
     });
 
     // View Trimap toggle
@@ -1290,14 +4073,18 @@
     cutoutInvertBtn.addEventListener("click", function () {
         toggleCutoutInvert();
     });
+    viewMatteBtn.addEventListener("click", function () {
+        toggleMatteView();
+    });
 
     function toggleTrimapView() {
         if (!state.image) return;
         state.showTrimap = !state.showTrimap;
         if (state.showTrimap) {
             state.showCutout = false;
+            state.showMatte = false;
             viewCutoutBtn.classList.remove("active");
-            updateTrimapView();
+            viewMatteBtn.classList.remove("active");
         }
         viewTrimapBtn.classList.toggle("active", state.showTrimap);
         requestRender();
@@ -1308,7 +4095,9 @@
         state.showCutout = !state.showCutout;
         if (state.showCutout) {
             state.showTrimap = false;
+            state.showMatte = false;
             viewTrimapBtn.classList.remove("active");
+            viewMatteBtn.classList.remove("active");
         } else {
             state.cutoutInvert = false;
             cutoutInvertBtn.classList.remove("active");
@@ -1318,11 +4107,27 @@
         requestRender();
     }
 
+    function toggleMatteView() {
+        if (!state.image) return;
+        state.showMatte = !state.showMatte;
+        if (state.showMatte) {
+            state.showTrimap = false;
+            state.showCutout = false;
+            state.cutoutInvert = false;
+            viewTrimapBtn.classList.remove("active");
+            viewCutoutBtn.classList.remove("active");
+            cutoutInvertBtn.classList.remove("active");
+            cutoutInvertBtn.disabled = true;
+        }
+        viewMatteBtn.classList.toggle("active", state.showMatte);
+        requestRender();
+    }
+
     function toggleCutoutInvert() {
         if (!state.showCutout) return;
         state.cutoutInvert = !state.cutoutInvert;
         cutoutInvertBtn.classList.toggle("active", state.cutoutInvert);
-        requestRender();
+        requestRender(LAYER_CONTENT);
     }
 
     // Remove image
@@ -1331,6 +4136,7 @@
 
         // Exit maximize mode if active
         if (state.maximized) toggleMaximize();
+        flushAutosave();
 
         // Revoke blob URL if any
         if (state.objectUrl) {
@@ -1338,26 +4144,32 @@
             state.objectUrl = null;
         }
 
-        // Reset image state
-        state.image       = null;
+        // Reset image state (and drop any decode still in flight)
+        state.imageLoadSeq++;
+        closeImage();
+        imagePyramid      = null;
+        state.imageKey    = null;
         state.imageUrl    = null;
         state.fileUrl    = null;
         state.imageSource = null;
         state.pendingCommit = false;
+        cancelCommits();
         state.showTrimap  = false;
         state.showCutout  = false;
+        state.showMatte   = false;
         state.cutoutInvert = false;
         viewTrimapBtn.classList.remove("active");
         viewCutoutBtn.classList.remove("active");
+        viewMatteBtn.classList.remove("active");
         cutoutInvertBtn.classList.remove("active");
         cutoutInvertBtn.disabled = true;
 
         // Reset clear button confirm state
         if (clearConfirmTimer) { clearTimeout(clearConfirmTimer); resetClearBtn(); }
 
-        // Clear mask canvases
-        unknownCtx.clearRect(0, 0, unknownCanvas.width, unknownCanvas.height);
-        fgCtx.clearRect(0, 0, fgCanvas.width, fgCanvas.height);
+        // Drop the label map and every display canvas
+        initMaskCanvases(0, 0);
+        releaseDisplay();
         clearHistory();
 
         // Remove has-image class to show upload hint
@@ -1366,10 +4178,6 @@
         // Reset file input so same file can be re-selected
         fileInput.value = "";
 
-        // Clear display canvas
-        ctx.setTransform(1, 0, 0, 1, 0, 0);
-        ctx.clearRect(0, 0, canvas.width, canvas.height);
-
         // Reset zoom/pan
         state.zoom = 1;
         state.panX = 0;
@@ -1411,10 +4219,9 @@
         document.body.style.overflow = state.maximized ? "hidden" : "";
         pinAncestorOpacity();
         if (state.image) {
-            requestAnimationFrame(function () {
-                resizeCanvas();
-                resetZoom();
-            });
+            _resizePending = true;
+            _fitPending = true;
+            requestRender();
         }
     }
 
@@ -1445,12 +4252,26 @@
         }
     });
 
-    // Drag & drop on canvas wrapper
+    loadTrimapBtn.addEventListener("click", function () {
+        if (state.image) trimapInput.click();
+    });
+    trimapInput.addEventListener("change", function () {
+        if (this.files && this.files[0]) loadTrimapFile(this.files[0]);
+        this.value = "";  // picking the same file again still fires change
+    });
+
+    // Drag & drop on canvas wrapper: an image to start with, then trimaps
+    // or alpha mattes for it
     canvasWrapper.addEventListener("dragover", function (e) { e.preventDefault(); });
     canvasWrapper.addEventListener("drop", function (e) {
         e.preventDefault();
         var file = e.dataTransfer && e.dataTransfer.files && e.dataTransfer.files[0];
-        if (file) loadImageFile(file);
+        if (!file) return;
+        if (state.image) {
+            loadTrimapFile(file);
+        } else {
+            loadImageFile(file);
+        }
     });
 
     // ── Cursor ─────────────────────────────────────────────────────────
@@ -1460,6 +4281,8 @@
             canvas.style.cursor = "grabbing";
         } else if (state.spaceHeld || state.tool === "pan") {
             canvas.style.cursor = "grab";
+        } else if (state.fillJob || edgeMapPending()) {
+            canvas.style.cursor = "progress";
         } else if (state.cursorOverImage) {
             canvas.style.cursor = "crosshair";
         } else {
@@ -1502,7 +4325,7 @@
         if (e.key === "i" || e.key === "I") {
             state.showImage = !state.showImage;
             imageToggleBtn.classList.toggle("active", state.showImage);
-            requestRender(); e.preventDefault(); return;
+            requestRender(LAYER_CONTENT); e.preventDefault(); return;
         }
         if (e.key === "m" || e.key === "M") {
             toggleMaximize(); e.preventDefault(); return;
@@ -1513,6 +4336,9 @@
         if (e.key === "c" || e.key === "C") {
             toggleCutoutView(); e.preventDefault(); return;
         }
+        if (e.key === "a" || e.key === "A") {
+            toggleMatteView(); e.preventDefault(); return;
+        }
         if (e.key === "n" || e.key === "N") {
             toggleCutoutInvert(); e.preventDefault(); return;
         }
@@ -1534,6 +4360,12 @@
         if (e.key === "g" || e.key === "G") {
             activateTool("bucket"); e.preventDefault(); return;
         }
+        if (e.key === "w" || e.key === "W") {
+            activateTool("wand"); e.preventDefault(); return;
+        }
+        if (e.key === "s" || e.key === "S") {
+            activateTool("edge"); e.preventDefault(); return;
+        }
         if (e.key === "x" || e.key === "X") {
             removeImage(); e.preventDefault(); return;
         }
@@ -1549,6 +4381,18 @@
         if (e.key === "]") {
             adjustBrushSize(2); e.preventDefault(); return;
         }
+        if (e.key === ".") {
+            morphActiveLayer(true); e.preventDefault(); return;
+        }
+        if (e.key === ",") {
+            morphActiveLayer(false); e.preventDefault(); return;
+        }
+        if (e.key === "h" || e.key === "H") {
+            cleanupActiveLayer(true); e.preventDefault(); return;
+        }
+        if (e.key === "k" || e.key === "K") {
+            cleanupActiveLayer(false); e.preventDefault(); return;
+        }
         if (e.key === "+" || e.key === "=") {
             zoomToCenter(state.zoom * 1.25); e.preventDefault(); return;
         }
@@ -1583,7 +4427,7 @@
             b.classList.toggle("active", b.getAttribute("data-layer") === layer);
         });
         // Cutout preview follows the active layer
-        if (state.showCutout) requestRender();
+        if (state.showCutout) requestRender(LAYER_CONTENT);
     }
 
     function getBrushSize() {
@@ -1605,6 +4449,7 @@
         element.querySelectorAll("[data-tool]").forEach(function (b) {
             b.classList.toggle("active", b.getAttribute("data-tool") === tool);
         });
+        if (tool === "edge") requestEdgeMap();
         updateCursor();
     }
 
@@ -1621,7 +4466,136 @@
             brushSizeSlider.value = newSize;
             brushSizeVal.textContent = newSize;
         }
-        requestRender();
+        requestRender(LAYER_HUD);
+    }
+
+    // ── Profiling (profile=True) ─────────────────────────────────────
+    // The hot paths are swapped for timed wrappers once, at startup, so a
+    // normal editor pays nothing.  Each sample is also a User Timing
+    // measure ("trimap-editor:<name>") for the browser's performance
+    // panel; the entries are cleared straight away so the buffer doesn't
+    // grow.  A summary rides along with every committed value and the
+    // HUD shows an overlay.
+
+    // Wraps the hot paths and returns the profiler state.
+    function instrumentHotPaths() {
+        render = profiled("render", render);
+        flushStamps = profiled("stamp", flushStamps);
+        runFillSlice = profiled("fill", runFillSlice);
+        snapshotHistory = profiled("snapshot", snapshotHistory);
+        updateTrimapView = profiled("trimapView", updateTrimapView);
+        commitValue = profiled("commit", commitValue);
+        return { metrics: {}, inputTime: 0 };
+    }
+
+    function profiled(name, fn) {
+        return function () {
+            var t0 = performance.now();
+            try {
+                return fn.apply(this, arguments);
+            } finally {
+                profileSince(name, t0);
+            }
+        };
+    }
+
+    // Records one sample of name: the time from t0 (performance.now()) to now.
+    function profileSince(name, t0) {
+        var t1 = performance.now();
+        var label = "trimap-editor:" + name;
+        try {
+            performance.measure(label, { start: t0, end: t1 });
+            performance.clearMeasures(label);
+        } catch (e) {
+            // No User Timing Level 3 — keep the sample anyway
+        }
+        var m = profiler.metrics[name];
+        if (!m) {
+            m = profiler.metrics[name] = { count: 0, total: 0, max: 0, samples: new Float64Array(PROFILE_SAMPLES) };
+        }
+        var ms = t1 - t0;
+        m.samples[m.count % PROFILE_SAMPLES] = ms;
+        m.count++;
+        m.total += ms;
+        if (ms > m.max) m.max = ms;
+    }
+
+    // {count, meanMs, p95Ms, maxMs} of a metric; p95 over the recent samples.
+    function metricSummary(m) {
+        var recent = Array.prototype.slice.call(m.samples, 0, Math.min(m.count, PROFILE_SAMPLES));
+        recent.sort(function (a, b) { return a - b; });
+        function round(ms) { return Math.round(ms * 100) / 100; }
+        return {
+            count: m.count,
+            meanMs: round(m.total / m.count),
+            p95Ms: round(recent[Math.min(recent.length - 1, Math.floor(recent.length * 0.95))]),
+            maxMs: round(m.max),
+        };
+    }
+
+    // Approximate backing-store bytes of the display canvases, the
+    // decoded image and the mask renderer's canvases (which may live in a
+    // worker: a display-size layer and two image-size masks in view).
+    function canvasBytes() {
+        var bytes = 0;
+        function add(c) { bytes += c.width * c.height * 4; }
+        [canvas, hudLayer, trimapViewCanvas, cutoutCanvas, matteCanvas].forEach(add);
+        [imagePyramid, trimapPyramid, cutoutPyramid, mattePyramid].forEach(function (pyramid) {
+            if (pyramid) pyramid.levels.slice(1).forEach(add);
+        });
+        if (state.image && !state.image.released) add(state.image);
+        if (state.inView && labelW > 0) bytes += canvas.width * canvas.height * 4 + 2 * labelW * labelH * 4;
+        return bytes;
+    }
+
+    // The summary committed as value.profile.
+    function profileSummary() {
+        var timings = {};
+        Object.keys(profiler.metrics).forEach(function (name) {
+            timings[name] = metricSummary(profiler.metrics[name]);
+        });
+        return {
+            timings: timings,
+            memory: {
+                historyBytes: state.historyBytes,
+                labelBytes: labels.length,
+                canvasBytes: canvasBytes(),
+            },
+            device: {
+                userAgent: navigator.userAgent,
+                cores: navigator.hardwareConcurrency || null,
+                memoryGB: navigator.deviceMemory || null,
+                pixelRatio: window.devicePixelRatio || 1,
+            },
+        };
+    }
+
+    // Frame time, stroke latency and memory, top left on the HUD.
+    function drawProfileOverlay() {
+        var metrics = profiler.metrics;
+        function timing(label, name) {
+            var m = metrics[name];
+            if (!m) return label + "  –";
+            var sum = metricSummary(m);
+            return label + "  " + sum.meanMs.toFixed(1) + " ms (p95 " + sum.p95Ms.toFixed(1) + ")";
+        }
+        function mb(bytes) { return (bytes / (1024 * 1024)).toFixed(1) + " MB"; }
+        var lines = [
+            timing("frame", "render"),
+            timing("stroke", "strokeLatency"),
+            "history  " + mb(state.historyBytes),
+            "canvas  " + mb(canvasBytes()),
+        ];
+        hudCtx.font = "11px ui-monospace, SFMono-Regular, Menlo, monospace";
+        var width = 0;
+        lines.forEach(function (line) { width = Math.max(width, hudCtx.measureText(line).width); });
+        hudCtx.fillStyle = "rgba(0,0,0,0.55)";
+        hudCtx.beginPath();
+        hudCtx.roundRect(8, 8, width + 12, lines.length * 15 + 8, 3);
+        hudCtx.fill();
+        hudCtx.fillStyle = "#fff";
+        hudCtx.textBaseline = "top";
+        lines.forEach(function (line, i) { hudCtx.fillText(line, 14, 13 + i * 15); });
     }
 
     // ── Window resize ─────────────────────────────────────────────────
@@ -1631,9 +4605,10 @@
         if (resizeTimer) clearTimeout(resizeTimer);
         resizeTimer = setTimeout(function () {
             if (state.image) {
-                resizeCanvas();
-                if (!state.maximized) resetZoom();
-                else render();
+                // Resize (and re-fit) in the frame that repaints
+                _resizePending = true;
+                if (!state.maximized) _fitPending = true;
+                requestRender(LAYER_ALL);
             }
         }, 150);
     });
@@ -0,0 +1,333 @@
+"""Server-side rasterizer for the stroke-log value format.
+
+The editor can commit an ordered log of operations instead of a PNG
+(``TrimapEditor(value_format="strokes")``).  :func:`rasterize_strokes`
+replays that log with the same rules the browser uses, so the server gets
+the exact trimap the user saw without shipping pixels over the wire.
+
+Log schema (``value["strokes"]``)::
+
+    {
+        "version": 1,
+        "ops": [
+            {"op": "keyframe", "trimap": "data:image/png;base64,..."},
+            {"op": "stroke", "layer": "foreground", "tool": "brush", "r": 12.5, "pts": [x0, y0, x1, y1, ...]},
+            {"op": "fill", "layer": "unknown", "x": 10, "y": 20},
+            {"op": "grow", "layer": "unknown", "r": 10},
+            {"op": "fill_holes", "layer": "foreground"},
+            {"op": "remove_islands", "layer": "foreground", "size": 50},
+            {"op": "clear"},
+        ],
+    }
+"""
+
+from __future__ import annotations
+
+import base64
+import math
+from io import BytesIO
+from typing import Any
+
+import numpy as np
+from PIL import Image
+
+__all__ = ["rasterize_strokes"]
+
+STROKE_LOG_VERSION = 1
+
+# Same thresholds as trimapBitmapLabels() in script.js
+_FG_THRESHOLD = 200
+_UNKNOWN_THRESHOLD = 64
+
+# Stamp spacing along a segment, as a fraction of the radius (paintInterpolated)
+_STAMP_SPACING = 0.3
+
+
+def _disk(cx: float, cy: float, r: float, shape: tuple[int, int]) -> tuple[slice, slice, np.ndarray] | None:
+    """Return the pixels whose centers lie inside the circle, clipped to ``shape``."""
+    h, w = shape
+    x0 = max(0, math.floor(cx - r - 1))
+    x1 = min(w, math.ceil(cx + r + 1))
+    y0 = max(0, math.floor(cy - r - 1))
+    y1 = min(h, math.ceil(cy + r + 1))
+    if x0 >= x1 or y0 >= y1:
+        return None
+    xs = np.arange(x0, x1, dtype=np.float64) + 0.5 - cx
+    ys = np.arange(y0, y1, dtype=np.float64) + 0.5 - cy
+    inside = ys[:, None] ** 2 + xs[None, :] ** 2 <= r * r
+    return slice(y0, y1), slice(x0, x1), inside
+
+
+def _stroke_mask(pts: list[float], r: float, shape: tuple[int, int]) -> np.ndarray:
+    """Rasterize one stroke: a dot at the first point, then interpolated stamps."""
+    mask = np.zeros(shape, dtype=bool)
+
+    def stamp(x: float, y: float) -> None:
+        disk = _disk(x, y, r, shape)
+        if disk is not None:
+            sy, sx, inside = disk
+            mask[sy, sx] |= inside
+
+    x0, y0 = pts[0], pts[1]
+    stamp(x0, y0)
+    for i in range(2, len(pts) - 1, 2):
+        x1, y1 = pts[i], pts[i + 1]
+        dx = x1 - x0
+        dy = y1 - y0
+        dist = math.sqrt(dx * dx + dy * dy)
+        steps = max(1, math.ceil(dist / (r * _STAMP_SPACING)))
+        for step in range(1, steps + 1):
+            t = step / steps
+            stamp(x0 + dx * t, y0 + dy * t)
+        x0, y0 = x1, y1
+    return mask
+
+
+def _flood_region(blocked: np.ndarray, x: int, y: int) -> np.ndarray:
+    """Return the 4-connected region of non-blocked pixels containing ``(x, y)``.
+
+    Scanline fill: each stack entry is a seed pixel; the whole horizontal run
+    around it is claimed at once and only run starts on the neighbouring rows
+    are pushed, so the stack stays proportional to the number of spans.
+    """
+    h, w = blocked.shape
+    region = np.zeros_like(blocked)
+    stack = [(x, y)]
+    while stack:
+        sx, sy = stack.pop()
+        row_blocked = blocked[sy] | region[sy]
+        if row_blocked[sx]:
+            continue
+        left_hits = np.flatnonzero(row_blocked[:sx])
+        left = int(left_hits[-1]) + 1 if left_hits.size else 0
+        right_hits = np.flatnonzero(row_blocked[sx:])
+        right = sx + int(right_hits[0]) if right_hits.size else w
+        region[sy, left:right] = True
+        for ny in (sy - 1, sy + 1):
+            if ny < 0 or ny >= h:
+                continue
+            open_px = ~(blocked[ny, left:right] | region[ny, left:right])
+            starts = np.flatnonzero(open_px & ~np.concatenate(([False], open_px[:-1])))
+            stack.extend((left + int(s), ny) for s in starts)
+    return region
+
+
+def _within(seed: np.ndarray, r: float) -> np.ndarray:
+    """Return the pixels whose centers lie within distance ``r`` of a ``seed`` pixel.
+
+    Exact squared distances up to ``r``: the distance to the nearest seed in
+    each column, then a minimum over horizontal offsets ``|dx| <= r``
+    (morphLabels() in script.js gets the same result with a full distance
+    transform).
+    """
+    h = seed.shape[0]
+    rows = np.arange(h, dtype=np.float64)[:, None]
+    above = np.maximum.accumulate(np.where(seed, rows, -np.inf), axis=0)
+    below = np.minimum.accumulate(np.where(seed, rows, np.inf)[::-1], axis=0)[::-1]
+    g2 = np.minimum(rows - above, below - rows) ** 2
+    d2 = g2.copy()
+    for dx in range(1, math.floor(r) + 1):
+        np.minimum(d2[:, dx:], g2[:, :-dx] + dx * dx, out=d2[:, dx:])
+        np.minimum(d2[:, :-dx], g2[:, dx:] + dx * dx, out=d2[:, :-dx])
+    return d2 <= r * r
+
+
+def _components(mask: np.ndarray, *, eight: bool) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Label the connected components of ``mask``, one horizontal run at a time.
+
+    Runs on neighbouring rows are joined with a union-find when they overlap
+    (or touch diagonally, with ``eight``), so the Python loop is over runs,
+    not pixels.  labelComponents() in script.js does the same per pixel.
+
+    Returns:
+        ``(ids, sizes, border)``: each pixel's component (0 outside the mask,
+        else 1..n), each component's pixel count, and whether it touches the
+        image edge.  ``sizes`` and ``border`` are indexed by component.
+    """
+    h, w = mask.shape
+    padded = np.zeros((h, w + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    steps = np.diff(padded, axis=1)
+    run_y, run_x0 = np.nonzero(steps == 1)
+    run_x1 = np.nonzero(steps == -1)[1]
+    row_start = np.searchsorted(run_y, np.arange(h + 1)).tolist()
+    x0s = run_x0.tolist()
+    x1s = run_x1.tolist()
+    gap = 1 if eight else 0
+
+    parent = list(range(len(x0s)))
+
+    def find(a: int) -> int:
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    for y in range(1, h):
+        i, i_end = row_start[y - 1], row_start[y]
+        j, j_end = row_start[y], row_start[y + 1]
+        while i < i_end and j < j_end:
+            if x0s[j] < x1s[i] + gap and x0s[i] < x1s[j] + gap:
+                a, b = find(i), find(j)
+                parent[max(a, b)] = min(a, b)
+            if x1s[i] < x1s[j]:
+                i += 1
+            else:
+                j += 1
+
+    roots = np.array([find(r) for r in range(len(parent))], dtype=np.intp)
+    _, run_ids = np.unique(roots, return_inverse=True)
+    run_ids += 1
+    count = int(run_ids.max()) if run_ids.size else 0
+    sizes = np.bincount(run_ids, weights=run_x1 - run_x0, minlength=count + 1).astype(np.int64)
+    on_edge = (run_y == 0) | (run_y == h - 1) | (run_x0 == 0) | (run_x1 == w)
+    border = np.zeros(count + 1, dtype=bool)
+    border[run_ids[on_edge]] = True
+
+    # Paint ids as +id at each run start and -id one past its end
+    flat = np.zeros(h * w + 1, dtype=np.int64)
+    np.add.at(flat, run_y * w + run_x0, run_ids)
+    np.add.at(flat, run_y * w + run_x1, -run_ids)
+    ids = np.cumsum(flat[:-1]).reshape(h, w)
+    return ids, sizes, border
+
+
+def _decode_keyframe(data_uri: str, shape: tuple[int, int]) -> tuple[np.ndarray, np.ndarray]:
+    """Decode a keyframe PNG into (unknown, fg) layers of the given shape."""
+    b64 = data_uri.split(",", 1)[1] if "," in data_uri else data_uri
+    img = Image.open(BytesIO(base64.b64decode(b64))).convert("L")
+    h, w = shape
+    if img.size != (w, h):
+        img = img.resize((w, h), Image.Resampling.NEAREST)
+    arr = np.asarray(img)
+    return arr > _UNKNOWN_THRESHOLD, arr > _FG_THRESHOLD
+
+
+def _apply_stroke(op: dict[str, Any], unknown: np.ndarray, fg: np.ndarray, sx: float, sy: float) -> None:
+    pts = op["pts"]
+    if len(pts) < 2:  # noqa: PLR2004 — need at least one (x, y) point
+        return
+    if sx != 1 or sy != 1:
+        pts = [v * (sx if i % 2 == 0 else sy) for i, v in enumerate(pts)]
+    mask = _stroke_mask(pts, op["r"] * math.sqrt(sx * sy), unknown.shape)
+    if op.get("tool") == "eraser":
+        # Erasing unknown also erases fg (fg ⊆ unknown); erasing fg leaves unknown
+        fg &= ~mask
+        if op["layer"] == "unknown":
+            unknown &= ~mask
+    else:
+        # Painting fg also paints unknown
+        unknown |= mask
+        if op["layer"] == "foreground":
+            fg |= mask
+
+
+def _apply_fill(op: dict[str, Any], unknown: np.ndarray, fg: np.ndarray, sx: float, sy: float) -> None:
+    h, w = unknown.shape
+    x = math.floor(op["x"] * sx)
+    y = math.floor(op["y"] * sy)
+    if not (0 <= x < w and 0 <= y < h):
+        return
+    active = fg if op["layer"] == "foreground" else unknown
+    if active[y, x]:
+        return
+    region = _flood_region(active, x, y)
+    active |= region
+    if op["layer"] == "foreground":
+        unknown |= region
+
+
+def _apply_morph(op: dict[str, Any], unknown: np.ndarray, fg: np.ndarray, sx: float, sy: float) -> None:
+    r = op["r"] * math.sqrt(sx * sy)
+    active = fg if op["layer"] == "foreground" else unknown
+    if op["op"] == "grow":
+        region = _within(active, r) & ~active
+        active |= region
+        if op["layer"] == "foreground":
+            unknown |= region
+    else:
+        # Pixels outside the image are not background, so edges don't erode
+        region = _within(~active, r) & active
+        fg &= ~region
+        if op["layer"] == "unknown":
+            unknown &= ~region
+
+
+def _apply_cleanup(op: dict[str, Any], unknown: np.ndarray, fg: np.ndarray, sx: float, sy: float) -> None:
+    active = fg if op["layer"] == "foreground" else unknown
+    if op["op"] == "fill_holes":
+        # The complement is 4-connected, so a diagonal wall still encloses
+        ids, _, border = _components(~active, eight=False)
+        border[0] = True
+        region = ~border[ids]
+        active |= region
+        if op["layer"] == "foreground":
+            unknown |= region
+    else:
+        ids, sizes, _ = _components(active, eight=True)
+        region = (ids > 0) & (sizes[ids] < op["size"] * sx * sy)
+        fg &= ~region
+        if op["layer"] == "unknown":
+            unknown &= ~region
+
+
+def rasterize_strokes(
+    strokes: dict[str, Any] | list[dict[str, Any]],
+    width: int,
+    height: int,
+    *,
+    size: tuple[int, int] | None = None,
+) -> np.ndarray:
+    """Replay a stroke log into a trimap.
+
+    Args:
+        strokes: The ``strokes`` object from the component value, or its ``ops`` list.
+        width: Width of the image the log was recorded on.
+        height: Height of the image the log was recorded on.
+        size: Optional ``(width, height)`` to render at a different resolution.
+            Coordinates and radii are scaled; keyframes are resized with
+            nearest-neighbour sampling.
+
+    Returns:
+        A ``(H, W)`` uint8 array with values 0 (background), 128 (unknown)
+        and 255 (foreground).
+    """
+    if isinstance(strokes, dict):
+        version = strokes.get("version", STROKE_LOG_VERSION)
+        if version != STROKE_LOG_VERSION:
+            msg = f"Unsupported stroke log version: {version}"
+            raise ValueError(msg)
+        ops = strokes.get("ops", [])
+    else:
+        ops = strokes
+
+    out_w, out_h = size if size is not None else (width, height)
+    sx = out_w / width
+    sy = out_h / height
+    shape = (out_h, out_w)
+    unknown = np.zeros(shape, dtype=bool)
+    fg = np.zeros(shape, dtype=bool)
+
+    for op in ops:
+        kind = op.get("op")
+        if kind == "stroke":
+            _apply_stroke(op, unknown, fg, sx, sy)
+        elif kind == "fill":
+            _apply_fill(op, unknown, fg, sx, sy)
+        elif kind in {"grow", "shrink"}:
+            _apply_morph(op, unknown, fg, sx, sy)
+        elif kind in {"fill_holes", "remove_islands"}:
+            _apply_cleanup(op, unknown, fg, sx, sy)
+        elif kind == "clear":
+            unknown[:] = False
+            fg[:] = False
+        elif kind == "keyframe":
+            unknown, fg = _decode_keyframe(op["trimap"], shape)
+        else:
+            msg = f"Unknown stroke log op: {kind!r}"
+            raise ValueError(msg)
+
+    trimap = np.zeros(shape, dtype=np.uint8)
+    trimap[unknown] = 128
+    trimap[fg] = 255
+    return trimap
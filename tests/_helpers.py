@@ -7,13 +7,18 @@ and the GradioApp context manager that test files import directly.
 from __future__ import annotations
 
 import re
+from contextlib import contextmanager
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any
 
+import gradio as gr
+import numpy as np
 from playwright.sync_api import Browser, Locator, Page, expect
 
+from trimap_editor import TrimapEditor
+
 if TYPE_CHECKING:
-    import gradio as gr
+    from collections.abc import Callable, Iterator
 
 # ── Constants ──
 
@@ -25,6 +30,20 @@ RE_MAXIMIZED = re.compile(r"\bte-maximized\b")
 RE_VISIBLE = re.compile(r"\bte-visible\b")
 RE_DANGER_CONFIRM = re.compile(r"\bte-btn-danger-confirm\b")
 
+# The trimap (0/128/255, row-major) composed from the editor's mask canvases
+JS_TRIMAP_FROM_CANVASES = """() => {
+    var el = document.querySelector('.trimap-editor');
+    var uc = el._teUnknownCanvas, fc = el._teFgCanvas;
+    var w = uc.width, h = uc.height;
+    var ud = uc.getContext('2d').getImageData(0, 0, w, h).data;
+    var fd = fc.getContext('2d').getImageData(0, 0, w, h).data;
+    var out = [];
+    for (var i = 0; i < w * h; i++) {
+        out.push(fd[i * 4 + 3] > 127 ? 255 : ud[i * 4 + 3] > 127 ? 128 : 0);
+    }
+    return {w: w, h: h, data: out};
+}"""
+
 # ── Locator helpers ──
 
 
@@ -49,16 +68,22 @@ def upload_image(block: Locator, image_path: Path) -> None:
 
 
 def wait_for_server_upload(page: Page) -> None:
-    """Wait for the background server upload to complete (filePath is set)."""
+    """Wait for the background server upload to complete (fileUrl is set)."""
     page.wait_for_function(
         """() => {
             var el = document.querySelector('.trimap-editor');
-            return el && el._teState && el._teState.filePath !== null;
+            return el && el._teState && el._teState.fileUrl;
         }""",
         timeout=8000,
     )
 
 
+def drawn_trimap(page: Page) -> np.ndarray:
+    """Return the trimap the editor shows, read from its mask canvases."""
+    t = page.evaluate(JS_TRIMAP_FROM_CANVASES)
+    return np.array(t["data"], dtype=np.uint8).reshape(t["h"], t["w"])
+
+
 def upload_and_draw(page: Page, block: Locator) -> None:
     """Upload an image, wait for server upload, then draw a stroke that commits."""
     example_img = next(EXAMPLES_DIR.glob("*.jpg"))
@@ -96,3 +121,29 @@ class GradioApp:
         if self.page:
             self.page.close()
         self._demo.close()
+
+
+@contextmanager
+def capture_committed(browser: Browser, **editor_kwargs: Any) -> Iterator[tuple[Page, Callable[[], Any]]]:
+    """Launch a TrimapEditor(**editor_kwargs) with a Read button.
+
+    Yields the page and ``read()``, which clicks Read and returns the value
+    the button's handler received.
+    """
+    captured: list[Any] = []
+    with gr.Blocks() as demo:
+        editor = TrimapEditor(label="Editor", **editor_kwargs)
+        gr.Button("Read").click(fn=captured.append, inputs=editor)
+
+    with GradioApp(demo, browser) as page:
+
+        def read() -> Any:
+            n = len(captured)
+            page.get_by_role("button", name="Read").click()
+            for _ in range(50):
+                if len(captured) > n:
+                    break
+                page.wait_for_timeout(100)
+            return captured[-1]
+
+        yield page, read
@@ -0,0 +1,129 @@
+"""Unit tests for the trimap payload decoders."""
+
+from __future__ import annotations
+
+import base64
+import json
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from trimap_editor import decode_rle, decode_trimap, trimap_hash, trimap_stats
+
+
+def _encode_rle(trimap: np.ndarray) -> str:
+    """Reference encoder mirroring writeRun() in script.js."""
+    classes = np.searchsorted([0, 128, 255], trimap.ravel())
+    out = bytearray()
+    start = 0
+    flat = classes.tolist()
+    for i in range(1, len(flat) + 1):
+        if i == len(flat) or flat[i] != flat[start]:
+            v = (i - start) * 4 + flat[start]
+            while v >= 0x80:
+                out.append((v & 0x7F) | 0x80)
+                v >>= 7
+            out.append(v)
+            start = i
+    return base64.b64encode(bytes(out)).decode()
+
+
+def _sample_trimap() -> np.ndarray:
+    trimap = np.zeros((30, 40), dtype=np.uint8)
+    trimap[5:25, 5:35] = 128
+    trimap[10:20, 10:30] = 255
+    return trimap
+
+
+class TestDecodeRLE:
+    def test_round_trip(self) -> None:
+        trimap = _sample_trimap()
+        decoded = decode_rle(_encode_rle(trimap), 40, 30)
+        assert decoded.dtype == np.uint8
+        np.testing.assert_array_equal(decoded, trimap)
+
+    def test_accepts_raw_bytes(self) -> None:
+        trimap = _sample_trimap()
+        raw = base64.b64decode(_encode_rle(trimap))
+        np.testing.assert_array_equal(decode_rle(raw, 40, 30), trimap)
+
+    def test_long_runs_use_multibyte_varints(self) -> None:
+        trimap = np.full((2000, 3000), 128, dtype=np.uint8)
+        trimap[-1, -1] = 0
+        payload = _encode_rle(trimap)
+        assert len(base64.b64decode(payload)) == 5
+        np.testing.assert_array_equal(decode_rle(payload, 3000, 2000), trimap)
+
+    def test_rejects_wrong_pixel_count(self) -> None:
+        with pytest.raises(ValueError, match="pixels"):
+            decode_rle(_encode_rle(_sample_trimap()), 40, 31)
+
+    def test_rejects_truncated_stream(self) -> None:
+        with pytest.raises(ValueError, match="Truncated"):
+            decode_rle(bytes([0x81]), 1, 1)
+
+    def test_rejects_invalid_class(self) -> None:
+        with pytest.raises(ValueError, match="class"):
+            decode_rle(bytes([1 * 4 + 3]), 1, 1)
+
+
+class TestDecodeTrimap:
+    def test_none_and_empty(self) -> None:
+        assert decode_trimap(None) is None
+        assert decode_trimap("") is None
+        assert decode_trimap(json.dumps({"image": "x.png"})) is None
+
+    def test_rle_value(self) -> None:
+        trimap = _sample_trimap()
+        value = json.dumps({"image": "x.png", "trimapRLE": _encode_rle(trimap), "width": 40, "height": 30})
+        np.testing.assert_array_equal(decode_trimap(value), trimap)
+
+    def test_png_value(self) -> None:
+        trimap = _sample_trimap()
+        buf = BytesIO()
+        Image.fromarray(trimap).save(buf, format="PNG")
+        b64 = "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode()
+        value = {"image": "x.png", "trimapBase64": b64, "width": 40, "height": 30}
+        np.testing.assert_array_equal(decode_trimap(value), trimap)
+
+    def test_strokes_value(self) -> None:
+        ops = [{"op": "stroke", "layer": "foreground", "tool": "brush", "r": 4, "pts": [20, 15]}]
+        value = {"image": "x.png", "strokes": {"version": 1, "ops": ops}, "width": 40, "height": 30}
+        trimap = decode_trimap(value)
+        assert trimap is not None
+        assert trimap[15, 20] == 255
+
+
+class TestTrimapStats:
+    def test_counts_and_bboxes(self) -> None:
+        stats = trimap_stats(_sample_trimap())
+        assert stats["counts"] == {"background": 600, "unknown": 400, "foreground": 200}
+        assert stats["unknownBBox"] == [5, 5, 35, 25]
+        assert stats["foregroundBBox"] == [10, 10, 30, 20]
+        assert stats["hash"] == trimap_hash(_sample_trimap())
+
+    def test_empty_trimap_has_no_bboxes(self) -> None:
+        stats = trimap_stats(np.zeros((4, 6), dtype=np.uint8))
+        assert stats["counts"] == {"background": 24, "unknown": 0, "foreground": 0}
+        assert stats["unknownBBox"] is None
+        assert stats["foregroundBBox"] is None
+
+    def test_hash_is_stable_hex(self) -> None:
+        h = trimap_hash(_sample_trimap())
+        assert len(h) == 8
+        int(h, 16)
+        assert trimap_hash(_sample_trimap()) == h
+
+    def test_hash_depends_on_content_and_shape(self) -> None:
+        trimap = _sample_trimap()
+        changed = trimap.copy()
+        changed[0, 0] = 128
+        assert trimap_hash(changed) != trimap_hash(trimap)
+        flat = np.zeros((2, 6), dtype=np.uint8)
+        assert trimap_hash(flat) != trimap_hash(flat.reshape(3, 4))
+
+    def test_hash_known_value(self) -> None:
+        # Pins the FNV-1a layout shared with createTrimapStats() in script.js
+        assert trimap_hash(np.zeros((1, 1), dtype=np.uint8)) == "741747ae"
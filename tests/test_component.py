@@ -281,3 +281,58 @@ class TestExtraProps:
             default_unknown_color="#00ff00",
         )
         assert ed is not None
+
+    def test_accepts_strokes_value_format(self) -> None:
+        ed = TrimapEditor(value_format="strokes")
+        assert ed.props["value_format"] == "strokes"
+
+    def test_accepts_rle_value_format(self) -> None:
+        ed = TrimapEditor(value_format="rle")
+        assert ed.props["value_format"] == "rle"
+
+    def test_commit_mode_defaults_to_eager(self) -> None:
+        assert TrimapEditor().props["commit_mode"] == "eager"
+        assert TrimapEditor(commit_mode="lazy").props["commit_mode"] == "lazy"
+
+    def test_rejects_unknown_commit_mode(self) -> None:
+        with pytest.raises(ValueError, match="commit_mode"):
+            TrimapEditor(commit_mode="never")  # type: ignore
+
+    def test_autosave_defaults_to_on(self) -> None:
+        assert TrimapEditor().props["autosave"] is True
+        assert TrimapEditor(autosave=False).props["autosave"] is False
+
+    def test_matte_band_defaults(self) -> None:
+        assert TrimapEditor().props["matte_band"] == [16, 240]
+        assert TrimapEditor(matte_band=(0, 255)).props["matte_band"] == [0, 255]
+
+    def test_profile_defaults_to_off(self) -> None:
+        assert TrimapEditor().props["profile"] is False
+        assert TrimapEditor(profile=True).props["profile"] is True
+
+    @pytest.mark.parametrize("band", [(128, 128), (200, 100), (-1, 240), (16, 256)])
+    def test_rejects_invalid_matte_band(self, band: tuple[int, int]) -> None:
+        with pytest.raises(ValueError, match="matte_band"):
+            TrimapEditor(matte_band=band)
+
+    def test_type_defaults_to_str(self) -> None:
+        ed = TrimapEditor()
+        assert ed.preprocess('{"image": "x.png"}') == '{"image": "x.png"}'
+
+    def test_type_dict_parses_payload(self) -> None:
+        ed = TrimapEditor(type="dict")
+        payload = json.dumps({"image": "x.png", "stats": {"hash": "00000000"}})
+        assert ed.preprocess(payload) == {"image": "x.png", "stats": {"hash": "00000000"}}
+        assert ed.preprocess(None) is None
+
+    def test_rejects_unknown_type(self) -> None:
+        with pytest.raises(ValueError, match="type"):
+            TrimapEditor(type="numpy")  # type: ignore
+
+    def test_value_format_defaults_to_png(self) -> None:
+        ed = TrimapEditor()
+        assert ed.props["value_format"] == "png"
+
+    def test_rejects_unknown_value_format(self) -> None:
+        with pytest.raises(ValueError, match="value_format"):
+            TrimapEditor(value_format="jpeg")  # type: ignore
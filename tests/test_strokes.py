@@ -0,0 +1,279 @@
+"""Unit tests for the stroke-log rasterizer."""
+
+from __future__ import annotations
+
+import base64
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from trimap_editor import rasterize_strokes
+
+
+def _stroke(layer: str, tool: str, r: float, *pts: float) -> dict:
+    return {"op": "stroke", "layer": layer, "tool": tool, "r": r, "pts": list(pts)}
+
+
+def _png_data_uri(arr: np.ndarray) -> str:
+    buf = BytesIO()
+    Image.fromarray(arr).save(buf, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode()
+
+
+def _keyframe_ops(keyframe: np.ndarray, *ops: dict) -> list[dict]:
+    return [{"op": "keyframe", "trimap": _png_data_uri(keyframe)}, *ops]
+
+
+class TestStrokes:
+    def test_empty_log_is_background(self) -> None:
+        trimap = rasterize_strokes({"version": 1, "ops": []}, 40, 30)
+        assert trimap.shape == (30, 40)
+        assert trimap.dtype == np.uint8
+        assert not trimap.any()
+
+    def test_accepts_bare_op_list(self) -> None:
+        trimap = rasterize_strokes([_stroke("unknown", "brush", 5, 20, 15)], 40, 30)
+        assert trimap[15, 20] == 128
+
+    def test_unknown_brush_paints_unknown(self) -> None:
+        trimap = rasterize_strokes([_stroke("unknown", "brush", 5, 20, 15)], 40, 30)
+        assert set(np.unique(trimap)) == {0, 128}
+        assert trimap[15, 20] == 128
+        assert trimap[0, 0] == 0
+
+    def test_foreground_brush_paints_fg_inside_unknown(self) -> None:
+        trimap = rasterize_strokes([_stroke("foreground", "brush", 5, 20, 15)], 40, 30)
+        assert trimap[15, 20] == 255
+        assert set(np.unique(trimap)) == {0, 255}
+
+    def test_disk_uses_pixel_centers(self) -> None:
+        trimap = rasterize_strokes([_stroke("unknown", "brush", 3, 10, 10)], 20, 20)
+        ys, xs = np.nonzero(trimap)
+        d2 = (xs + 0.5 - 10) ** 2 + (ys + 0.5 - 10) ** 2
+        assert (d2 <= 9).all()
+        assert len(xs) == 32
+
+    def test_segment_is_gap_free(self) -> None:
+        trimap = rasterize_strokes([_stroke("unknown", "brush", 2, 5, 10, 55, 10)], 60, 20)
+        assert (trimap[10, 5:55] == 128).all()
+
+    def test_unknown_eraser_also_erases_fg(self) -> None:
+        ops = [
+            _stroke("foreground", "brush", 8, 20, 15),
+            _stroke("unknown", "eraser", 3, 20, 15),
+        ]
+        trimap = rasterize_strokes(ops, 40, 30)
+        assert trimap[15, 20] == 0
+        assert trimap[15, 26] == 255
+
+    def test_fg_eraser_leaves_unknown(self) -> None:
+        ops = [
+            _stroke("foreground", "brush", 8, 20, 15),
+            _stroke("foreground", "eraser", 3, 20, 15),
+        ]
+        trimap = rasterize_strokes(ops, 40, 30)
+        assert trimap[15, 20] == 128
+        assert trimap[15, 26] == 255
+
+    def test_fg_is_always_subset_of_unknown(self) -> None:
+        ops = [
+            _stroke("foreground", "brush", 6, 10, 10, 30, 20),
+            _stroke("unknown", "eraser", 4, 20, 15),
+            _stroke("foreground", "eraser", 2, 12, 10),
+            {"op": "fill", "layer": "foreground", "x": 0, "y": 0},
+        ]
+        trimap = rasterize_strokes(ops, 40, 30)
+        assert set(np.unique(trimap)) <= {0, 128, 255}
+
+
+class TestFill:
+    def test_fill_outside_ring_leaves_interior(self) -> None:
+        ops = [
+            _stroke("unknown", "brush", 2, 10, 10, 30, 10, 30, 30, 10, 30, 10, 10),
+            {"op": "fill", "layer": "unknown", "x": 0, "y": 0},
+        ]
+        trimap = rasterize_strokes(ops, 40, 40)
+        assert trimap[0, 0] == 128
+        assert trimap[20, 20] == 0
+
+    def test_fill_inside_ring(self) -> None:
+        ops = [
+            _stroke("unknown", "brush", 2, 10, 10, 30, 10, 30, 30, 10, 30, 10, 10),
+            {"op": "fill", "layer": "unknown", "x": 20, "y": 20},
+        ]
+        trimap = rasterize_strokes(ops, 40, 40)
+        assert trimap[20, 20] == 128
+        assert trimap[0, 0] == 0
+
+    def test_foreground_fill_also_fills_unknown(self) -> None:
+        ops = [{"op": "fill", "layer": "foreground", "x": 3, "y": 3}]
+        trimap = rasterize_strokes(ops, 10, 10)
+        assert (trimap == 255).all()
+
+    def test_fill_on_painted_pixel_is_noop(self) -> None:
+        ops = [
+            _stroke("unknown", "brush", 4, 10, 10),
+            {"op": "fill", "layer": "unknown", "x": 10, "y": 10},
+        ]
+        trimap = rasterize_strokes(ops, 30, 30)
+        assert trimap[0, 0] == 0
+
+    def test_fill_is_four_connected(self) -> None:
+        keyframe = np.zeros((4, 4), dtype=np.uint8)
+        keyframe[[0, 1], [1, 0]] = 128  # diagonal wall around (0, 0)
+        ops = [
+            {"op": "keyframe", "trimap": _png_data_uri(keyframe)},
+            {"op": "fill", "layer": "unknown", "x": 3, "y": 3},
+        ]
+        trimap = rasterize_strokes(ops, 4, 4)
+        assert trimap[0, 0] == 0
+        assert trimap[3, 3] == 128
+
+
+class TestKeyframeAndClear:
+    def test_keyframe_replaces_state(self) -> None:
+        keyframe = np.zeros((10, 12), dtype=np.uint8)
+        keyframe[2:8, 2:10] = 128
+        keyframe[4:6, 4:8] = 255
+        ops = [
+            _stroke("unknown", "brush", 3, 1, 1),
+            {"op": "keyframe", "trimap": _png_data_uri(keyframe)},
+        ]
+        trimap = rasterize_strokes(ops, 12, 10)
+        np.testing.assert_array_equal(trimap, keyframe)
+
+    def test_clear_resets_everything(self) -> None:
+        ops = [_stroke("foreground", "brush", 5, 10, 10), {"op": "clear"}]
+        assert not rasterize_strokes(ops, 20, 20).any()
+
+
+class TestResolution:
+    def test_size_scales_output(self) -> None:
+        ops = [_stroke("foreground", "brush", 4, 10, 10)]
+        trimap = rasterize_strokes(ops, 20, 20, size=(40, 40))
+        assert trimap.shape == (40, 40)
+        assert trimap[20, 20] == 255
+        assert (trimap == 255).sum() > 4 * 40
+
+    def test_deterministic(self) -> None:
+        ops = [
+            _stroke("foreground", "brush", 3.7, 5.125, 6.5, 33.25, 17.875),
+            {"op": "fill", "layer": "unknown", "x": 0, "y": 0},
+            _stroke("unknown", "eraser", 2.2, 10, 3),
+        ]
+        a = rasterize_strokes(ops, 40, 30)
+        b = rasterize_strokes(ops, 40, 30)
+        np.testing.assert_array_equal(a, b)
+
+
+class TestValidation:
+    def test_rejects_unknown_version(self) -> None:
+        with pytest.raises(ValueError, match="version"):
+            rasterize_strokes({"version": 99, "ops": []}, 10, 10)
+
+    def test_rejects_unknown_op(self) -> None:
+        with pytest.raises(ValueError, match="op"):
+            rasterize_strokes([{"op": "smudge"}], 10, 10)
+
+
+class TestMorphology:
+    def test_grow_is_a_pixel_center_disk(self) -> None:
+        keyframe = np.zeros((11, 11), dtype=np.uint8)
+        keyframe[5, 5] = 255
+        trimap = rasterize_strokes(_keyframe_ops(keyframe, {"op": "grow", "layer": "foreground", "r": 3}), 11, 11)
+        ys, xs = np.nonzero(trimap == 255)
+        assert ((xs - 5) ** 2 + (ys - 5) ** 2 <= 9).all()
+        assert len(xs) == 29
+        assert set(np.unique(trimap)) == {0, 255}
+
+    def test_grow_matches_brute_force(self) -> None:
+        rng = np.random.default_rng(0)
+        keyframe = np.where(rng.random((40, 50)) < 0.01, 128, 0).astype(np.uint8)
+        trimap = rasterize_strokes(_keyframe_ops(keyframe, {"op": "grow", "layer": "unknown", "r": 4.5}), 50, 40)
+        sy, sx = np.nonzero(keyframe)
+        yy, xx = np.mgrid[:40, :50]
+        d2 = ((yy[..., None] - sy) ** 2 + (xx[..., None] - sx) ** 2).min(axis=-1)
+        np.testing.assert_array_equal(trimap == 128, d2 <= 4.5**2)
+
+    def test_unknown_band_around_foreground(self) -> None:
+        keyframe = np.zeros((30, 30), dtype=np.uint8)
+        keyframe[10:20, 10:20] = 255
+        ops = _keyframe_ops(
+            keyframe,
+            {"op": "grow", "layer": "unknown", "r": 2},
+            {"op": "shrink", "layer": "foreground", "r": 2},
+        )
+        trimap = rasterize_strokes(ops, 30, 30)
+        assert (trimap[12:18, 12:18] == 255).all()
+        assert trimap[10, 15] == 128
+        assert trimap[8, 15] == 128
+        assert trimap[7, 15] == 0
+
+    def test_shrinking_unknown_also_shrinks_fg(self) -> None:
+        keyframe = np.zeros((30, 30), dtype=np.uint8)
+        keyframe[5:25, 5:25] = 255
+        trimap = rasterize_strokes(_keyframe_ops(keyframe, {"op": "shrink", "layer": "unknown", "r": 3}), 30, 30)
+        assert trimap[6, 15] == 0
+        assert trimap[15, 15] == 255
+        assert set(np.unique(trimap)) == {0, 255}
+
+    def test_image_border_does_not_erode(self) -> None:
+        keyframe = np.full((10, 10), 255, dtype=np.uint8)
+        trimap = rasterize_strokes(_keyframe_ops(keyframe, {"op": "shrink", "layer": "foreground", "r": 3}), 10, 10)
+        assert (trimap == 255).all()
+
+
+class TestCleanup:
+    def test_fill_holes_fills_enclosed_pockets_only(self) -> None:
+        keyframe = np.zeros((20, 30), dtype=np.uint8)
+        keyframe[2:12, 2:12] = 255
+        keyframe[4:6, 4:6] = 0
+        keyframe[7:9, 7:9] = 128
+        keyframe[0:5, 20:25] = 255
+        keyframe[0:2, 22] = 0  # notch open to the image edge
+        trimap = rasterize_strokes(_keyframe_ops(keyframe, {"op": "fill_holes", "layer": "foreground"}), 30, 20)
+        expected = keyframe.copy()
+        expected[4:6, 4:6] = 255
+        expected[7:9, 7:9] = 255
+        np.testing.assert_array_equal(trimap, expected)
+
+    def test_diagonal_wall_encloses_a_hole(self) -> None:
+        keyframe = np.zeros((5, 5), dtype=np.uint8)
+        keyframe[[1, 2, 2, 3], [2, 1, 3, 2]] = 128  # diamond around (2, 2)
+        trimap = rasterize_strokes(_keyframe_ops(keyframe, {"op": "fill_holes", "layer": "unknown"}), 5, 5)
+        assert trimap[2, 2] == 128
+        assert trimap[0, 0] == 0
+
+    def test_remove_islands_by_size(self) -> None:
+        keyframe = np.zeros((30, 30), dtype=np.uint8)
+        keyframe[2:4, 2:4] = 255  # 4 px
+        keyframe[10, 10] = 255
+        keyframe[11, 11] = 255  # 2 px, diagonally connected
+        keyframe[20:25, 20:25] = 255  # 25 px
+        ops = _keyframe_ops(keyframe, {"op": "remove_islands", "layer": "foreground", "size": 5})
+        trimap = rasterize_strokes(ops, 30, 30)
+        assert (trimap[2:4, 2:4] == 128).all()
+        assert trimap[10, 10] == 128
+        assert trimap[11, 11] == 128
+        assert (trimap[20:25, 20:25] == 255).all()
+
+    def test_removing_unknown_islands_takes_fg_along(self) -> None:
+        keyframe = np.zeros((20, 20), dtype=np.uint8)
+        keyframe[5:8, 5:8] = 128
+        keyframe[6, 6] = 255
+        ops = _keyframe_ops(keyframe, {"op": "remove_islands", "layer": "unknown", "size": 10})
+        assert not rasterize_strokes(ops, 20, 20).any()
+
+    def test_components_match_flood_fill(self) -> None:
+        rng = np.random.default_rng(1)
+        keyframe = np.where(rng.random((40, 50)) < 0.45, 128, 0).astype(np.uint8)
+        trimap = rasterize_strokes(_keyframe_ops(keyframe, {"op": "fill_holes", "layer": "unknown"}), 50, 40)
+        # Reference: background reachable from the edge stays, the rest fills
+        ops = [{"op": "keyframe", "trimap": _png_data_uri(keyframe)}]
+        ops += [{"op": "fill", "layer": "unknown", "x": x, "y": y} for y in (0, 39) for x in range(50)]
+        ops += [{"op": "fill", "layer": "unknown", "x": x, "y": y} for x in (0, 49) for y in range(40)]
+        reached = rasterize_strokes(ops, 50, 40) == 128
+        expected = np.where((keyframe == 0) & reached, 0, 128)
+        np.testing.assert_array_equal(trimap, expected)
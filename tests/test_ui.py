@@ -2,9 +2,12 @@
 
 from __future__ import annotations
 
+import json
 import re
+from typing import TYPE_CHECKING
 
 import gradio as gr
+import numpy as np
 from _helpers import (
     EXAMPLES_DIR,
     RE_ACTIVE,
@@ -13,14 +16,20 @@ from _helpers import (
     RE_VIS_OFF,
     RE_VISIBLE,
     GradioApp,
+    capture_committed,
+    drawn_trimap,
     get_editor_block,
     get_editor_element,
     upload_image,
     wait_for_server_upload,
 )
-from playwright.sync_api import Browser, Page, expect
+from PIL import Image
+from playwright.sync_api import Browser, Locator, Page, expect
 
-from trimap_editor import TrimapEditor
+from trimap_editor import TrimapEditor, decode_trimap, rasterize_strokes, trimap_stats
+
+if TYPE_CHECKING:
+    from pathlib import Path
 
 
 class TestImageUpload:
@@ -116,6 +125,34 @@ class TestBucketTool:
         demo_app.keyboard.press("g")
         expect(canvas).to_have_css("cursor", "crosshair")
 
+    def test_fill_outside_ring_leaves_interior_and_undoes(self, demo_app: Page):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        wait_for_server_upload(demo_app)
+
+        box = block.locator(".te-canvas").bounding_box()
+        cx = box["x"] + box["width"] / 2
+        cy = box["y"] + box["height"] / 2
+        block.focus()
+        demo_app.keyboard.press("u")
+        demo_app.mouse.move(cx - 80, cy - 80)
+        demo_app.mouse.down()
+        for tx, ty in [(80, -80), (80, 80), (-80, 80), (-80, -80)]:
+            demo_app.mouse.move(cx + tx, cy + ty, steps=10)
+        demo_app.mouse.up()
+        demo_app.keyboard.press("g")
+        demo_app.mouse.click(cx + 150, cy + 150)
+        demo_app.wait_for_function("() => !document.querySelector('.trimap-editor')._teState.fillJob")
+
+        filled = drawn_trimap(demo_app)
+        h, w = filled.shape
+        assert filled[0, 0] == 128
+        assert filled[h - 1, w - 1] == 128
+        assert filled[h // 2, w // 2] == 0
+
+        demo_app.keyboard.press("Control+z")
+        assert drawn_trimap(demo_app)[0, 0] == 0
+
     def test_cursor_default_outside_image(self, demo_app: Page):
         """Cursor should be default when hovering dark area outside image."""
         block = get_editor_block(demo_app)
@@ -422,6 +459,32 @@ class TestTrimapView:
         trimap_btn.click()
         expect(trimap_btn).not_to_have_class(RE_ACTIVE)
 
+    def test_trimap_view_tracks_strokes_and_undo(self, demo_app: Page):
+        """Incremental trimap view updates stay identical to the masks."""
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        block.locator("#te-view-trimap-btn").click()
+
+        js_view = """() => {
+            var c = document.querySelector('.trimap-editor')._teTrimapViewCanvas;
+            var d = c.getContext('2d').getImageData(0, 0, c.width, c.height).data;
+            var out = [];
+            for (var i = 0; i < d.length; i += 4) out.push(d[i]);
+            return out;
+        }"""
+
+        def assert_view_matches() -> None:
+            demo_app.wait_for_timeout(100)
+            assert demo_app.evaluate(js_view) == drawn_trimap(demo_app).ravel().tolist()
+
+        _draw_strokes(demo_app, block, 2)
+        block.locator("[data-layer='unknown']").first.click()
+        _draw_strokes(demo_app, block, 3)
+        assert_view_matches()
+        block.focus()
+        demo_app.keyboard.press("Control+z")
+        assert_view_matches()
+
 
 class TestGrExamples:
     def test_examples_gallery_shows_thumbnails(self, demo_app: Page):
@@ -684,11 +747,11 @@ class TestTrimapLoading:
         block = get_editor_block(demo_app)
         expect(block.locator(".te-canvas-wrapper.te-has-image")).to_be_visible(timeout=8000)
 
-        # Wait for trimap to be fully loaded
+        # Wait for trimap to be fully loaded (decoded off the main thread)
         demo_app.wait_for_function(
             """() => {
                 var el = document.querySelector('.trimap-editor');
-                return el && el._teState && el._teState.image;
+                return el && el._teState && el._teState.image && el._teLabels.some((v) => v > 0);
             }""",
             timeout=8000,
         )
@@ -714,11 +777,11 @@ class TestTrimapLoading:
         block = get_editor_block(demo_app)
         expect(block.locator(".te-canvas-wrapper.te-has-image")).to_be_visible(timeout=8000)
 
-        # Wait for trimap to be fully loaded
+        # Wait for trimap to be fully loaded (decoded off the main thread)
         demo_app.wait_for_function(
             """() => {
                 var el = document.querySelector('.trimap-editor');
-                return el && el._teState && el._teState.image;
+                return el && el._teState && el._teState.image && el._teLabels.some((v) => v > 0);
             }""",
             timeout=8000,
         )
@@ -878,6 +941,30 @@ class TestCutoutPreview:
         expect(trimap_btn).to_have_class(RE_ACTIVE)
         expect(cutout_btn).not_to_have_class(RE_ACTIVE)
 
+    def test_cutout_tracks_strokes_and_invert(self, demo_app: Page):
+        """The cached cutout is recomposed where strokes land and on invert."""
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        _draw_strokes(demo_app, block, 1)
+        block.locator("#te-view-cutout-btn").click()
+        _draw_strokes(demo_app, block, 3)
+
+        js_alpha = """(name) => {
+            var c = document.querySelector('.trimap-editor')[name];
+            var d = c.getContext('2d').getImageData(0, 0, c.width, c.height).data;
+            var out = [];
+            for (var i = 3; i < d.length; i += 4) out.push(d[i] > 127 ? 1 : 0);
+            return out;
+        }"""
+        demo_app.wait_for_timeout(100)
+        fg = demo_app.evaluate(js_alpha, "_teFgCanvas")
+        assert any(fg)
+        assert demo_app.evaluate(js_alpha, "_teCutoutCanvas") == fg
+
+        block.locator("#te-cutout-invert-btn").click()
+        demo_app.wait_for_timeout(100)
+        assert demo_app.evaluate(js_alpha, "_teCutoutCanvas") == [1 - v for v in fg]
+
     def test_invert_button_disabled_when_cutout_off(self, demo_app: Page):
         """Invert button should be disabled when cutout mode is off."""
         block = get_editor_block(demo_app)
@@ -1448,6 +1535,25 @@ class TestColorPalette:
             f"Swatch background should change after selecting a new color: before={initial_bg}, after={new_bg}"
         )
 
+    def test_palette_recolours_drawn_mask(self, demo_app: Page):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        _draw_strokes(demo_app, block, 1)
+
+        block.locator("#te-fg-color").click()
+        block.locator(".te-palette-item[data-color='#f44336']").click()
+
+        colors = demo_app.evaluate("""() => {
+            var c = document.querySelector('.trimap-editor')._teFgCanvas;
+            var d = c.getContext('2d').getImageData(0, 0, c.width, c.height).data;
+            var seen = {};
+            for (var i = 0; i < d.length; i += 4) {
+                if (d[i + 3]) seen[[d[i], d[i + 1], d[i + 2], d[i + 3]].join(',')] = true;
+            }
+            return Object.keys(seen);
+        }""")
+        assert colors == ["244,67,54,255"]
+
 
 # ---------------------------------------------------------------------------
 # Bracket key brush-size tests
@@ -1533,6 +1639,33 @@ class TestClearConfirmation:
         expect(clear_btn).not_to_have_class(RE_DANGER_CONFIRM)
         expect(clear_btn).to_have_text("Clear")
 
+    def test_confirmed_clear_adds_one_history_entry(self, demo_app: Page):
+        js_history = (
+            "() => { var s = document.querySelector('.trimap-editor')._teState;"
+            " return [s.historyIndex, s.history.length]; }"
+        )
+        block = get_editor_block(demo_app)
+        example_img = next(EXAMPLES_DIR.glob("*.jpg"))
+        upload_image(block, example_img)
+
+        canvas = block.locator(".te-canvas")
+        box = canvas.bounding_box()
+        demo_app.mouse.move(box["x"] + 60, box["y"] + 60)
+        demo_app.mouse.down()
+        demo_app.mouse.move(box["x"] + 120, box["y"] + 60, steps=5)
+        demo_app.mouse.up()
+        index, length = demo_app.evaluate(js_history)
+
+        clear_btn = block.locator("#te-clear-btn")
+        clear_btn.click()
+        clear_btn.click()
+
+        assert demo_app.evaluate(js_history) == [index + 1, length + 1]
+        # One undo restores the stroke rather than an empty duplicate
+        block.focus()
+        demo_app.keyboard.press("Control+z")
+        assert demo_app.evaluate(js_history)[0] == index
+
 
 # ---------------------------------------------------------------------------
 # Trimap view key test
@@ -1692,3 +1825,1123 @@ class TestExtraProps:
             un_bg = page.locator("#te-unknown-color").first.evaluate("el => getComputedStyle(el).backgroundColor")
             assert fg_bg == "rgb(0, 200, 83)"  # #00c853
             assert un_bg == "rgb(33, 150, 243)"  # #2196F3
+
+
+# ---------------------------------------------------------------------------
+# value_format="strokes": the committed op log replays to the drawn trimap
+# ---------------------------------------------------------------------------
+
+
+def _draw_strokes(page: Page, block: Locator, n: int) -> None:
+    """Draw n horizontal strokes across the middle of the image."""
+    box = block.locator(".te-canvas").bounding_box()
+    cx = box["x"] + box["width"] / 2
+    cy = box["y"] + box["height"] / 2
+    for i in range(n):
+        y = cy - 60 + i * 30
+        page.mouse.move(cx - 60, y)
+        page.mouse.down()
+        page.mouse.move(cx + 60, y, steps=4)
+        page.mouse.up()
+
+
+def _draw_ring_and_dot(page: Page, block: Locator) -> None:
+    """Draw a closed square ring around the image centre and a dot off to its side."""
+    box = block.locator(".te-canvas").bounding_box()
+    cx = box["x"] + box["width"] / 2
+    cy = box["y"] + box["height"] / 2
+    page.mouse.move(cx - 60, cy - 60)
+    page.mouse.down()
+    for x, y in ((cx + 60, cy - 60), (cx + 60, cy + 60), (cx - 60, cy + 60), (cx - 60, cy - 60)):
+        page.mouse.move(x, y, steps=6)
+    page.mouse.up()
+    page.mouse.click(cx + 120, cy)
+
+
+class TestStrokeLogFormat:
+    def test_committed_log_replays_to_drawn_trimap(self, browser: Browser):
+        with capture_committed(browser, value_format="strokes") as (page, read):
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+
+            canvas = block.locator(".te-canvas")
+            box = canvas.bounding_box()
+            cx = box["x"] + box["width"] / 2
+            cy = box["y"] + box["height"] / 2
+
+            # Foreground stroke, unknown ring, unknown eraser, then fill the ring
+            page.mouse.move(cx - 60, cy - 20)
+            page.mouse.down()
+            page.mouse.move(cx + 60, cy + 20, steps=12)
+            page.mouse.up()
+            block.focus()
+            page.keyboard.press("u")
+            page.mouse.move(cx - 100, cy - 100)
+            page.mouse.down()
+            for tx, ty in [(100, -100), (100, 100), (-100, 100), (-100, -100)]:
+                page.mouse.move(cx + tx, cy + ty, steps=10)
+            page.mouse.up()
+            page.keyboard.press("e")
+            page.mouse.move(cx - 20, cy + 60)
+            page.mouse.down()
+            page.mouse.move(cx + 20, cy + 60, steps=4)
+            page.mouse.up()
+            page.keyboard.press("g")
+            page.mouse.click(cx + 40, cy - 50)
+            page.wait_for_timeout(300)
+
+            value = json.loads(read())
+            drawn = drawn_trimap(page)
+
+        assert "trimapBase64" not in value
+        assert value["strokes"]["version"] == 1
+        kinds = {op["op"] for op in value["strokes"]["ops"]}
+        assert {"stroke", "fill"} <= kinds
+
+        replayed = rasterize_strokes(value["strokes"], value["width"], value["height"])
+        # Brush stamps are hard-edged pixel-center disks in both, so exact
+        np.testing.assert_array_equal(replayed, drawn)
+        assert (replayed == 255).sum() > 0
+        assert (replayed == 128).sum() > 0
+
+    def test_grow_and_shrink_replay_to_drawn_trimap(self, browser: Browser):
+        with capture_committed(browser, value_format="strokes") as (page, read):
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+            _draw_strokes(page, block, 2)
+
+            # Unknown band around the foreground: grow unknown, shrink fg
+            block.focus()
+            page.keyboard.press("u")
+            page.keyboard.press(".")
+            page.keyboard.press("f")
+            page.keyboard.press(",")
+            page.wait_for_timeout(300)
+
+            value = json.loads(read())
+            drawn = drawn_trimap(page)
+
+        kinds = [op["op"] for op in value["strokes"]["ops"]]
+        assert kinds[-2:] == ["grow", "shrink"]
+        replayed = rasterize_strokes(value["strokes"], value["width"], value["height"])
+        np.testing.assert_array_equal(replayed, drawn)
+        assert (replayed == 255).sum() > 0
+        assert (replayed == 128).sum() > 0
+
+    def test_cleanup_replays_to_drawn_trimap(self, browser: Browser):
+        with capture_committed(browser, value_format="strokes") as (page, read):
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+            _draw_ring_and_dot(page, block)
+
+            block.focus()
+            page.keyboard.press("h")
+            page.keyboard.press("u")
+            page.keyboard.press(".")
+            page.keyboard.press("f")
+            page.keyboard.press("k")
+            page.wait_for_timeout(300)
+
+            value = json.loads(read())
+            drawn = drawn_trimap(page)
+
+        kinds = [op["op"] for op in value["strokes"]["ops"]]
+        assert kinds[-3:] == ["fill_holes", "grow", "remove_islands"]
+        replayed = rasterize_strokes(value["strokes"], value["width"], value["height"])
+        np.testing.assert_array_equal(replayed, drawn)
+
+
+class TestMorphology:
+    JS_COUNTS = """() => {
+        var counts = [0, 0, 0];
+        document.querySelector('.trimap-editor')._teLabels.forEach((v) => counts[v]++);
+        return counts;
+    }"""
+
+    def test_grow_and_shrink_buttons(self, demo_app: Page):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        _draw_strokes(demo_app, block, 1)
+        demo_app.wait_for_timeout(100)
+        before = demo_app.evaluate(self.JS_COUNTS)
+
+        block.locator("#te-grow-btn").click()
+        grown = demo_app.evaluate(self.JS_COUNTS)
+        assert grown[2] > before[2]
+        assert grown[1] == 0
+
+        block.locator("#te-shrink-btn").click()
+        block.locator("#te-shrink-btn").click()
+        assert demo_app.evaluate(self.JS_COUNTS)[2] < before[2]
+
+    def test_grow_is_one_undo_step(self, demo_app: Page):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        _draw_strokes(demo_app, block, 1)
+        demo_app.wait_for_timeout(100)
+        before = demo_app.evaluate(self.JS_COUNTS)
+
+        block.focus()
+        demo_app.keyboard.press("u")
+        demo_app.keyboard.press(".")
+        grown = demo_app.evaluate(self.JS_COUNTS)
+        assert grown[1] > 0
+        assert grown[2] == before[2]
+
+        demo_app.keyboard.press("Control+z")
+        assert demo_app.evaluate(self.JS_COUNTS) == before
+
+
+class TestCleanup:
+    JS_CENTER_LABEL = """() => {
+        var el = document.querySelector('.trimap-editor');
+        var w = el._teState.image.width;
+        var h = el._teState.image.height;
+        return el._teLabels[(h >> 1) * w + (w >> 1)];
+    }"""
+
+    JS_SET_ISLAND_SIZE = """(n) => {
+        var slider = document.querySelector('.trimap-editor #te-island-size');
+        slider.value = n;
+        slider.dispatchEvent(new Event('input'));
+    }"""
+
+    def test_fill_holes_is_one_undo_step(self, demo_app: Page):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        _draw_ring_and_dot(demo_app, block)
+        demo_app.wait_for_timeout(100)
+        before = demo_app.evaluate(TestMorphology.JS_COUNTS)
+        assert demo_app.evaluate(self.JS_CENTER_LABEL) == 0
+
+        block.locator("#te-holes-btn").click()
+        assert demo_app.evaluate(self.JS_CENTER_LABEL) == 2
+        filled = demo_app.evaluate(TestMorphology.JS_COUNTS)
+        assert filled[0] > 0
+
+        block.focus()
+        demo_app.keyboard.press("Control+z")
+        assert demo_app.evaluate(TestMorphology.JS_COUNTS) == before
+
+    def test_remove_islands_keeps_large_components(self, demo_app: Page):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        _draw_ring_and_dot(demo_app, block)
+        demo_app.wait_for_timeout(100)
+        before = demo_app.evaluate(TestMorphology.JS_COUNTS)
+
+        demo_app.evaluate(self.JS_SET_ISLAND_SIZE, 1000)
+        assert block.locator("#te-island-size-val").text_content() == "1000"
+        block.locator("#te-islands-btn").click()
+        after = demo_app.evaluate(TestMorphology.JS_COUNTS)
+        # The dot drops to unknown; the ring is far larger and stays
+        assert after[1] > 0
+        assert after[2] == before[2] - after[1]
+        assert after[2] > 1000
+
+
+class TestMagicWand:
+    JS_LABEL_IMAGE_POINT = """([x, y]) => {
+        var el = document.querySelector('.trimap-editor');
+        return el._teLabels[y * el._teState.image.width + x];
+    }"""
+
+    def _click_background(self, page: Page, block: Locator) -> None:
+        box = block.locator(".te-canvas").bounding_box()
+        block.focus()
+        page.keyboard.press("w")
+        # Just inside the image's top-left corner (400x400, fitted and centred)
+        side = min(box["width"], box["height"])
+        page.mouse.click(box["x"] + (box["width"] - side) / 2 + 5, box["y"] + (box["height"] - side) / 2 + 5)
+        page.wait_for_function("() => !document.querySelector('.trimap-editor')._teState.fillJob")
+
+    def test_wand_fills_similar_colour_only(self, demo_app: Page):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        self._click_background(demo_app, block)
+        assert demo_app.evaluate(self.JS_LABEL_IMAGE_POINT, [5, 5]) == 2
+        assert demo_app.evaluate(self.JS_LABEL_IMAGE_POINT, [395, 395]) == 2
+        assert demo_app.evaluate(self.JS_LABEL_IMAGE_POINT, [200, 200]) == 0
+
+        demo_app.keyboard.press("Control+z")
+        assert demo_app.evaluate(self.JS_LABEL_IMAGE_POINT, [5, 5]) == 0
+
+    def test_wand_is_logged_as_keyframe(self, browser: Browser):
+        with capture_committed(browser, value_format="strokes") as (page, read):
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+            self._click_background(page, block)
+            value = json.loads(read())
+            drawn = drawn_trimap(page)
+
+        assert value["strokes"]["ops"][-1]["op"] == "keyframe"
+        replayed = rasterize_strokes(value["strokes"], value["width"], value["height"])
+        np.testing.assert_array_equal(replayed, drawn)
+
+    def test_log_starts_at_latest_keyframe(self, browser: Browser):
+        with capture_committed(browser, value_format="strokes") as (page, read):
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+            _draw_strokes(page, block, 1)
+            self._click_background(page, block)
+            self._click_background(page, block)
+            page.keyboard.press("b")
+            _draw_strokes(page, block, 1)
+            value = json.loads(read())
+            drawn = drawn_trimap(page)
+
+        assert [op["op"] for op in value["strokes"]["ops"]] == ["keyframe", "stroke"]
+        replayed = rasterize_strokes(value["strokes"], value["width"], value["height"])
+        np.testing.assert_array_equal(replayed, drawn)
+
+
+class TestEdgeBrush:
+    JS_LABELS_ON_ROW = """([y]) => {
+        var el = document.querySelector('.trimap-editor');
+        var w = el._teState.image.width;
+        return Array.from(el._teLabels.subarray(y * w, (y + 1) * w));
+    }"""
+
+    def test_marks_unknown_only_along_edges(self, demo_app: Page):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        block.focus()
+        demo_app.keyboard.press("s")
+        demo_app.wait_for_function(
+            "() => document.querySelector('.trimap-editor .te-canvas').style.cursor !== 'progress'"
+        )
+
+        # Stroke across the whole circle (x 80..320 on row 200 of 400)
+        box = block.locator(".te-canvas").bounding_box()
+        side = min(box["width"], box["height"])
+        scale = side / 400
+        left = box["x"] + (box["width"] - side) / 2
+        top = box["y"] + (box["height"] - side) / 2
+        demo_app.mouse.move(left + 40 * scale, top + 200 * scale)
+        demo_app.mouse.down()
+        demo_app.mouse.move(left + 360 * scale, top + 200 * scale, steps=20)
+        demo_app.mouse.up()
+        demo_app.wait_for_timeout(100)
+
+        row = demo_app.evaluate(self.JS_LABELS_ON_ROW, [200])
+        assert max(row) == 1
+        marked = [x for x, v in enumerate(row) if v]
+        assert all(abs(x - 80) <= 6 or abs(x - 320) <= 6 for x in marked)
+        assert any(abs(x - 80) <= 2 for x in marked)
+        assert any(abs(x - 320) <= 2 for x in marked)
+
+
+class TestRLEFormat:
+    def test_committed_rle_decodes_to_drawn_trimap(self, browser: Browser):
+        with capture_committed(browser, value_format="rle") as (page, read):
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+
+            canvas = block.locator(".te-canvas")
+            box = canvas.bounding_box()
+            cx = box["x"] + box["width"] / 2
+            cy = box["y"] + box["height"] / 2
+
+            page.mouse.move(cx - 60, cy - 20)
+            page.mouse.down()
+            page.mouse.move(cx + 60, cy + 20, steps=12)
+            page.mouse.up()
+            block.focus()
+            page.keyboard.press("u")
+            page.mouse.move(cx - 80, cy + 60)
+            page.mouse.down()
+            page.mouse.move(cx + 80, cy + 60, steps=12)
+            page.mouse.up()
+            page.wait_for_timeout(300)
+
+            value = json.loads(read())
+            drawn = drawn_trimap(page)
+
+        assert "trimapBase64" not in value
+        assert "trimapRLE" in value
+        decoded = decode_trimap(value)
+        np.testing.assert_array_equal(decoded, drawn)
+        assert (decoded == 255).sum() > 0
+        assert (decoded == 128).sum() > 0
+
+
+class TestCommittedStats:
+    def test_stats_match_committed_trimap(self, browser: Browser):
+        with capture_committed(browser, type="dict") as (page, read):
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+
+            canvas = block.locator(".te-canvas")
+            box = canvas.bounding_box()
+            cx = box["x"] + box["width"] / 2
+            cy = box["y"] + box["height"] / 2
+
+            page.mouse.move(cx - 40, cy - 10)
+            page.mouse.down()
+            page.mouse.move(cx + 40, cy + 10, steps=8)
+            page.mouse.up()
+            block.focus()
+            page.keyboard.press("u")
+            page.mouse.move(cx - 80, cy + 60)
+            page.mouse.down()
+            page.mouse.move(cx + 80, cy + 60, steps=12)
+            page.mouse.up()
+            page.wait_for_timeout(500)
+
+            value = read()
+
+        assert isinstance(value, dict)
+        stats = value["stats"]
+        assert stats == trimap_stats(decode_trimap(value))
+        assert stats["counts"]["foreground"] > 0
+        assert stats["unknownBBox"] is not None
+
+
+class TestCommitScheduler:
+    def test_rapid_undo_redo_commits_latest_value(self, browser: Browser):
+        with capture_committed(browser, type="dict") as (page, read):
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+            _draw_strokes(page, block, 4)
+
+            block.focus()
+            for _ in range(6):
+                page.keyboard.press("Control+z")
+            page.keyboard.press("Control+Shift+z")
+            # Read immediately: the pointerdown on the button must flush
+            # the coalesced commit synchronously.
+            value = read()
+            drawn = drawn_trimap(page)
+
+            page.wait_for_timeout(500)
+            versions = page.evaluate(
+                "() => { var s = document.querySelector('.trimap-editor')._teState;"
+                " return [s.commitVersion, s.committedVersion]; }"
+            )
+
+        np.testing.assert_array_equal(decode_trimap(value), drawn)
+        assert (drawn > 0).any()
+        assert versions[0] == versions[1]
+
+    def test_remove_drops_in_flight_commit(self, browser: Browser):
+        # Hold trimap encodes back so the commit is still in flight when
+        # the image is removed.
+        js_delay_encodes = """() => {
+            var post = Worker.prototype.postMessage;
+            window._teDelayedEncodes = 0;
+            Worker.prototype.postMessage = function (msg, transfer) {
+                var worker = this;
+                if (msg && msg.pixels && msg.labels) {
+                    window._teDelayedEncodes++;
+                    setTimeout(function () { post.call(worker, msg, transfer); }, 1000);
+                    return;
+                }
+                return post.call(worker, msg, transfer);
+            };
+        }"""
+        with capture_committed(browser) as (page, read):
+            page.evaluate(js_delay_encodes)
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+            _draw_strokes(page, block, 2)
+            page.wait_for_function("() => window._teDelayedEncodes > 0")
+
+            block.locator("#te-remove-btn").click()
+            page.wait_for_timeout(1500)
+
+            value = read()
+            current = page.evaluate("() => document.querySelector('.trimap-editor')._teState.fileUrl")
+
+        assert value in (None, "")
+        assert current is None
+
+
+class TestLazyCommitMode:
+    def test_value_published_only_on_external_interaction(self, browser: Browser):
+        js_versions = (
+            "() => { var s = document.querySelector('.trimap-editor')._teState;"
+            " return [s.commitVersion, s.committedVersion, !!s.stagedValue]; }"
+        )
+        with capture_committed(browser, type="dict", commit_mode="lazy") as (page, read):
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+            _draw_strokes(page, block, 2)
+            page.wait_for_timeout(600)
+
+            # Encoded in idle time but held back from props.value
+            version, committed, staged = page.evaluate(js_versions)
+            assert version > committed
+            assert staged
+
+            value = read()
+            drawn = drawn_trimap(page)
+            version, committed, staged = page.evaluate(js_versions)
+
+        assert version == committed
+        assert not staged
+        np.testing.assert_array_equal(decode_trimap(value), drawn)
+        assert (drawn > 0).any()
+
+    def test_remove_discards_staged_value(self, browser: Browser):
+        with capture_committed(browser, commit_mode="lazy") as (page, read):
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+            _draw_strokes(page, block, 2)
+            page.wait_for_function("() => !!document.querySelector('.trimap-editor')._teState.stagedValue")
+
+            block.locator("#te-remove-btn").click()
+            staged = page.evaluate("() => document.querySelector('.trimap-editor')._teState.stagedValue")
+            value = read()
+
+        assert staged is None
+        assert value in (None, "")
+
+
+class TestProfiling:
+    def test_committed_value_carries_profile_summary(self, browser: Browser):
+        with capture_committed(browser, type="dict", profile=True) as (page, read):
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+            _draw_strokes(page, block, 2)
+            page.wait_for_timeout(600)
+
+            value = read()
+
+        profile = value["profile"]
+        for name in ("render", "stamp", "snapshot", "commit"):
+            timing = profile["timings"][name]
+            assert timing["count"] > 0
+            assert 0 <= timing["meanMs"] <= timing["maxMs"]
+        assert profile["memory"]["historyBytes"] > 0
+        assert profile["memory"]["canvasBytes"] > 0
+
+
+class TestDeltaHistory:
+    def test_undo_redo_round_trip_with_tile_deltas(self, browser: Browser):
+        with gr.Blocks() as demo:
+            TrimapEditor(label="Editor")
+
+        js_history = """() => {
+            var s = document.querySelector('.trimap-editor')._teState;
+            return s.history.map(function (e) { return [e.tiles.length, e.bytes]; });
+        }"""
+
+        with GradioApp(demo, browser) as page:
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+            _draw_strokes(page, block, 3)
+            page.wait_for_timeout(400)
+            drawn = drawn_trimap(page)
+            history = page.evaluate(js_history)
+
+            block.focus()
+            for _ in range(3):
+                page.keyboard.press("Control+z")
+            page.wait_for_timeout(100)
+            undone = drawn_trimap(page)
+            for _ in range(3):
+                page.keyboard.press("Control+Shift+z")
+            page.wait_for_timeout(100)
+            redone = drawn_trimap(page)
+
+        # Base entry carries no delta; each stroke stores only its tiles, compressed
+        assert history[0] == [0, 0]
+        assert len(history) == 4
+        for tiles, nbytes in history[1:]:
+            assert 1 <= tiles <= 4
+            assert 0 < nbytes < drawn.size // 20
+        assert not undone.any()
+        np.testing.assert_array_equal(redone, drawn)
+
+
+class TestAutosave:
+    JS_CHECKPOINT_SAVED = """() => new Promise(function (resolve) {
+        var key = document.querySelector('.trimap-editor')._teState.imageKey;
+        var req = indexedDB.open('trimap-editor');
+        req.onsuccess = function () {
+            var get = req.result.transaction('checkpoints').objectStore('checkpoints').get(key);
+            get.onsuccess = function () { resolve(!!get.result && get.result.history.length > 1); };
+            get.onerror = function () { resolve(false); };
+        };
+        req.onerror = function () { resolve(false); };
+    })"""
+
+    def _wait_for_checkpoint(self, page: Page) -> None:
+        # wait_for_function() doesn't await promises, so poll with evaluate()
+        for _ in range(40):
+            if page.evaluate(self.JS_CHECKPOINT_SAVED):
+                return
+            page.wait_for_timeout(200)
+        msg = "No autosave checkpoint was written"
+        raise AssertionError(msg)
+
+    def test_masks_and_history_restored_after_reload(self, browser: Browser):
+        with gr.Blocks() as demo:
+            TrimapEditor(label="Editor")
+
+        with GradioApp(demo, browser) as page:
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+            _draw_strokes(page, block, 3)
+            self._wait_for_checkpoint(page)
+            drawn = drawn_trimap(page)
+
+            page.reload()
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            page.wait_for_function(
+                "() => document.querySelector('.trimap-editor')._teState.historyIndex === 3",
+                timeout=8000,
+            )
+            restored = drawn_trimap(page)
+            block.focus()
+            for _ in range(3):
+                page.keyboard.press("Control+z")
+            page.wait_for_timeout(100)
+            undone = drawn_trimap(page)
+
+        assert drawn.any()
+        np.testing.assert_array_equal(restored, drawn)
+        assert not undone.any()
+
+    def test_old_checkpoints_are_evicted(self, browser: Browser):
+        with gr.Blocks() as demo:
+            TrimapEditor(label="Editor")
+
+        # Other images' checkpoints saved 40 s to 1 s ago, each with a
+        # spilled delta, and one past the maximum age
+        js_seed = """() => new Promise(function (resolve) {
+            var req = indexedDB.open('trimap-editor');
+            req.onsuccess = function () {
+                var tx = req.result.transaction(['checkpoints', 'deltas'], 'readwrite');
+                for (var i = 1; i <= 40; i++) {
+                    tx.objectStore('checkpoints').put({ savedAt: Date.now() - 1000 * (41 - i) }, 'old-' + i);
+                    tx.objectStore('deltas').put([], ['old-' + i, 1]);
+                }
+                tx.objectStore('checkpoints').put({ savedAt: 0 }, 'ancient');
+                tx.oncomplete = function () { resolve(true); };
+            };
+        })"""
+        js_keys = """() => new Promise(function (resolve) {
+            var req = indexedDB.open('trimap-editor');
+            req.onsuccess = function () {
+                var tx = req.result.transaction(['checkpoints', 'deltas']);
+                var cps = tx.objectStore('checkpoints').getAllKeys();
+                var deltas = tx.objectStore('deltas').getAllKeys();
+                tx.oncomplete = function () {
+                    resolve([cps.result, deltas.result.map(function (k) { return k[0]; })]);
+                };
+            };
+        })"""
+
+        with GradioApp(demo, browser) as page:
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+            _draw_strokes(page, block, 2)
+            self._wait_for_checkpoint(page)
+            page.evaluate(js_seed)
+            _draw_strokes(page, block, 1)
+            key = page.evaluate("() => document.querySelector('.trimap-editor')._teState.imageKey")
+            for _ in range(40):
+                checkpoints, delta_keys = page.evaluate(js_keys)
+                if "ancient" not in checkpoints:
+                    break
+                page.wait_for_timeout(200)
+
+        assert key in checkpoints
+        assert len(checkpoints) == 32
+        # The most recently saved others survive, with their deltas
+        assert {f"old-{i}" for i in range(10, 41)} <= set(checkpoints)
+        assert "old-9" not in checkpoints
+        assert "old-9" not in delta_keys
+        assert "old-10" in delta_keys
+
+    def test_old_undo_steps_spill_and_read_back(self, browser: Browser):
+        with gr.Blocks() as demo:
+            TrimapEditor(label="Editor")
+
+        n = 20
+        with GradioApp(demo, browser) as page:
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+            box = block.locator(".te-canvas").bounding_box()
+            cx = box["x"] + box["width"] / 2
+            cy = box["y"] + box["height"] / 2
+            for i in range(n):
+                page.mouse.move(cx - 60, cy - 100 + i * 10)
+                page.mouse.down()
+                page.mouse.move(cx + 60, cy - 100 + i * 10, steps=2)
+                page.mouse.up()
+            page.wait_for_function(
+                """() => document.querySelector('.trimap-editor')._teState.history
+                    .some(function (e) { return e.spilled && e.tiles === null; })""",
+                timeout=8000,
+                polling=200,
+            )
+            spilled = page.evaluate(
+                """() => document.querySelector('.trimap-editor')._teState.history
+                    .filter(function (e) { return e.spilled; }).length"""
+            )
+            block.focus()
+            for _ in range(n):
+                page.keyboard.press("Control+z")
+                page.wait_for_timeout(30)
+            page.wait_for_function(
+                "() => document.querySelector('.trimap-editor')._teState.historyIndex === 0",
+                timeout=4000,
+            )
+            undone = drawn_trimap(page)
+
+        assert spilled == n - 16
+        assert not undone.any()
+
+    def test_strokes_log_spills_behind_a_keyframe(self, browser: Browser):
+        n = 20
+        with capture_committed(browser, value_format="strokes") as (page, read):
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+            box = block.locator(".te-canvas").bounding_box()
+            cx = box["x"] + box["width"] / 2
+            cy = box["y"] + box["height"] / 2
+            for i in range(n):
+                page.mouse.move(cx - 60, cy - 100 + i * 10)
+                page.mouse.down()
+                page.mouse.move(cx + 60, cy - 100 + i * 10, steps=2)
+                page.mouse.up()
+            page.wait_for_function(
+                """() => document.querySelector('.trimap-editor')._teState.history
+                    .some(function (e) { return e.spilled && e.tiles === null; })""",
+                timeout=8000,
+                polling=200,
+            )
+            value = json.loads(read())
+            drawn = drawn_trimap(page)
+
+            # Undo into the steps still resident after the keyframe
+            block.focus()
+            for _ in range(8):
+                page.keyboard.press("Control+z")
+            undone_value = json.loads(read())
+            undone = drawn_trimap(page)
+
+        ops = value["strokes"]["ops"]
+        assert ops[0]["op"] == "keyframe"
+        assert ops[0]["trimap"]
+        assert [op["op"] for op in ops[1:]] == ["stroke"] * 16
+        replayed = rasterize_strokes(value["strokes"], value["width"], value["height"])
+        np.testing.assert_array_equal(replayed, drawn)
+        replayed = rasterize_strokes(undone_value["strokes"], undone_value["width"], undone_value["height"])
+        np.testing.assert_array_equal(replayed, undone)
+        assert (undone != drawn).any()
+
+
+class TestDisplayLayers:
+    # The mask layer may be owned by a worker, so it is read through the renderer
+    JS_LAYER_PIXELS = """async (sel) => {
+        var el = document.querySelector('.trimap-editor');
+        if (sel === '.te-mask-layer') return await el._teReadMaskLayer();
+        var c = el.querySelector(sel);
+        return c.getContext('2d').getImageData(0, 0, c.width, c.height).data;
+    }"""
+
+    JS_LAYER_SUM = f"""async (sel) => {{
+        var d = await ({JS_LAYER_PIXELS})(sel);
+        var sum = 0;
+        for (var i = 0; i < d.length; i++) sum += d[i];
+        return sum;
+    }}"""
+
+    def test_hover_redraws_only_the_hud(self, demo_app: Page):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        _draw_strokes(demo_app, block, 1)
+        demo_app.wait_for_timeout(100)
+        content = demo_app.evaluate(self.JS_LAYER_SUM, ".te-canvas")
+        masks = demo_app.evaluate(self.JS_LAYER_SUM, ".te-mask-layer")
+        hud = demo_app.evaluate(self.JS_LAYER_SUM, ".te-hud-layer")
+
+        box = block.locator(".te-canvas").bounding_box()
+        demo_app.mouse.move(box["x"] + box["width"] / 2 + 40, box["y"] + box["height"] / 2 + 40, steps=5)
+        demo_app.wait_for_timeout(100)
+
+        assert masks > 0
+        assert demo_app.evaluate(self.JS_LAYER_SUM, ".te-canvas") == content
+        assert demo_app.evaluate(self.JS_LAYER_SUM, ".te-mask-layer") == masks
+        assert demo_app.evaluate(self.JS_LAYER_SUM, ".te-hud-layer") != hud
+
+    JS_LAYER_HASH = f"""async (sel) => {{
+        var d = await ({JS_LAYER_PIXELS})(sel);
+        var h = 0;
+        for (var i = 0; i < d.length; i++) h = (h * 31 + d[i]) | 0;
+        return h;
+    }}"""
+
+    def test_panned_frame_matches_full_redraw(self, demo_app: Page):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        _draw_strokes(demo_app, block, 2)
+        for _ in range(4):
+            demo_app.keyboard.press("=")
+
+        box = block.locator(".te-canvas").bounding_box()
+        cx = box["x"] + box["width"] / 2
+        cy = box["y"] + box["height"] / 2
+        demo_app.keyboard.down(" ")
+        demo_app.mouse.move(cx, cy)
+        demo_app.mouse.down()
+        demo_app.mouse.move(cx + 37, cy - 23, steps=6)
+        demo_app.mouse.up()
+        demo_app.keyboard.up(" ")
+        demo_app.wait_for_timeout(100)
+        scrolled = [demo_app.evaluate(self.JS_LAYER_HASH, sel) for sel in (".te-canvas", ".te-mask-layer")]
+
+        # Toggling the trimap view on and off redraws every layer in full
+        demo_app.keyboard.press("v")
+        demo_app.keyboard.press("v")
+        demo_app.wait_for_timeout(100)
+        redrawn = [demo_app.evaluate(self.JS_LAYER_HASH, sel) for sel in (".te-canvas", ".te-mask-layer")]
+        assert scrolled == redrawn
+
+    def test_zoomed_out_view_draws_from_pyramid(self, demo_app: Page, tmp_path: Path):
+        path = tmp_path / "large.png"
+        Image.fromarray(np.full((2400, 3000, 3), 90, dtype=np.uint8)).save(path)
+        block = get_editor_block(demo_app)
+        upload_image(block, path)
+        _draw_strokes(demo_app, block, 1)
+        demo_app.wait_for_timeout(100)
+        assert demo_app.evaluate("() => document.querySelector('.trimap-editor')._teState.zoom") < 0.5
+        assert demo_app.evaluate(self.JS_LAYER_SUM, ".te-mask-layer") > 0
+
+        # A stroke made while zoomed out refreshes the cached levels
+        masks = demo_app.evaluate(self.JS_LAYER_SUM, ".te-mask-layer")
+        box = block.locator(".te-canvas").bounding_box()
+        demo_app.mouse.move(box["x"] + box["width"] / 2 - 20, box["y"] + box["height"] / 2 + 20)
+        demo_app.mouse.down()
+        demo_app.mouse.move(box["x"] + box["width"] / 2 + 20, box["y"] + box["height"] / 2 + 20, steps=5)
+        demo_app.mouse.up()
+        demo_app.wait_for_timeout(100)
+        assert demo_app.evaluate(self.JS_LAYER_SUM, ".te-mask-layer") > masks
+
+
+class TestMaskRenderer:
+    JS_MASK_SUM = """async () => {
+        var d = await document.querySelector('.trimap-editor')._teReadMaskLayer();
+        var sum = 0;
+        for (var i = 0; i < d.length; i++) sum += d[i];
+        return sum;
+    }"""
+
+    JS_LAYER_TRANSFERRED = """() => {
+        try {
+            document.querySelector('.trimap-editor .te-mask-layer').getContext('2d');
+            return false;
+        } catch (e) {
+            return true;
+        }
+    }"""
+
+    def test_mask_layer_is_drawn_in_a_worker(self, demo_app: Page):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        _draw_strokes(demo_app, block, 1)
+        demo_app.wait_for_timeout(100)
+        assert demo_app.evaluate(self.JS_LAYER_TRANSFERRED)
+        assert demo_app.evaluate(self.JS_MASK_SUM) > 0
+
+    def test_runs_on_main_thread_without_offscreen_control(self, demo_app: Page):
+        demo_app.add_init_script("delete HTMLCanvasElement.prototype.transferControlToOffscreen;")
+        demo_app.reload()
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        _draw_strokes(demo_app, block, 1)
+        demo_app.wait_for_timeout(100)
+        assert not demo_app.evaluate(self.JS_LAYER_TRANSFERRED)
+        assert demo_app.evaluate(self.JS_MASK_SUM) > 0
+
+
+class TestMemoryRelease:
+    JS_CANVAS_WIDTHS = """() => {
+        var el = document.querySelector('.trimap-editor');
+        return [el.querySelector('.te-canvas').width, el._teTrimapViewCanvas.width, el._teCutoutCanvas.width];
+    }"""
+
+    JS_IN_VIEW = "(v) => document.querySelector('.trimap-editor')._teState.inView === v"
+
+    def test_remove_image_releases_canvases(self, demo_app: Page):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        _draw_strokes(demo_app, block, 1)
+        block.locator("#te-view-trimap-btn").click()
+        demo_app.wait_for_timeout(100)
+        assert all(demo_app.evaluate(self.JS_CANVAS_WIDTHS)[:2])
+
+        block.locator("#te-remove-btn").click()
+        demo_app.wait_for_timeout(100)
+        assert demo_app.evaluate(self.JS_CANVAS_WIDTHS) == [0, 0, 0]
+        assert demo_app.evaluate("() => document.querySelector('.trimap-editor')._teLabels.length") == 0
+        assert demo_app.evaluate(TestMaskRenderer.JS_MASK_SUM) == 0
+
+    def test_scrolled_out_editor_releases_and_restores(self, demo_app: Page):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        _draw_strokes(demo_app, block, 1)
+        demo_app.wait_for_timeout(100)
+        before = demo_app.evaluate(TestMaskRenderer.JS_MASK_SUM)
+        assert before > 0
+
+        demo_app.evaluate("() => { window._teImg = document.querySelector('.trimap-editor')._teState.image; }")
+        demo_app.evaluate("() => { document.body.style.paddingTop = '6000px'; }")
+        demo_app.wait_for_function(self.JS_IN_VIEW, arg=False)
+        assert demo_app.evaluate(self.JS_CANVAS_WIDTHS)[0] == 0
+        assert demo_app.evaluate(TestMaskRenderer.JS_MASK_SUM) == 0
+        # The decoded bitmap is closed; a stand-in keeps its size
+        assert demo_app.evaluate("() => window._teImg.width") == 0
+        assert demo_app.evaluate("() => document.querySelector('.trimap-editor')._teState.image.width") == 400
+
+        demo_app.evaluate("() => { document.body.style.paddingTop = ''; }")
+        demo_app.wait_for_function(self.JS_IN_VIEW, arg=True)
+        demo_app.wait_for_function(
+            "() => document.querySelector('.trimap-editor')._teState.image instanceof ImageBitmap"
+        )
+        demo_app.wait_for_timeout(200)
+        assert demo_app.evaluate(self.JS_CANVAS_WIDTHS)[0] > 0
+        assert demo_app.evaluate(TestMaskRenderer.JS_MASK_SUM) == before
+
+
+class TestImageDecoding:
+    JS_RECORD_WORKER_BLOBS = """
+        window._teWorkerBlobs = 0;
+        var post = Worker.prototype.postMessage;
+        Worker.prototype.postMessage = function (msg) {
+            if (msg && msg.blob instanceof Blob) window._teWorkerBlobs++;
+            return post.apply(this, arguments);
+        };
+    """
+
+    JS_HAS_FG = """() => {
+        var el = document.querySelector('.trimap-editor');
+        return !!el._teState.image && Array.prototype.some.call(el._teLabels, (v) => v === 2);
+    }"""
+
+    def _load_trimap_example(self, demo_app: Page) -> None:
+        gallery_items = demo_app.locator(".gallery .gallery-item")
+        expect(gallery_items.nth(1)).to_be_visible()
+        gallery_items.nth(1).click()
+        demo_app.wait_for_function(self.JS_HAS_FG, timeout=8000)
+
+    def test_removed_image_bitmap_is_closed(self, demo_app: Page):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        demo_app.evaluate("() => { window._teImg = document.querySelector('.trimap-editor')._teState.image; }")
+        assert demo_app.evaluate("() => window._teImg instanceof ImageBitmap && window._teImg.width > 0")
+        block.locator("#te-remove-btn").click()
+        assert demo_app.evaluate("() => window._teImg.width") == 0
+
+    def test_trimap_is_decoded_in_a_worker(self, demo_app: Page):
+        demo_app.add_init_script(self.JS_RECORD_WORKER_BLOBS)
+        demo_app.reload()
+        self._load_trimap_example(demo_app)
+        assert demo_app.evaluate("() => window._teWorkerBlobs") == 1
+
+    def test_decodes_on_main_thread_without_offscreen_canvas(self, demo_app: Page):
+        demo_app.add_init_script("delete window.OffscreenCanvas;" + self.JS_RECORD_WORKER_BLOBS)
+        demo_app.reload()
+        self._load_trimap_example(demo_app)
+        assert demo_app.evaluate("() => window._teWorkerBlobs") == 0
+
+
+class TestLocalTrimapFile:
+    JS_STRIPE_LABELS = """() => {
+        var el = document.querySelector('.trimap-editor');
+        var w = el._teState.image.width;
+        var y = el._teState.image.height >> 1;
+        return [1, 3, 5].map((k) => el._teLabels[y * w + Math.floor(w * k / 6)]);
+    }"""
+
+    JS_HAS_FG = TestImageDecoding.JS_HAS_FG
+
+    @staticmethod
+    def _stripes(path: Path, values: tuple[int, int, int]) -> Path:
+        arr = np.repeat(np.array(values, dtype=np.uint8), 40)[None, :].repeat(60, axis=0)
+        Image.fromarray(arr).save(path)
+        return path
+
+    def test_trimap_file_replaces_masks_as_one_undo_step(self, demo_app: Page, tmp_path: Path):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        block.locator("#te-trimap-input").set_input_files(self._stripes(tmp_path / "trimap.png", (0, 128, 255)))
+        demo_app.wait_for_function(self.JS_HAS_FG, timeout=5000)
+        assert demo_app.evaluate(self.JS_STRIPE_LABELS) == [0, 1, 2]
+
+        block.focus()
+        demo_app.keyboard.press("Control+z")
+        assert demo_app.evaluate(TestMorphology.JS_COUNTS)[1:] == [0, 0]
+
+    def test_alpha_matte_is_split_by_band(self, demo_app: Page, tmp_path: Path):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        block.locator("#te-trimap-input").set_input_files(self._stripes(tmp_path / "matte.png", (10, 90, 245)))
+        demo_app.wait_for_function(self.JS_HAS_FG, timeout=5000)
+        # 90 would be background as a trimap value; as alpha it is in the band
+        assert demo_app.evaluate(self.JS_STRIPE_LABELS) == [0, 1, 2]
+
+    def test_narrow_band_reads_near_trimap_values_as_alpha(self, browser: Browser, tmp_path: Path):
+        with gr.Blocks() as demo:
+            TrimapEditor(label="Editor", matte_band=(8, 248))
+
+        with GradioApp(demo, browser) as page:
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            block.locator("#te-trimap-input").set_input_files(self._stripes(tmp_path / "matte.png", (12, 128, 255)))
+            page.wait_for_function(self.JS_HAS_FG, timeout=5000)
+            # 12 passes for a trimap's 0 with the default band, not outside (8, 248)
+            labels = page.evaluate(self.JS_STRIPE_LABELS)
+
+        assert labels == [1, 1, 2]
+
+
+class TestMattePreview:
+    JS_MATTE_SETTLED = """() => {
+        var el = document.querySelector('.trimap-editor');
+        var c = el._teMatteCanvas;
+        if (!c.width) return false;
+        var d = c.getContext('2d').getImageData(0, 0, c.width, c.height).data;
+        var labels = el._teLabels;
+        var soft = 0;
+        for (var i = 0; i < labels.length; i++) {
+            var v = d[i * 4];
+            if ((labels[i] === 2 && v !== 255) || (labels[i] === 0 && v !== 0)) return false;
+            if (labels[i] === 1 && v !== 128) soft++;
+        }
+        return soft > 0;
+    }"""
+
+    def _load_trimap_example(self, demo_app: Page) -> None:
+        gallery_items = demo_app.locator(".gallery .gallery-item")
+        expect(gallery_items.nth(1)).to_be_visible()
+        gallery_items.nth(1).click()
+        demo_app.wait_for_function(TestImageDecoding.JS_HAS_FG, timeout=8000)
+
+    def test_matte_view_solves_the_unknown_band(self, demo_app: Page):
+        self._load_trimap_example(demo_app)
+        block = get_editor_block(demo_app)
+        block.focus()
+        demo_app.keyboard.press("a")
+        expect(block.locator("#te-view-matte-btn")).to_have_class(RE_ACTIVE)
+        demo_app.wait_for_function(self.JS_MATTE_SETTLED, timeout=8000)
+
+        demo_app.keyboard.press("v")
+        expect(block.locator("#te-view-matte-btn")).not_to_have_class(RE_ACTIVE)
+
+    def test_matte_refreshes_after_a_stroke(self, demo_app: Page):
+        self._load_trimap_example(demo_app)
+        block = get_editor_block(demo_app)
+        block.locator("#te-view-matte-btn").click()
+        demo_app.wait_for_function(self.JS_MATTE_SETTLED, timeout=8000)
+
+        # A foreground stroke into the background: settled again only once
+        # the matte shows 255 under it
+        box = block.locator(".te-canvas").bounding_box()
+        demo_app.mouse.move(box["x"] + 20, box["y"] + 20)
+        demo_app.mouse.down()
+        demo_app.mouse.move(box["x"] + 80, box["y"] + 20, steps=4)
+        demo_app.mouse.up()
+        demo_app.wait_for_function(self.JS_MATTE_SETTLED, timeout=8000)
+
+
+class TestPointerInput:
+    JS_LABEL_AT = """([cx, cy]) => {
+        var el = document.querySelector('.trimap-editor');
+        var s = el._teState;
+        var c = el.querySelector('.te-canvas').getBoundingClientRect();
+        var x = Math.floor((cx - c.left - s.panX) / s.zoom);
+        var y = Math.floor((cy - c.top - s.panY) / s.zoom);
+        return el._teLabels[y * s.image.width + x];
+    }"""
+
+    def test_dot_lands_under_cursor_after_layout_shift(self, demo_app: Page):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        canvas = block.locator(".te-canvas")
+        box = canvas.bounding_box()
+        demo_app.mouse.move(box["x"] + box["width"] / 2, box["y"] + box["height"] / 2)
+
+        # Moves the canvas without resizing it
+        demo_app.evaluate("() => { document.body.style.paddingTop = '120px'; }")
+        box = canvas.bounding_box()
+        x = box["x"] + box["width"] / 2 + 30
+        y = box["y"] + box["height"] / 2 - 20
+        demo_app.mouse.click(x, y)
+        demo_app.wait_for_timeout(400)
+        assert demo_app.evaluate(self.JS_LABEL_AT, [x, y]) > 0
+        assert demo_app.evaluate(self.JS_LABEL_AT, [x, y + 60]) == 0
+
+    def test_fast_stroke_is_gap_free(self, demo_app: Page):
+        block = get_editor_block(demo_app)
+        upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+        box = block.locator(".te-canvas").bounding_box()
+        cy = box["y"] + box["height"] / 2
+        x0 = box["x"] + box["width"] / 2 - 120
+        demo_app.mouse.move(x0, cy)
+        demo_app.mouse.down()
+        demo_app.mouse.move(x0 + 240, cy, steps=2)
+        demo_app.mouse.up()
+        demo_app.wait_for_timeout(100)
+        assert all(demo_app.evaluate(self.JS_LABEL_AT, [x0 + dx, cy]) > 0 for dx in range(0, 241, 8))
+
+
+class TestEncodeWorker:
+    JS_COUNT_WORKERS = """() => {
+        window.__teWorkers = 0;
+        var Native = window.Worker;
+        window.Worker = function (url, opts) { window.__teWorkers++; return new Native(url, opts); };
+    }"""
+
+    def _commit_and_read(self, browser: Browser, *setup_js: str) -> tuple[dict, np.ndarray, int]:
+        with capture_committed(browser, type="dict") as (page, read):
+            for js in setup_js:
+                page.evaluate(js)
+            block = get_editor_block(page)
+            upload_image(block, EXAMPLES_DIR / "red_circle.jpg")
+            wait_for_server_upload(page)
+            _draw_strokes(page, block, 3)
+            # Let the idle-time commit finish before reading
+            page.wait_for_function(
+                "() => { var s = document.querySelector('.trimap-editor')._teState;"
+                " return s.committedVersion === s.commitVersion; }"
+            )
+            drawn = drawn_trimap(page)
+            value = read()
+            workers = page.evaluate("() => window.__teWorkers || 0")
+
+        return value, drawn, workers
+
+    def test_png_commit_is_encoded_in_a_worker(self, browser: Browser):
+        value, drawn, workers = self._commit_and_read(browser, self.JS_COUNT_WORKERS)
+        assert workers == 1
+        assert (drawn > 0).any()
+        np.testing.assert_array_equal(decode_trimap(value), drawn)
+
+    def test_falls_back_without_offscreen_canvas(self, browser: Browser):
+        value, drawn, workers = self._commit_and_read(
+            browser, self.JS_COUNT_WORKERS, "() => { delete window.OffscreenCanvas; }"
+        )
+        assert workers == 0
+        np.testing.assert_array_equal(decode_trimap(value), drawn)